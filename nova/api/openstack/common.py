@@ -545,12 +545,27 @@ class ViewBuilder(object):
         3) 'limit' param is NOT specified but the number of items is
         CONF.osapi_max_limit.
         """
+        last_item = items[-1] if items else None
+        return self._get_collection_links_by_count(request, len(items),
+                                                   last_item,
+                                                   collection_name, id_key)
+
+    def _get_collection_links_by_count(self,
+                                       request,
+                                       item_count,
+                                       last_item,
+                                       collection_name,
+                                       id_key="uuid"):
+        """Retrieve 'next' link of a list of item_count items.
+
+        Same as _get_collection_links, for lists which are not held in
+        memory as a whole.
+        """
         links = []
         max_items = min(
             int(request.params.get("limit", CONF.osapi_max_limit)),
             CONF.osapi_max_limit)
-        if max_items and max_items == len(items):
-            last_item = items[-1]
+        if max_items and max_items == item_count:
             if id_key in last_item:
                 last_item_id = last_item[id_key]
             elif 'id' in last_item:
@@ -52,6 +52,13 @@ server_opts = [
                      ' or rescue, If the hypervisor does not support'
                      ' password injection then the password returned will'
                      ' not be correct'),
+    cfg.IntOpt('osapi_compute_server_list_page_size',
+               default=0,
+               help='Number of servers loaded per database query when '
+                    'listing servers. When set, longer JSON lists are '
+                    'loaded and sent one page at a time, which bounds the '
+                    'memory used to list many servers. 0 loads and sends '
+                    'each list at once'),
 ]
 CONF = cfg.CONF
 CONF.register_opts(server_opts)
@@ -594,12 +601,33 @@ class Controller(wsgi.Controller):
                 search_opts['user_id'] = context.user_id
 
         limit, marker = common.get_limit_and_marker(req)
+        page_size = CONF.osapi_compute_server_list_page_size
+        if page_size and limit > page_size:
+            return self._get_server_pages(req, search_opts, limit, marker,
+                                          is_detail)
+
+        instance_list = self._get_instance_list(context, search_opts, limit,
+                                                marker, is_detail)
+        if is_detail:
+            instance_list.fill_faults()
+            response = self._view_builder.detail(req, instance_list)
+        else:
+            response = self._view_builder.index(req, instance_list)
+        req.cache_db_instances(instance_list)
+        return response
+
+    def _get_instance_list(self, context, search_opts, limit, marker,
+                           is_detail):
+        """Returns a list of instances, for the servers list views."""
         try:
-            instance_list = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     limit=limit,
-                                                     marker=marker,
-                                                     want_objects=True)
+            # NOTE: the index view only shows the id and name of the
+            # servers, so none of their joined attributes are loaded.
+            return self.compute_api.get_all(context,
+                                            search_opts=search_opts,
+                                            limit=limit,
+                                            marker=marker,
+                                            want_objects=True,
+                                            default_attrs=is_detail)
         except exception.MarkerNotFound:
             msg = _('marker [%s] not found') % marker
             raise exc.HTTPBadRequest(explanation=msg)
@@ -607,15 +635,44 @@ class Controller(wsgi.Controller):
             log_msg = _("Flavor '%s' could not be found ")
             LOG.debug(log_msg, search_opts['flavor'])
             # TODO(mriedem): Move to ObjectListBase.__init__ for empty lists.
-            instance_list = instance_obj.InstanceList(objects=[])
+            return instance_obj.InstanceList(objects=[])
 
+    def _get_server_pages(self, req, search_opts, limit, marker, is_detail):
+        """Returns a list of servers, loaded and sent page by page."""
+        context = req.environ['nova.context']
+        page_size = CONF.osapi_compute_server_list_page_size
+
+        # NOTE: the next pages start from the last instance of the page
+        # before, which may have been deleted since it was loaded.
+        next_search_opts = dict(search_opts, deleted_marker=True)
+
+        def instance_pages(instance_list):
+            remaining = limit
+            while True:
+                if is_detail:
+                    instance_list.fill_faults()
+                req.cache_db_instances(instance_list)
+                yield instance_list
+
+                remaining -= len(instance_list)
+                if len(instance_list) < page_size or remaining <= 0:
+                    return
+                instance_list = self._get_instance_list(
+                        context, next_search_opts, min(remaining, page_size),
+                        instance_list[-1].uuid, is_detail)
+
+        # NOTE: the first page is loaded right away, so that an invalid
+        # marker is still reported before the response is started.
+        instance_list = self._get_instance_list(context, search_opts,
+                                                min(limit, page_size),
+                                                marker, is_detail)
         if is_detail:
-            instance_list.fill_faults()
-            response = self._view_builder.detail(req, instance_list)
+            pages, links = self._view_builder.paged_detail(
+                    req, instance_pages(instance_list))
         else:
-            response = self._view_builder.index(req, instance_list)
-        req.cache_db_instances(instance_list)
-        return response
+            pages, links = self._view_builder.paged_index(
+                    req, instance_pages(instance_list))
+        return wsgi.StreamingResponseObject('servers', pages, links)
 
     def _get_server(self, context, req, instance_uuid):
         """Utility function for looking up an instance by uuid."""
@@ -134,6 +134,40 @@ class ViewBuilder(common.ViewBuilder):
 
         return servers_dict
 
+    def paged_index(self, request, instance_pages):
+        """Show a list of servers without many details, page by page."""
+        return self._paged_list_view(self.basic, request, instance_pages)
+
+    def paged_detail(self, request, instance_pages):
+        """Detailed view of a list of instances, page by page."""
+        return self._paged_list_view(self.show, request, instance_pages)
+
+    def _paged_list_view(self, func, request, instance_pages):
+        """Provide a view for a list of servers loaded page by page.
+
+        Returns a generator of the lists of servers of each page, and a
+        function returning the servers links once all the pages were
+        generated.
+        """
+        state = {'count': 0, 'last': None}
+
+        def pages():
+            for instances in instance_pages:
+                server_list = [func(request, server)["server"]
+                               for server in instances]
+                if server_list:
+                    state['count'] += len(server_list)
+                    state['last'] = server_list[-1]
+                yield server_list
+
+        def links():
+            return self._get_collection_links_by_count(request,
+                                                       state['count'],
+                                                       state['last'],
+                                                       self._collection_name)
+
+        return pages(), links
+
     @staticmethod
     def _get_metadata(instance):
         # FIXME(danms): Transitional support for objects
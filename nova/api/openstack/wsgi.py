@@ -25,6 +25,7 @@ import webob
 
 from nova.api.openstack import xmlutil
 from nova import exception
+from nova.openstack.common import excutils
 from nova.openstack.common import gettextutils
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import jsonutils
@@ -105,6 +106,10 @@ class Request(webob.Request):
         """
         return self.get_db_items(key).get(item_key)
 
+    def clear_db_items(self):
+        """Drop every object stored with cache_db_items()."""
+        self._extension_data['db_items'] = {}
+
     def cache_db_instances(self, instances):
         self.cache_db_items('instances', instances, 'uuid')
 
@@ -635,6 +640,49 @@ class ResponseObject(object):
         return self._headers.copy()
 
 
+class StreamingResponseObject(ResponseObject):
+    """Bundles a collection built one page at a time with serializers.
+
+    pages is an iterable of lists of items of the collection_name list,
+    and links, if given, is called once all the pages were consumed to
+    return the <collection_name>_links list.  JSON responses are written
+    one page at a time through the WSGI iterable, the post-processing
+    extensions being run on each page in turn, so that only one page is
+    held in memory.  Other content types, and methods with generator
+    extensions which can't be run more than once, get the collection
+    loaded as a whole in obj before being serialized.
+    """
+
+    def __init__(self, collection_name, pages, links=None, code=None,
+                 headers=None, **serializers):
+        super(StreamingResponseObject, self).__init__(None, code=code,
+                                                      headers=headers,
+                                                      **serializers)
+        self.collection_name = collection_name
+        self.pages = pages
+        self.links = links
+
+    def can_stream(self, extensions):
+        """Whether the response can be written one page at a time."""
+        if self.media_type != 'json':
+            return False
+        return not any(inspect.isgenerator(ext) for ext in extensions)
+
+    def get_links(self):
+        """Return the links of the collection, once it was consumed."""
+        return self.links() if self.links else None
+
+    def load(self):
+        """Load the whole collection in obj."""
+        items = []
+        for page in self.pages:
+            items.extend(page)
+        self.obj = {self.collection_name: items}
+        links = self.get_links()
+        if links:
+            self.obj['%s_links' % self.collection_name] = links
+
+
 def action_peek_json(body):
     """Determine action to invoke."""
 
@@ -1004,6 +1052,14 @@ class Resource(wsgi.Application):
                     resp_obj._default_code = meth.wsgi_code
                 resp_obj.preserialize(accept, self.default_serializers)
 
+                if isinstance(resp_obj, StreamingResponseObject):
+                    post = list(post)
+                    if resp_obj.can_stream(post):
+                        return self._stream_response(resp_obj, post, request,
+                                                     action_args, accept,
+                                                     context)
+                    resp_obj.load()
+
                 # Process post-processing extensions
                 response = self.post_process_extensions(post, resp_obj,
                                                         request, action_args)
@@ -1023,6 +1079,55 @@ class Resource(wsgi.Application):
 
         return response
 
+    def _stream_response(self, resp_obj, extensions, request, action_args,
+                         content_type, context):
+        """Serialize a StreamingResponseObject one page at a time."""
+        response = webob.Response()
+        response.status_int = resp_obj.code
+        for hdr, value in resp_obj.headers.items():
+            response.headers[hdr] = utils.utf8(str(value))
+        response.headers['Content-Type'] = utils.utf8(content_type)
+        if context:
+            response.headers['x-compute-request-id'] = utils.utf8(
+                    context.request_id)
+        response.app_iter = self._stream_pages(resp_obj, extensions,
+                                               request, action_args)
+        return response
+
+    def _stream_pages(self, resp_obj, extensions, request, action_args):
+        """Generate the JSON body of a StreamingResponseObject."""
+        collection_name = resp_obj.collection_name
+        separator = ''
+        yield '{%s: [' % jsonutils.dumps(collection_name)
+        try:
+            for page in resp_obj.pages:
+                resp_obj.obj = {collection_name: page}
+                if self.post_process_extensions(extensions, resp_obj,
+                                                request, action_args):
+                    # NOTE: the status was already sent, so an extension
+                    # can't replace the response any more.
+                    raise exception.NovaException(
+                            _("An extension failed to process the %s "
+                              "response") % collection_name)
+                if page:
+                    yield separator + ', '.join(jsonutils.dumps(item)
+                                                for item in page)
+                    separator = ', '
+                resp_obj.obj = None
+                request.clear_db_items()
+
+            links = resp_obj.get_links()
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                LOG.exception(_("Failed to stream the %s response"),
+                              collection_name)
+        if links:
+            yield '], %s: %s}' % (jsonutils.dumps('%s_links' %
+                                                  collection_name),
+                                  jsonutils.dumps(links))
+        else:
+            yield ']}'
+
     def get_method(self, request, action, content_type, body):
         meth, extensions = self._get_method(request,
                                             action,
@@ -650,11 +650,16 @@ class VmCommands(object):
                                              _('zone'),
                                              _('index'))))
 
-        if host is None:
-            instances = db.instance_get_all(context.get_admin_context())
-        else:
-            instances = db.instance_get_all_by_host(
-                           context.get_admin_context(), host)
+        filters = {'deleted': False, 'soft_deleted': True}
+        if host is not None:
+            filters['host'] = host
+        # Only load the columns shown, and the flavor from system_metadata
+        instances = db.instance_get_all_by_filters(
+                context.get_admin_context(), filters,
+                columns=['display_name', 'host', 'vm_state', 'launched_at',
+                         'image_ref', 'kernel_id', 'ramdisk_id', 'project_id',
+                         'user_id', 'availability_zone', 'launch_index'],
+                columns_to_join=['system_metadata'])
 
         for instance in instances:
             instance_type = flavors.extract_flavor(instance)
@@ -890,7 +895,14 @@ class DbCommands(object):
 
     @args('--max_rows', metavar='<number>',
             help='Maximum number of deleted rows to archive')
-    def archive_deleted_rows(self, max_rows):
+    @args('--batch_size', metavar='<number>', default=1000,
+            help='Number of rows archived per transaction')
+    @args('--batch_delay', metavar='<seconds>', default=0,
+            help='Time to wait between two batches of a table')
+    @args('--workers', metavar='<number>', default=1,
+            help='Number of tables archived at once')
+    def archive_deleted_rows(self, max_rows, batch_size=1000, batch_delay=0,
+                             workers=1):
         """Move up to max_rows deleted rows from production tables to shadow
         tables.
         """
@@ -899,8 +911,26 @@ class DbCommands(object):
             if max_rows < 0:
                 print(_("Must supply a positive value for max_rows"))
                 return(1)
+        batch_size = int(batch_size)
+        workers = int(workers)
+        if batch_size <= 0 or workers <= 0:
+            print(_("Must supply a positive value for batch_size and "
+                    "workers"))
+            return(1)
+
+        def progress(tablename, rows, seconds):
+            if rows:
+                print(_("%(table)s: %(rows)d rows archived in %(seconds).1f "
+                        "seconds (%(rate).1f rows/s)") %
+                      {'table': tablename, 'rows': rows, 'seconds': seconds,
+                       'rate': rows / max(seconds, 0.001)})
+
         admin_context = context.get_admin_context()
-        db.archive_deleted_rows(admin_context, max_rows)
+        rows = db.archive_deleted_rows(admin_context, max_rows,
+                                       batch_size=batch_size,
+                                       batch_delay=float(batch_delay),
+                                       workers=workers, progress=progress)
+        print(_("%d rows archived") % rows)
 
 
 class FlavorCommands(object):
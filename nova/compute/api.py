@@ -71,6 +71,7 @@ from nova.openstack.common import uuidutils
 import nova.policy
 from nova import quota
 from nova import rpc
+from nova.scheduler import rpcapi as scheduler_rpcapi
 from nova import servicegroup
 from nova import utils
 from nova import volume
@@ -1815,7 +1816,7 @@ class API(base.Base):
 
     def get_all(self, context, search_opts=None, sort_key='created_at',
                 sort_dir='desc', limit=None, marker=None, want_objects=False,
-                expected_attrs=None):
+                expected_attrs=None, default_attrs=True):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -1827,6 +1828,10 @@ class API(base.Base):
         The results will be returned sorted in the order specified by the
         'sort_dir' parameter using the key specified in the 'sort_key'
         parameter.
+
+        The metadata, system metadata, info cache and security groups of the
+        instances are loaded with them, as well as expected_attrs, unless
+        default_attrs is False.
         """
 
         #TODO(bcwaldon): determine the best argument for target here
@@ -1888,7 +1893,7 @@ class API(base.Base):
 
         inst_models = self._get_instances_by_filters(context, filters,
                 sort_key, sort_dir, limit=limit, marker=marker,
-                expected_attrs=expected_attrs)
+                expected_attrs=expected_attrs, default_attrs=default_attrs)
 
         if want_objects:
             return inst_models
@@ -1903,7 +1908,8 @@ class API(base.Base):
     def _get_instances_by_filters(self, context, filters,
                                   sort_key, sort_dir,
                                   limit=None,
-                                  marker=None, expected_attrs=None):
+                                  marker=None, expected_attrs=None,
+                                  default_attrs=True):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1912,8 +1918,10 @@ class API(base.Base):
             uuids = set([r['instance_uuid'] for r in res])
             filters['uuid'] = uuids
 
-        fields = ['metadata', 'system_metadata', 'info_cache',
-                  'security_groups']
+        fields = []
+        if default_attrs:
+            fields = ['metadata', 'system_metadata', 'info_cache',
+                      'security_groups']
         if expected_attrs:
             fields.extend(expected_attrs)
         return instance_obj.InstanceList.get_by_filters(
@@ -3280,6 +3288,7 @@ class AggregateAPI(base.Base):
     """Sub-set of the Compute Manager API for managing host aggregates."""
     def __init__(self, **kwargs):
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
+        self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
         super(AggregateAPI, self).__init__(**kwargs)
 
     @wrap_exception()
@@ -3341,6 +3350,7 @@ class AggregateAPI(base.Base):
         # which stored availability_zones and host need to be reset
         if values.get('availability_zone'):
             availability_zones.reset_cache()
+        self.scheduler_rpcapi.aggregates_changed(context)
         return self._reformat_aggregate_info(aggregate)
 
     @wrap_exception()
@@ -3354,6 +3364,7 @@ class AggregateAPI(base.Base):
         # which stored availability_zones and host need to be reset
         if metadata and metadata.get('availability_zone'):
             availability_zones.reset_cache()
+        self.scheduler_rpcapi.aggregates_changed(context)
         return aggregate
 
     @wrap_exception()
@@ -3422,6 +3433,7 @@ class AggregateAPI(base.Base):
         #NOTE(jogo): Send message to host to support resource pools
         self.compute_rpcapi.add_aggregate_host(context,
                 aggregate=aggregate, host_param=host_name, host=host_name)
+        self.scheduler_rpcapi.aggregates_changed(context)
         aggregate_payload.update({'name': aggregate['name']})
         compute_utils.notify_about_aggregate_update(context,
                                                     "addhost.end",
@@ -3443,6 +3455,7 @@ class AggregateAPI(base.Base):
         self._update_az_cache_for_host(context, host_name, aggregate.metadata)
         self.compute_rpcapi.remove_aggregate_host(context,
                 aggregate=aggregate, host_param=host_name, host=host_name)
+        self.scheduler_rpcapi.aggregates_changed(context)
         compute_utils.notify_about_aggregate_update(context,
                                                     "removehost.end",
                                                     aggregate_payload)
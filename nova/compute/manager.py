@@ -34,6 +34,7 @@ import time
 import traceback
 import uuid
 
+import eventlet
 import eventlet.event
 from eventlet import greenthread
 import eventlet.timeout
@@ -131,10 +132,27 @@ interval_opts = [
                default=600,
                help='Interval to sync power states between '
                     'the database and the hypervisor'),
+    cfg.IntOpt('sync_power_state_event_interval',
+               default=0,
+               help='Interval to sync power states between the database '
+                    'and hypervisors which report instance lifecycle '
+                    'events. These events already keep the power states in '
+                    'sync, so it can be much longer than '
+                    'sync_power_state_interval. Set to 0 to use '
+                    'sync_power_state_interval'),
     cfg.IntOpt("heal_instance_info_cache_interval",
                default=60,
                help="Number of seconds between instance info_cache self "
                     "healing updates"),
+    cfg.IntOpt("heal_instance_info_cache_batch_size",
+               default=5,
+               help="Number of instances whose info_cache is refreshed on "
+                    "each self healing update, starting with the instances "
+                    "whose info_cache was refreshed least recently"),
+    cfg.IntOpt("heal_instance_info_cache_workers",
+               default=2,
+               help="Maximum number of instance info_caches refreshed "
+                    "concurrently by each self healing update"),
     cfg.IntOpt('reclaim_instance_interval',
                default=0,
                help='Interval in seconds for reclaiming deleted instances'),
@@ -224,6 +242,16 @@ get_notifier = functools.partial(rpc.get_notifier, service='compute')
 wrap_exception = functools.partial(exception.wrap_exception,
                                    get_notifier=get_notifier)
 
+# The power states _sync_instance_power_state leaves alone for each
+# vm_state, once the database has the power state of the hypervisor.
+_IN_SYNC_POWER_STATES = {
+    vm_states.ACTIVE: (power_state.RUNNING,),
+    vm_states.STOPPED: (power_state.NOSTATE,
+                        power_state.SHUTDOWN,
+                        power_state.CRASHED),
+    vm_states.PAUSED: (power_state.PAUSED,),
+}
+
 
 @utils.expects_func_args('migration')
 def errors_out_migration(function):
@@ -576,6 +604,7 @@ class ComputeManager(manager.Manager):
         self._last_bw_usage_poll = 0
         self._bw_usage_supported = True
         self._last_bw_usage_cell_update = 0
+        self._last_power_state_sync = 0
         self.compute_api = compute.API()
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
         self.conductor_api = conductor.API()
@@ -1118,8 +1147,8 @@ class ComputeManager(manager.Manager):
         """This call passes straight through to the virtualization driver."""
         return self.driver.refresh_provider_fw_rules()
 
-    def _get_instance_nw_info(self, context, instance, use_slave=False):
-        """Get a list of dictionaries of network data of an instance."""
+    def _get_instance_with_system_metadata(self, context, instance,
+                                           use_slave=False):
         if (not hasattr(instance, 'system_metadata') or
                 len(instance['system_metadata']) == 0):
             # NOTE(danms): Several places in the code look up instances without
@@ -1130,11 +1159,23 @@ class ComputeManager(manager.Manager):
             instance = instance_obj.Instance.get_by_uuid(context,
                                                          instance['uuid'],
                                                          use_slave=use_slave)
+        return instance
 
+    def _get_instance_nw_info(self, context, instance, use_slave=False):
+        """Get a list of dictionaries of network data of an instance."""
+        instance = self._get_instance_with_system_metadata(
+            context, instance, use_slave=use_slave)
         network_info = self.network_api.get_instance_nw_info(context,
                                                              instance)
         return network_info
 
+    def _get_instances_nw_info(self, context, instances, use_slave=False):
+        """Get the network info of several instances at once."""
+        instances = [self._get_instance_with_system_metadata(
+                         context, instance, use_slave=use_slave)
+                     for instance in instances]
+        return self.network_api.get_instances_nw_info(context, instances)
+
     def _await_block_device_map_created(self, context, vol_id, max_tries=180,
                                         wait_between=1):
         # TODO(yamahata): creating volume simultaneously
@@ -4817,90 +4858,96 @@ class ComputeManager(manager.Manager):
         spacing=CONF.heal_instance_info_cache_interval)
     def _heal_instance_info_cache(self, context):
         """Called periodically.  On every call, try to update the
-        info_cache's network information for another instance by
-        calling to the network manager.
+        info_cache's network information for the next
+        heal_instance_info_cache_batch_size instances by calling to the
+        network manager.
 
         This is implemented by keeping a cache of uuids of instances
-        that live on this host.  On each call, we pop one off of a
-        list, pull the DB record, and try the call to the network API.
-        If anything errors don't fail, as it's possible the instance
-        has been deleted, etc.
+        that live on this host, sorted so that the instances whose
+        info_cache was refreshed least recently come first.  Only the uuids
+        are loaded when the list is rebuilt.  On each call, we take a batch
+        off of the list, pull the DB records, and try the calls to the
+        network API using at most heal_instance_info_cache_workers
+        greenthreads.  If anything errors don't fail, as it's possible the
+        instance has been deleted, etc.
         """
         heal_interval = CONF.heal_instance_info_cache_interval
         if not heal_interval:
             return
 
+        batch_size = max(CONF.heal_instance_info_cache_batch_size, 1)
         instance_uuids = getattr(self, '_instance_uuids_to_heal', [])
-        instance = None
+        instances = []
 
         LOG.debug(_('Starting heal instance info cache'))
 
         if not instance_uuids:
-            # The list of instances to heal is empty so rebuild it
+            # The list of instances to heal is empty so rebuild it. We
+            # don't want to refresh the cache for instances which are
+            # building or deleting, so they are left out. If they are
+            # building they will get added to the list next time we build
+            # it.
             LOG.debug(_('Rebuilding the list of instances to heal'))
-            db_instances = instance_obj.InstanceList.get_by_host(
-                context, self.host, expected_attrs=[], use_slave=True)
-            for inst in db_instances:
-                # We don't want to refersh the cache for instances
-                # which are building or deleting so don't put them
-                # in the list. If they are building they will get
-                # added to the list next time we build it.
-                if (inst.vm_state == vm_states.BUILDING):
-                    LOG.debug(_('Skipping network cache update for instance '
-                                'because it is Building.'), instance=inst)
-                    continue
-                if (inst.task_state == task_states.DELETING):
-                    LOG.debug(_('Skipping network cache update for instance '
-                                'because it is being deleted.'), instance=inst)
-                    continue
-
-                if not instance:
-                    # Save the first one we find so we don't
-                    # have to get it again
-                    instance = inst
-                else:
-                    instance_uuids.append(inst['uuid'])
-
+            instance_uuids = (
+                instance_obj.InstanceList.get_uuids_by_info_cache_age(
+                    context, self.host, use_slave=True))
             self._instance_uuids_to_heal = instance_uuids
-        else:
-            # Find the next valid instance on the list
-            while instance_uuids:
-                try:
-                    inst = instance_obj.Instance.get_by_uuid(
-                            context, instance_uuids.pop(0),
-                            expected_attrs=['system_metadata', 'info_cache'],
-                            use_slave=True)
-                except exception.InstanceNotFound:
-                    # Instance is gone.  Try to grab another.
-                    continue
 
+        # Find the next valid instances on the list
+        while instance_uuids and len(instances) < batch_size:
+            uuids = instance_uuids[:batch_size - len(instances)]
+            del instance_uuids[:len(uuids)]
+            db_instances = instance_obj.InstanceList.get_by_filters(
+                    context, {'uuid': uuids},
+                    expected_attrs=['system_metadata', 'info_cache'],
+                    use_slave=True)
+            # Instances which are gone are simply not returned.
+            db_instances = dict((inst.uuid, inst) for inst in db_instances)
+            for uuid in uuids:
+                inst = db_instances.get(uuid)
+                if inst is None:
+                    continue
                 # Check the instance hasn't been migrated
                 if inst.host != self.host:
-                    LOG.debug(_('Skipping network cache update for instance '
-                                'because it has been migrated to another '
-                                'host.'), instance=inst)
+                    LOG.debug(_('Skipping network cache update for '
+                                'instance because it has been migrated '
+                                'to another host.'), instance=inst)
                 # Check the instance isn't being deleting
                 elif inst.task_state == task_states.DELETING:
-                    LOG.debug(_('Skipping network cache update for instance '
-                                'because it is being deleted.'), instance=inst)
+                    LOG.debug(_('Skipping network cache update for '
+                                'instance because it is being deleted.'),
+                              instance=inst)
                 else:
-                    instance = inst
-                    break
+                    instances.append(inst)
 
-        if instance:
-            # We have an instance now to refresh
+        if not instances:
+            LOG.debug(_("Didn't find any instances for network info cache "
+                        "update."))
+            return
+
+        def _heal_instances(instances):
             try:
-                # Call to network API to get instance info.. this will
-                # force an update to the instance's info_cache
-                self._get_instance_nw_info(context, instance, use_slave=True)
-                LOG.debug(_('Updated the network info_cache for instance'),
-                          instance=instance)
+                # Call to network API to get instances info.. this will
+                # force an update to the instances' info_caches
+                nw_infos = self._get_instances_nw_info(context, instances,
+                                                       use_slave=True)
+                for instance, nw_info in zip(instances, nw_infos):
+                    if nw_info is not None:
+                        LOG.debug(_('Updated the network info_cache for '
+                                    'instance'), instance=instance)
             except Exception:
+                uuids = ', '.join(instance['uuid'] for instance in instances)
                 LOG.error(_('An error occurred while refreshing the network '
-                            'cache.'), instance=instance, exc_info=True)
-        else:
-            LOG.debug(_("Didn't find any instances for network info cache "
-                        "update."))
+                            'cache of instances %s.'), uuids, exc_info=True)
+
+        # Split the instances between the workers, so that network APIs
+        # which refresh several instances at once can do so in bulk.
+        workers = min(max(CONF.heal_instance_info_cache_workers, 1),
+                      len(instances))
+        pool = eventlet.GreenPool(workers)
+        for i in range(workers):
+            pool.spawn_n(_heal_instances, instances[i::workers])
+        pool.waitall()
 
     @periodic_task.periodic_task
     def _poll_rebooting_instances(self, context):
@@ -5228,12 +5275,29 @@ class ComputeManager(manager.Manager):
         number of virtual machines known by the database, we proceed in a lazy
         loop, one database record at a time, checking if the hypervisor has the
         same power state as is in the database.
+
+        When the driver can return the power states of all its instances at
+        once, the instances whose power state already matches are skipped
+        without being queried again.
         """
+        if (CONF.sync_power_state_event_interval > 0 and
+                self.driver.capabilities.get('emits_lifecycle_events')):
+            curr_time = time.time()
+            if (curr_time - self._last_power_state_sync <
+                    CONF.sync_power_state_event_interval):
+                return
+            self._last_power_state_sync = curr_time
+
         db_instances = instance_obj.InstanceList.get_by_host(context,
                                                              self.host,
                                                              use_slave=True)
 
-        num_vm_instances = self.driver.get_num_instances()
+        try:
+            vm_power_states = self.driver.get_power_states()
+            num_vm_instances = len(vm_power_states)
+        except NotImplementedError:
+            vm_power_states = None
+            num_vm_instances = self.driver.get_num_instances()
         num_db_instances = len(db_instances)
 
         if num_vm_instances != num_db_instances:
@@ -5251,11 +5315,18 @@ class ComputeManager(manager.Manager):
                 continue
             # No pending tasks. Now try to figure out the real vm_power_state.
             try:
-                try:
-                    vm_instance = self.driver.get_info(db_instance)
-                    vm_power_state = vm_instance['state']
-                except exception.InstanceNotFound:
-                    vm_power_state = power_state.NOSTATE
+                if vm_power_states is not None:
+                    vm_power_state = vm_power_states.get(db_instance.uuid,
+                                                         power_state.NOSTATE)
+                    if self._power_state_in_sync(db_instance,
+                                                 vm_power_state):
+                        continue
+                else:
+                    try:
+                        vm_instance = self.driver.get_info(db_instance)
+                        vm_power_state = vm_instance['state']
+                    except exception.InstanceNotFound:
+                        vm_power_state = power_state.NOSTATE
                 # Note(maoy): the above get_info call might take a long time,
                 # for example, because of a broken libvirt driver.
                 try:
@@ -5272,6 +5343,16 @@ class ComputeManager(manager.Manager):
                                 "while processing an instance."),
                                 instance=db_instance)
 
+    @staticmethod
+    def _power_state_in_sync(db_instance, vm_power_state):
+        """Whether _sync_instance_power_state has nothing to do for an
+        instance, judging from the instance as last read from the database.
+        """
+        if db_instance.power_state != vm_power_state:
+            return False
+        return vm_power_state in _IN_SYNC_POWER_STATES.get(
+                db_instance.vm_state, ())
+
     def _sync_instance_power_state(self, context, db_instance, vm_power_state,
                                    use_slave=False):
         """Align instance power state between the database and hypervisor.
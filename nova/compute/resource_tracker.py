@@ -37,6 +37,7 @@ from nova.openstack.common.gettextutils import _
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova.pci import pci_manager
 from nova import rpc
 from nova import utils
@@ -48,7 +49,13 @@ resource_tracker_opts = [
                help='Amount of memory in MB to reserve for the host'),
     cfg.StrOpt('compute_stats_class',
                default='nova.compute.stats.Stats',
-               help='Class that will manage stats for the local compute host')
+               help='Class that will manage stats for the local compute host'),
+    cfg.IntOpt('compute_node_full_update_interval', default=300,
+               help='Number of seconds between updates of the compute node '
+                    'record which send all of its fields. In between, only '
+                    'the fields which changed since the previous update are '
+                    'sent, or none but the update time when none changed. A '
+                    'value of 0 sends all the fields on every update.'),
 ]
 
 CONF = cfg.CONF
@@ -57,6 +64,10 @@ CONF.register_opts(resource_tracker_opts)
 LOG = logging.getLogger(__name__)
 COMPUTE_RESOURCE_SEMAPHORE = "compute_resources"
 
+# Fields of the compute node record which are set by the database and
+# never compared with the values last sent.
+_DB_MANAGED_FIELDS = ('created_at', 'updated_at', 'deleted_at', 'deleted')
+
 CONF.import_opt('my_ip', 'nova.netconf')
 
 
@@ -71,6 +82,9 @@ class ResourceTracker(object):
         self.pci_tracker = None
         self.nodename = nodename
         self.compute_node = None
+        # values of the compute node record as of the last update sent
+        self._sent_values = None
+        self._last_full_update = None
         self.stats = importutils.import_object(CONF.compute_stats_class)
         self.tracked_instances = {}
         self.tracked_migrations = {}
@@ -359,6 +373,7 @@ class ResourceTracker(object):
                 for cn in compute_node_refs:
                     if cn.get('hypervisor_hostname') == self.nodename:
                         self.compute_node = cn
+                        self._sent_values = None
                         if self.pci_tracker:
                             self.pci_tracker.set_compute_node_id(cn['id'])
                         break
@@ -383,6 +398,8 @@ class ResourceTracker(object):
         # initialize load stats from existing instances:
         self.compute_node = self.conductor_api.compute_node_create(context,
                                                                    values)
+        self._sent_values = self._get_comparable_values(values)
+        self._last_full_update = timeutils.utcnow()
 
     def _get_service(self, context):
         try:
@@ -441,12 +458,43 @@ class ResourceTracker(object):
         if 'pci_devices' in resources:
             LOG.audit(_("Free PCI devices: %s") % resources['pci_devices'])
 
+    def _get_comparable_values(self, values):
+        return dict((key, value) for key, value in values.iteritems()
+                    if key not in _DB_MANAGED_FIELDS and key != 'service')
+
+    def _full_update_due(self):
+        interval = CONF.compute_node_full_update_interval
+        return (interval <= 0 or self._sent_values is None or
+                self._last_full_update is None or
+                timeutils.is_older_than(self._last_full_update, interval))
+
     def _update(self, context, values):
-        """Persist the compute node updates to the DB."""
+        """Persist the compute node updates to the DB.
+
+        Only the fields which changed since the previous update are sent,
+        except every compute_node_full_update_interval seconds, when all
+        of them are. The update is sent even when nothing changed, so that
+        the updated_at field of the compute node, which the schedulers
+        rely on, is kept current.
+        """
         if "service" in self.compute_node:
             del self.compute_node['service']
+        current = self._get_comparable_values(values)
+        full_update = self._full_update_due()
+        if full_update:
+            updates = dict(current)
+        else:
+            updates = dict((key, value) for key, value in current.iteritems()
+                           if key not in self._sent_values or
+                           self._sent_values[key] != value)
+
         self.compute_node = self.conductor_api.compute_node_update(
-            context, self.compute_node, values)
+            context, self.compute_node, updates)
+        if full_update:
+            self._sent_values = current
+            self._last_full_update = timeutils.utcnow()
+        else:
+            self._sent_values.update(current)
         if self.pci_tracker:
             self.pci_tracker.save(context)
 
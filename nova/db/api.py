@@ -194,6 +194,24 @@ def compute_node_get_all(context, no_date_fields=False):
     return IMPL.compute_node_get_all(context, no_date_fields)
 
 
+def compute_node_get_all_changed_since(context, changed_since):
+    """Get computeNodes created, updated or deleted since a point in time.
+
+    :param context: The security context
+    :param changed_since: Datetime; only compute nodes whose created_at,
+                          updated_at or deleted_at is not older than this
+                          are returned
+
+    :returns: Tuple of the list of dictionaries each containing compute
+              node properties, including corresponding service, and of the
+              list of all the nova-compute services. Unlike
+              compute_node_get_all, soft-deleted compute nodes are included
+              so that callers caching compute nodes can notice their
+              removal.
+    """
+    return IMPL.compute_node_get_all_changed_since(context, changed_since)
+
+
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     """Get compute nodes by hypervisor hostname.
 
@@ -651,13 +669,18 @@ def instance_get_all(context, columns_to_join=None):
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
                                 sort_dir='desc', limit=None, marker=None,
-                                columns_to_join=None, use_slave=False):
-    """Get all instances that match all filters."""
+                                columns_to_join=None, use_slave=False,
+                                columns=None):
+    """Get all instances that match all filters.
+
+    If columns is given, only load these columns and return dicts.
+    """
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
                                             sort_dir, limit=limit,
                                             marker=marker,
                                             columns_to_join=columns_to_join,
-                                            use_slave=use_slave)
+                                            use_slave=use_slave,
+                                            columns=columns)
 
 
 def instance_get_active_by_window_joined(context, begin, end=None,
@@ -705,6 +728,16 @@ def instance_get_all_hung_in_rebooting(context, reboot_window):
     return IMPL.instance_get_all_hung_in_rebooting(context, reboot_window)
 
 
+def instance_get_uuids_by_info_cache_age(context, host, use_slave=False):
+    """Get the uuids of the instances of a host, least recently refreshed
+    network info cache first.
+
+    Instances which are building or being deleted are left out.
+    """
+    return IMPL.instance_get_uuids_by_info_cache_age(context, host,
+                                                     use_slave=use_slave)
+
+
 def instance_update(context, instance_uuid, values, update_cells=True):
     """Set the given properties on an instance and update it.
 
@@ -1906,23 +1939,35 @@ def task_log_get(context, task_name, period_beginning,
 ####################
 
 
-def archive_deleted_rows(context, max_rows=None):
+def archive_deleted_rows(context, max_rows=None, batch_size=None,
+                         batch_delay=0, workers=1, progress=None):
     """Move up to max_rows rows from production tables to corresponding shadow
     tables.
 
+    Rows are moved batch_size rows at a time, waiting batch_delay seconds
+    between two batches of a table, and up to workers tables are archived
+    at once. progress, if given, is called with the name of each table,
+    the number of rows archived from it and the time it took in seconds.
+
     :returns: number of rows archived.
     """
-    return IMPL.archive_deleted_rows(context, max_rows=max_rows)
+    return IMPL.archive_deleted_rows(context, max_rows=max_rows,
+                                     batch_size=batch_size,
+                                     batch_delay=batch_delay,
+                                     workers=workers, progress=progress)
 
 
-def archive_deleted_rows_for_table(context, tablename, max_rows=None):
+def archive_deleted_rows_for_table(context, tablename, max_rows=None,
+                                   batch_size=None, batch_delay=0):
     """Move up to max_rows rows from tablename to corresponding shadow
-    table.
+    table, batch_size rows at a time.
 
     :returns: number of rows archived.
     """
     return IMPL.archive_deleted_rows_for_table(context, tablename,
-                                               max_rows=max_rows)
+                                               max_rows=max_rows,
+                                               batch_size=batch_size,
+                                               batch_delay=batch_delay)
 
 
 ####################
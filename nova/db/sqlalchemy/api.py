@@ -25,6 +25,7 @@ import sys
 import time
 import uuid
 
+import eventlet
 from oslo.config import cfg
 import six
 from sqlalchemy import and_
@@ -124,6 +125,7 @@ def get_session(use_slave=False, **kwargs):
 
 
 _SHADOW_TABLE_PREFIX = 'shadow_'
+_ARCHIVE_BATCH_SIZE = 1000
 _DEFAULT_QUOTA_NAME = 'default'
 PER_PROJECT_QUOTAS = ['fixed_ips', 'floating_ips', 'networks']
 
@@ -568,6 +570,25 @@ def compute_node_get_by_service_id(context, service_id):
 
 @require_admin_context
 def compute_node_get_all(context, no_date_fields):
+    compute_node = models.ComputeNode.__table__
+    compute_nodes, services = _compute_node_get_all_by_clause(
+            compute_node.c.deleted == 0, no_date_fields)
+    return compute_nodes
+
+
+@require_admin_context
+def compute_node_get_all_changed_since(context, changed_since):
+    compute_node = models.ComputeNode.__table__
+    changed_since = timeutils.normalize_time(changed_since)
+    compute_nodes, services = _compute_node_get_all_by_clause(
+            or_(compute_node.c.created_at >= changed_since,
+                compute_node.c.updated_at >= changed_since,
+                compute_node.c.deleted_at >= changed_since),
+            no_date_fields=False)
+    return compute_nodes, services.values()
+
+
+def _compute_node_get_all_by_clause(whereclause, no_date_fields):
 
     # NOTE(msdubov): Using lower-level 'select' queries and joining the tables
     #                manually here allows to gain 3x speed-up and to have 5x
@@ -587,7 +608,7 @@ def compute_node_get_all(context, no_date_fields):
             return [c for c in table.c if c.name not in redundant_columns]
 
         compute_node_query = select(filter_columns(compute_node)).\
-                                where(compute_node.c.deleted == 0).\
+                                where(whereclause).\
                                 order_by(compute_node.c.service_id)
         compute_node_rows = conn.execute(compute_node_query).fetchall()
 
@@ -609,7 +630,7 @@ def compute_node_get_all(context, no_date_fields):
 
         compute_nodes.append(node)
 
-    return compute_nodes
+    return compute_nodes, services
 
 
 @require_admin_context
@@ -1818,7 +1839,7 @@ def instance_get_all(context, columns_to_join=None):
 @require_context
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                                 limit=None, marker=None, columns_to_join=None,
-                                use_slave=False):
+                                use_slave=False, columns=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
     otherwise.
@@ -1851,27 +1872,49 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
         'soft_deleted' - modify behavior of 'deleted' to either
                          include or exclude instances whose
                          vm_state is SOFT_DELETED.
+        'deleted_marker' - also find the marker among deleted
+                           instances, for paging through a list the
+                           marker instance may have been deleted from.
+
+    Pages are read with keyset pagination on (sort_key, created_at, id):
+    marker is the uuid of the last instance of the previous page, and only
+    these columns of it are read to find where the next page starts.
+
+    If columns is a list of column names, only these columns of the
+    instances table, and the uuid, are loaded and the instances are
+    returned as dicts. columns_to_join can then only contain 'metadata',
+    'system_metadata' and 'pci_devices', which are joined manually, and
+    defaults to no join. A ValueError is raised for any other join.
     """
 
-    sort_fn = {'desc': desc, 'asc': asc}
-
     if CONF.database.slave_connection == '':
         use_slave = False
 
     session = get_session(use_slave=use_slave)
 
-    if columns_to_join is None:
-        columns_to_join = ['info_cache', 'security_groups']
-        manual_joins = ['metadata', 'system_metadata']
+    if columns is not None:
+        columns = list(columns)
+        if 'uuid' not in columns:
+            columns.append('uuid')
+        manual_joins, columns_to_join = _manual_join_columns(
+                list(columns_to_join or []))
+        if columns_to_join:
+            raise ValueError(_('Cannot join %s when loading only some '
+                               'columns of instances') %
+                             ', '.join(columns_to_join))
+        query_prefix = session.query(*[getattr(models.Instance, column)
+                                       for column in columns])
     else:
-        manual_joins, columns_to_join = _manual_join_columns(columns_to_join)
-
-    query_prefix = session.query(models.Instance)
-    for column in columns_to_join:
-        query_prefix = query_prefix.options(joinedload(column))
+        if columns_to_join is None:
+            columns_to_join = ['info_cache', 'security_groups']
+            manual_joins = ['metadata', 'system_metadata']
+        else:
+            manual_joins, columns_to_join = _manual_join_columns(
+                    columns_to_join)
 
-    query_prefix = query_prefix.order_by(sort_fn[sort_dir](
-            getattr(models.Instance, sort_key)))
+        query_prefix = session.query(models.Instance)
+        for column in columns_to_join:
+            query_prefix = query_prefix.options(joinedload(column))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1908,6 +1951,10 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                     )
                 query_prefix = query_prefix.filter(not_soft_deleted)
 
+    marker_read_deleted = None
+    if filters.pop('deleted_marker', False):
+        marker_read_deleted = 'yes'
+
     if 'cleaned' in filters:
         if filters.pop('cleaned'):
             query_prefix = query_prefix.filter(models.Instance.cleaned == 1)
@@ -1939,20 +1986,41 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                               filters)
 
     # paginate query
+    sort_keys = [sort_key] + [key for key in ('created_at', 'id')
+                              if key != sort_key]
     if marker is not None:
-        try:
-            marker = _instance_get_by_uuid(context, marker, session=session)
-        except exception.InstanceNotFound:
-            raise exception.MarkerNotFound(marker)
+        marker = _instance_get_sort_values(context, marker, sort_keys,
+                                           session=session,
+                                           read_deleted=marker_read_deleted)
     query_prefix = sqlalchemyutils.paginate_query(query_prefix,
-                           models.Instance, limit,
-                           [sort_key, 'created_at', 'id'],
+                           models.Instance, limit, sort_keys,
                            marker=marker,
                            sort_dir=sort_dir)
 
+    if columns is not None:
+        instances = [dict(zip(columns, row)) for row in query_prefix.all()]
+        if not manual_joins:
+            return instances
+        return _instances_fill_metadata(context, instances, manual_joins)
     return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
 
 
+def _instance_get_sort_values(context, uuid, sort_keys, session=None,
+                              read_deleted=None):
+    """Return the sort_keys columns of an instance, to use as a marker."""
+    columns = [getattr(models.Instance, sort_key) for sort_key in sort_keys]
+    result = model_query(context, *columns, base_model=models.Instance,
+                         session=session, project_only=True,
+                         read_deleted=read_deleted).\
+                filter(models.Instance.uuid == uuid).\
+                first()
+
+    if not result:
+        raise exception.MarkerNotFound(uuid)
+
+    return result
+
+
 def tag_filter(context, query, model, model_metadata,
                model_uuid, filters):
     """Applies tag filtering to a query.
@@ -2179,6 +2247,32 @@ def instance_get_all_hung_in_rebooting(context, reboot_window):
         manual_joins=[])
 
 
+@require_context
+def instance_get_uuids_by_info_cache_age(context, host, use_slave=False):
+    # NOTE: only the uuids and the info_cache timestamps are loaded, as this
+    # lists every instance of the host.
+    rows = model_query(context, models.Instance.uuid,
+                       models.InstanceInfoCache.created_at,
+                       models.InstanceInfoCache.updated_at,
+                       base_model=models.Instance, use_slave=use_slave).\
+            outerjoin(models.InstanceInfoCache,
+                      models.InstanceInfoCache.instance_uuid ==
+                      models.Instance.uuid).\
+            filter(models.Instance.host == host).\
+            filter(or_(models.Instance.vm_state == None,
+                       models.Instance.vm_state != vm_states.BUILDING)).\
+            filter(or_(models.Instance.task_state == None,
+                       models.Instance.task_state != task_states.DELETING)).\
+            all()
+
+    def refreshed_at(row):
+        uuid, created_at, updated_at = row
+        refreshed_at = updated_at or created_at
+        return (refreshed_at is not None, refreshed_at)
+
+    return [row[0] for row in sorted(rows, key=refreshed_at)]
+
+
 @require_context
 def instance_update(context, instance_uuid, values):
     instance_ref = _instance_update(context, instance_uuid, values)[1]
@@ -5558,10 +5652,31 @@ def _get_default_deleted_value(table):
         return None
 
 
-@require_admin_context
-def archive_deleted_rows_for_table(context, tablename, max_rows):
-    """Move up to max_rows rows from one tables to the corresponding
-    shadow table. The context argument is only used for the decorator.
+class _ArchiveBudget(object):
+    """Number of rows left to archive, shared by the tables being archived.
+
+    The rows of a batch are taken from the budget before it is run, so that
+    tables archived at the same time never archive more than max_rows rows
+    in total. max_rows None means no limit.
+    """
+
+    def __init__(self, max_rows=None):
+        self.remaining = max_rows
+
+    def take(self, batch_size):
+        if self.remaining is None:
+            return batch_size
+        rows = min(batch_size, self.remaining)
+        self.remaining -= rows
+        return rows
+
+    def give_back(self, rows):
+        if self.remaining is not None:
+            self.remaining += rows
+
+
+def _archive_rows(conn, table, shadow_table, where):
+    """Move the rows of table matching where to shadow_table.
 
     :returns: number of rows archived
     """
@@ -5569,12 +5684,69 @@ def archive_deleted_rows_for_table(context, tablename, max_rows):
     # imports nova.db.sqlalchemy.api.
     from nova.db.sqlalchemy import utils as db_utils
 
+    insert_statement = db_utils.InsertFromSelect(shadow_table,
+                                                 select([table], where))
+    delete_statement = table.delete(where)
+    # Group the insert and delete in a transaction.
+    with conn.begin():
+        conn.execute(insert_statement)
+        result_delete = conn.execute(delete_statement)
+    return result_delete.rowcount
+
+
+def _archive_deleted_rows_batch(conn, table, shadow_table, column,
+                                batch_size, after=None):
+    """Move the first batch_size deleted rows of table with a key greater
+    than after to shadow_table.
+
+    :returns: number of rows archived, number of rows in the batch and key
+              of the last row of the batch
+    """
+    deleted = table.c.deleted != _get_default_deleted_value(table)
+    if after is not None:
+        deleted = and_(deleted, column > after)
+    keys = [row[0] for row in
+            conn.execute(select([column], deleted).
+                         order_by(column).limit(batch_size))]
+    if not keys:
+        return 0, 0, after
+
+    # NOTE: select the rows of the batch by key range rather than by key,
+    # to avoid the database's limit of maximum parameters in one statement.
+    try:
+        rows_archived = _archive_rows(conn, table, shadow_table,
+                and_(deleted, column.between(keys[0], keys[-1])))
+    except IntegrityError:
+        # A foreign key constraint keeps us from deleting some of these
+        # rows until a dependent table is cleaned up. Archive the others
+        # one at a time, and leave those behind for a later run.
+        rows_archived = 0
+        for key in keys:
+            try:
+                rows_archived += _archive_rows(conn, table, shadow_table,
+                                               and_(deleted, column == key))
+            except IntegrityError:
+                pass
+        msg = _("IntegrityError detected when archiving table %(table)s, "
+                "%(count)d rows were skipped")
+        LOG.warn(msg, {'table': table.name,
+                       'count': len(keys) - rows_archived})
+    return rows_archived, len(keys), keys[-1]
+
+
+def _archive_deleted_rows_for_table(tablename, budget, batch_size,
+                                    batch_delay=0):
+    """Move deleted rows from one table to the corresponding shadow table,
+    batch_size rows at a time, until no deleted rows are left or the
+    budget is spent.
+
+    :returns: number of rows archived
+    """
     engine = get_engine()
     conn = engine.connect()
     metadata = MetaData()
     metadata.bind = engine
     table = Table(tablename, metadata, autoload=True)
-    default_deleted_value = _get_default_deleted_value(table)
     shadow_tablename = _SHADOW_TABLE_PREFIX + tablename
     rows_archived = 0
     try:
@@ -5587,56 +5759,108 @@ def archive_deleted_rows_for_table(context, tablename, max_rows):
         # We have one table (dns_domains) where the key is called
         # "domain" rather than "id"
         column = table.c.domain
-        column_name = "domain"
     else:
         column = table.c.id
-        column_name = "id"
-    # NOTE(guochbo): Use InsertFromSelect and DeleteFromSelect to avoid
-    # database's limit of maximum parameter in one SQL statement.
-    query_insert = select([table],
-                          table.c.deleted != default_deleted_value).\
-                          order_by(column).limit(max_rows)
-    query_delete = select([column],
-                          table.c.deleted != default_deleted_value).\
-                          order_by(column).limit(max_rows)
-
-    insert_statement = db_utils.InsertFromSelect(shadow_table, query_insert)
-    delete_statement = db_utils.DeleteFromSelect(table, query_delete, column)
-    try:
-        # Group the insert and delete in a transaction.
-        with conn.begin():
-            result_insert = conn.execute(insert_statement)
-            result_delete = conn.execute(delete_statement)
-    except IntegrityError:
-        # A foreign key constraint keeps us from deleting some of
-        # these rows until we clean up a dependent table.  Just
-        # skip this table for now; we'll come back to it later.
-        msg = _("IntegrityError detected when archiving table %s") % tablename
-        LOG.warn(msg)
-        return rows_archived
 
-    rows_archived = result_delete.rowcount
+    after = None
+    while True:
+        rows = budget.take(batch_size)
+        if not rows:
+            break
+        batch_archived, batch_rows, after = _archive_deleted_rows_batch(
+                conn, table, shadow_table, column, rows, after)
+        budget.give_back(rows - batch_archived)
+        rows_archived += batch_archived
+        if batch_rows < rows:
+            break
+        if batch_delay:
+            time.sleep(batch_delay)
 
     return rows_archived
 
 
+def _archive_table_levels():
+    """Group the tables of the models in levels to archive them in order.
+
+    The rows of a table must be archived before the rows they refer to
+    through a foreign key: each table is in a level after the levels of the
+    tables which refer to it, so that the tables of one level don't depend
+    on each other.
+
+    :returns: list of lists of table names
+    """
+    tables = models.BASE.metadata.tables
+    children = dict((tablename, set()) for tablename in tables)
+    for tablename, table in tables.iteritems():
+        for foreign_key in table.foreign_keys:
+            parent = foreign_key.column.table.name
+            if parent != tablename:
+                children[parent].add(tablename)
+
+    levels = {}
+
+    def get_level(tablename):
+        if tablename not in levels:
+            levels[tablename] = 0
+            levels[tablename] = max([get_level(child) + 1
+                                     for child in children[tablename]] or
+                                    [0])
+        return levels[tablename]
+
+    table_levels = []
+    for tablename in sorted(tables):
+        level = get_level(tablename)
+        while len(table_levels) <= level:
+            table_levels.append([])
+        table_levels[level].append(tablename)
+    return table_levels
+
+
 @require_admin_context
-def archive_deleted_rows(context, max_rows=None):
+def archive_deleted_rows_for_table(context, tablename, max_rows,
+                                   batch_size=None, batch_delay=0):
+    """Move up to max_rows rows from one tables to the corresponding
+    shadow table, batch_size rows at a time. The context argument is only
+    used for the decorator.
+
+    :returns: number of rows archived
+    """
+    return _archive_deleted_rows_for_table(
+            tablename, _ArchiveBudget(max_rows),
+            batch_size or _ARCHIVE_BATCH_SIZE, batch_delay)
+
+
+@require_admin_context
+def archive_deleted_rows(context, max_rows=None, batch_size=None,
+                         batch_delay=0, workers=1, progress=None):
     """Move up to max_rows rows from production tables to the corresponding
     shadow tables.
 
+    The tables are archived batch_size rows at a time, waiting batch_delay
+    seconds between two batches, and up to workers tables at once. The rows
+    of a table are archived before the rows they refer to. progress, if
+    given, is called with the name, the number of rows archived and the
+    duration in seconds of each table once it is archived.
+
     :returns: Number of rows archived.
     """
     # The context argument is only used for the decorator.
-    tablenames = []
-    for model_class in models.__dict__.itervalues():
-        if hasattr(model_class, "__tablename__"):
-            tablenames.append(model_class.__tablename__)
+    budget = _ArchiveBudget(max_rows)
+    pool = eventlet.GreenPool(workers)
+
+    def archive_table(tablename):
+        start = time.time()
+        rows = _archive_deleted_rows_for_table(
+                tablename, budget, batch_size or _ARCHIVE_BATCH_SIZE,
+                batch_delay)
+        if progress:
+            progress(tablename, rows, time.time() - start)
+        return rows
+
     rows_archived = 0
-    for tablename in tablenames:
-        rows_archived += archive_deleted_rows_for_table(context, tablename,
-                                         max_rows=max_rows - rows_archived)
-        if rows_archived >= max_rows:
+    for tablenames in _archive_table_levels():
+        rows_archived += sum(pool.imap(archive_table, tablenames))
+        if budget.remaining == 0:
             break
     return rows_archived
 
@@ -18,6 +18,7 @@
 from __future__ import absolute_import
 
 import copy
+import hashlib
 import itertools
 import json
 import random
@@ -62,6 +63,29 @@ glance_opts = [
     cfg.IntOpt('glance_num_retries',
                default=0,
                help='Number of retries when downloading an image from glance'),
+    cfg.IntOpt('glance_api_server_down_time',
+               default=60,
+               help='Number of seconds during which a glance api server '
+                    'which could not be reached is only tried after the '
+                    'other ones'),
+    cfg.IntOpt('glance_client_pool_size',
+               default=50,
+               help='Maximum number of glance clients, along with their '
+                    'keep-alive connections, kept for reuse by the calls '
+                    'made to the same api server with the same token. Set '
+                    'to 0 to create a new client for every call'),
+    cfg.IntOpt('glance_client_pool_idle_timeout',
+               default=60,
+               help='Number of seconds a pooled glance client may stay '
+                    'unused before it is dropped'),
+    cfg.IntOpt('glance_image_metadata_cache_ttl',
+               default=60,
+               help='Number of seconds the metadata of an active image '
+                    'shown by glance is reused instead of being requested '
+                    'again. Set to 0 to disable the cache'),
+    cfg.IntOpt('glance_image_metadata_cache_size',
+               default=1000,
+               help='Maximum number of images whose metadata is cached'),
     cfg.ListOpt('allowed_direct_url_schemes',
                 default=[],
                 help='A list of url scheme that can be downloaded directly '
@@ -141,10 +165,9 @@ def _create_glance_client(context, host, port, use_ssl, version=1):
     return glanceclient.Client(str(version), endpoint, **params)
 
 
-def get_api_servers():
-    """Shuffle a list of CONF.glance_api_servers and return an iterator
-    that will cycle through the list, looping around to the beginning
-    if necessary.
+def _get_api_server_list():
+    """Return a shuffled list of the (host, port, use_ssl) tuples of
+    CONF.glance_api_servers.
     """
     api_servers = []
     for api_server in CONF.glance_api_servers:
@@ -158,7 +181,192 @@ def get_api_servers():
         use_ssl = (o.scheme == 'https')
         api_servers.append((host, port, use_ssl))
     random.shuffle(api_servers)
-    return itertools.cycle(api_servers)
+    return api_servers
+
+
+def get_api_servers():
+    """Shuffle a list of CONF.glance_api_servers and return an iterator
+    that will cycle through the list, looping around to the beginning
+    if necessary.
+    """
+    return itertools.cycle(_get_api_server_list())
+
+
+class _ApiServerHealth(object):
+    """Remembers the glance api servers which could not be reached."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # { (host, port, use_ssl) : time of the last failure }
+        self._failed_at = {}
+
+    def sort(self, api_servers):
+        """Return api_servers with the ones which could not be reached in
+        the last glance_api_server_down_time seconds at the end, those
+        which failed least recently first.
+        """
+        now = time.time()
+
+        def _failed_at(api_server):
+            failed_at = self._failed_at.get(api_server)
+            if (failed_at is None or
+                    now - failed_at > CONF.glance_api_server_down_time):
+                return 0
+            return failed_at
+
+        return sorted(api_servers, key=_failed_at)
+
+    def failed(self, api_server):
+        self._failed_at[api_server] = time.time()
+
+    def succeeded(self, api_server):
+        self._failed_at.pop(api_server, None)
+
+
+class _ClientPool(object):
+    """Glance clients kept for reuse, along with their keep-alive
+    connections.
+
+    A client carries the token of the context it was created for, so it
+    is only reused by the calls made to the same api server with the same
+    token: the calls made while handling one request, or the requests made
+    with one token until it expires. Contexts without a token, such as the
+    ones of periodic tasks, share their clients.
+
+    A client is not safe to share between greenthreads, so each call checks
+    an idle client out of the pool and only puts it back once it succeeded.
+    Idle clients unused for glance_client_pool_idle_timeout seconds are
+    dropped, and so are the least recently used ones beyond
+    glance_client_pool_size.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # { (host, port, use_ssl, version, credentials) :
+        #   [(idle client, last used)] }, least recently used first
+        self._clients = {}
+
+    @staticmethod
+    def _key(context, host, port, use_ssl, version):
+        credentials = None
+        if CONF.auth_strategy == 'keystone':
+            credentials = tuple(sorted(
+                generate_identity_headers(context).items()))
+        return (host, port, use_ssl, version, credentials)
+
+    def checkout(self, context, host, port, use_ssl, version):
+        """Take an idle client out of the pool, or create one."""
+        if CONF.glance_client_pool_size > 0:
+            now = time.time()
+            idle = self._clients.get(
+                    self._key(context, host, port, use_ssl, version), [])
+            while idle:
+                client, last_used = idle.pop()
+                if now - last_used <= CONF.glance_client_pool_idle_timeout:
+                    return client
+        return _create_glance_client(context, host, port, use_ssl, version)
+
+    def checkin(self, context, host, port, use_ssl, version, client):
+        """Put a client back in the pool once its call succeeded."""
+        if CONF.glance_client_pool_size <= 0:
+            return
+        now = time.time()
+        self._evict(now)
+        key = self._key(context, host, port, use_ssl, version)
+        self._clients.setdefault(key, []).append((client, now))
+
+    def _evict(self, now):
+        entries = []
+        for key, idle in self._clients.items():
+            kept = [(client, last_used) for client, last_used in idle
+                    if now - last_used <= CONF.glance_client_pool_idle_timeout]
+            if kept:
+                self._clients[key] = kept
+                entries.extend((last_used, key) for client, last_used in kept)
+            else:
+                del self._clients[key]
+        excess = len(entries) + 1 - CONF.glance_client_pool_size
+        if excess > 0:
+            for last_used, key in sorted(entries)[:excess]:
+                del self._clients[key][0]
+                if not self._clients[key]:
+                    del self._clients[key]
+
+
+class _ImageMetaCache(object):
+    """Metadata of the active images shown by glance, reused for
+    glance_image_metadata_cache_ttl seconds.
+
+    Glance only shows the images a project may see, so an image is
+    cached per glance endpoint and per project (or for all the admin
+    contexts), and _is_image_available is still checked on every hit.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # { image id : { (endpoint, visibility) : (image, cached at) } }
+        self._images = {}
+
+    @staticmethod
+    def _key(context, endpoint):
+        visibility = None if context.is_admin else context.project_id
+        return (endpoint, visibility)
+
+    def get(self, context, endpoint, image_id):
+        if CONF.glance_image_metadata_cache_ttl <= 0:
+            return None
+        entries = self._images.get(image_id, {})
+        key = self._key(context, endpoint)
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        image, cached_at = entry
+        if timeutils.is_older_than(cached_at,
+                                   CONF.glance_image_metadata_cache_ttl):
+            del entries[key]
+            return None
+        return image
+
+    def set(self, context, endpoint, image_id, image):
+        """Cache an image, unless it may still change status."""
+        if (CONF.glance_image_metadata_cache_ttl <= 0 or
+                getattr(image, 'status', None) != 'active'):
+            return
+        if (image_id not in self._images and
+                len(self._images) >= CONF.glance_image_metadata_cache_size):
+            self._evict()
+        entries = self._images.setdefault(image_id, {})
+        entries[self._key(context, endpoint)] = (image, timeutils.utcnow())
+
+    def invalidate(self, image_id):
+        """Forget an image which nova updated or deleted."""
+        self._images.pop(image_id, None)
+
+    def _evict(self):
+        ttl = CONF.glance_image_metadata_cache_ttl
+        for image_id, entries in self._images.items():
+            if all(timeutils.is_older_than(cached_at, ttl)
+                   for image, cached_at in entries.values()):
+                del self._images[image_id]
+        excess = (len(self._images) + 1 -
+                  CONF.glance_image_metadata_cache_size)
+        if excess > 0:
+            image_ids = sorted(self._images, key=lambda image_id: max(
+                cached_at for image, cached_at
+                in self._images[image_id].values()))
+            for image_id in image_ids[:excess]:
+                del self._images[image_id]
+
+
+_api_server_health = _ApiServerHealth()
+_client_pool = _ClientPool()
+_image_meta_cache = _ImageMetaCache()
 
 
 class GlanceClientWrapper(object):
@@ -172,7 +380,6 @@ class GlanceClientWrapper(object):
                                                      use_ssl, version)
         else:
             self.client = None
-        self.api_servers = None
 
     def _create_static_client(self, context, host, port, use_ssl, version):
         """Create a client that we'll use for every call."""
@@ -184,30 +391,43 @@ class GlanceClientWrapper(object):
                                      self.host, self.port,
                                      self.use_ssl, self.version)
 
-    def _create_onetime_client(self, context, version):
-        """Create a client that will be used for one call."""
-        if self.api_servers is None:
-            self.api_servers = get_api_servers()
-        self.host, self.port, self.use_ssl = self.api_servers.next()
-        return _create_glance_client(context,
-                                     self.host, self.port,
+    def _get_pooled_client(self, context, version, api_server):
+        """Check a client out of the pool for one call to api_server."""
+        self.host, self.port, self.use_ssl = api_server
+        return _client_pool.checkout(context, self.host, self.port,
                                      self.use_ssl, version)
 
     def call(self, context, version, method, *args, **kwargs):
         """Call a glance client method.  If we get a connection error,
         retry the request according to CONF.glance_num_retries.
+
+        Without a static client, the api servers which could be reached
+        recently are tried first.
         """
         retry_excs = (glanceclient.exc.ServiceUnavailable,
                 glanceclient.exc.InvalidEndpoint,
                 glanceclient.exc.CommunicationError)
         num_attempts = 1 + CONF.glance_num_retries
+        if not self.client:
+            api_servers = _api_server_health.sort(_get_api_server_list())
 
         for attempt in xrange(1, num_attempts + 1):
-            client = self.client or self._create_onetime_client(context,
-                                                                version)
+            if self.client:
+                client = self.client
+            else:
+                api_server = api_servers[(attempt - 1) % len(api_servers)]
+                client = self._get_pooled_client(context, version,
+                                                 api_server)
             try:
-                return getattr(client.images, method)(*args, **kwargs)
+                result = getattr(client.images, method)(*args, **kwargs)
+                if not self.client:
+                    _api_server_health.succeeded(api_server)
+                    _client_pool.checkin(context, self.host, self.port,
+                                         self.use_ssl, version, client)
+                return result
             except retry_excs as e:
+                if not self.client:
+                    _api_server_health.failed(api_server)
                 host = self.host
                 port = self.port
                 extra = "retrying"
@@ -264,12 +484,27 @@ class GlanceImageService(object):
 
         return _images
 
+    def _get_endpoint(self):
+        """Return the glance endpoint of a static client, None otherwise."""
+        if getattr(self._client, 'client', None) is None:
+            return None
+        return (self._client.host, self._client.port)
+
+    def _get_image(self, context, image_id):
+        """Returns the image shown by glance, cached if possible."""
+        endpoint = self._get_endpoint()
+        image = _image_meta_cache.get(context, endpoint, image_id)
+        if image is None:
+            try:
+                image = self._client.call(context, 1, 'get', image_id)
+            except Exception:
+                _reraise_translated_image_exception(image_id)
+            _image_meta_cache.set(context, endpoint, image_id, image)
+        return image
+
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
-        try:
-            image = self._client.call(context, 1, 'get', image_id)
-        except Exception:
-            _reraise_translated_image_exception(image_id)
+        image = self._get_image(context, image_id)
 
         if not _is_image_available(context, image):
             raise exception.ImageNotFound(image_id=image_id)
@@ -306,8 +541,31 @@ class GlanceImageService(object):
                 "for %(scheme)s") % {'scheme': scheme})
         return
 
+    def _get_checksum(self, context, image_id):
+        """Return the md5 checksum glance has for the data of an image, or
+        None if it has none.
+        """
+        checksum = getattr(self._get_image(context, image_id),
+                           'checksum', None)
+        if isinstance(checksum, six.string_types):
+            return checksum
+
+    @staticmethod
+    def _verify_checksum(image_id, md5, checksum):
+        if checksum is not None and md5.hexdigest() != checksum:
+            raise exception.ImageUnacceptable(image_id=image_id,
+                reason=_("Checksum of the downloaded data %(actual)s "
+                         "does not match %(expected)s") %
+                {'actual': md5.hexdigest(), 'expected': checksum})
+
     def download(self, context, image_id, data=None, dst_path=None):
         """Calls out to Glance for data and writes data."""
+        # NOTE: The checksum is fetched before anything is written, so that
+        # failing to get it does not leave an empty destination file behind.
+        checksum = None
+        if data is not None or dst_path:
+            checksum = self._get_checksum(context, image_id)
+
         if CONF.allowed_direct_url_schemes and dst_path is not None:
             locations = self._get_locations(context, image_id)
             for entry in locations:
@@ -318,6 +576,14 @@ class GlanceImageService(object):
                 if xfer_mod:
                     try:
                         xfer_mod.download(context, o, dst_path, loc_meta)
+                        # NOTE: The transfer modules copy the file as a
+                        # whole, so it is read again to verify it.
+                        if checksum is not None:
+                            md5 = hashlib.md5()
+                            with open(dst_path, 'rb') as f:
+                                for chunk in iter(lambda: f.read(65536), b''):
+                                    md5.update(chunk)
+                            self._verify_checksum(image_id, md5, checksum)
                         msg = _("Successfully transferred "
                                 "using %s") % o.scheme
                         LOG.info(msg)
@@ -338,12 +604,17 @@ class GlanceImageService(object):
         if data is None:
             return image_chunks
         else:
+            # NOTE: The checksum is computed while the data is written, so
+            # that verifying the image does not take a second read pass.
+            md5 = hashlib.md5()
             try:
                 for chunk in image_chunks:
+                    md5.update(chunk)
                     data.write(chunk)
             finally:
                 if close_file:
                     data.close()
+            self._verify_checksum(image_id, md5, checksum)
 
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
@@ -377,6 +648,8 @@ class GlanceImageService(object):
             _reraise_translated_image_exception(image_id)
         else:
             return _translate_from_glance(image_meta)
+        finally:
+            _image_meta_cache.invalidate(image_id)
 
     def delete(self, context, image_id):
         """Delete the given image.
@@ -392,6 +665,8 @@ class GlanceImageService(object):
             raise exception.ImageNotFound(image_id=image_id)
         except glanceclient.exc.HTTPForbidden:
             raise exception.ImageNotAuthorized(image_id=image_id)
+        finally:
+            _image_meta_cache.invalidate(image_id)
         return True
 
 
@@ -428,6 +428,21 @@ class API(base.Base):
                                            result, update_cells=False)
         return result
 
+    def get_instances_nw_info(self, context, instances):
+        """Returns the network info of several instances, or None for
+        the instances whose network info can't be refreshed.
+        """
+        result = []
+        for instance in instances:
+            try:
+                nw_info = self.get_instance_nw_info(context, instance)
+            except Exception:
+                LOG.exception(_('Failed to refresh the network info cache'),
+                              instance=instance)
+                nw_info = None
+            result.append(nw_info)
+        return result
+
     def _get_instance_nw_info(self, context, instance):
         """Returns all network info related to an instance."""
         flavor = flavors.extract_flavor(instance)
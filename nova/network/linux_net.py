@@ -122,6 +122,13 @@ linux_net_opts = [
                default='DROP',
                help=('The table that iptables to jump to when a packet is '
                      'to be dropped.')),
+    cfg.IntOpt('iptables_full_apply_interval',
+               default=600,
+               help='Number of seconds during which only the nova chains '
+                    'which changed are replaced when applying iptables '
+                    'rules, after which all the rules are saved and '
+                    'restored again. Set to 0 to always save and restore '
+                    'all the rules.'),
     cfg.IntOpt('ovs_vsctl_timeout',
                default=120,
                help='Amount of time, in seconds, that ovs_vsctl should wait '
@@ -360,6 +367,11 @@ class IptablesManager(object):
 
         self.iptables_apply_deferred = False
 
+        # { (command, table name) : rules of the table as last applied }
+        self.applied_rules = {}
+        # { command : time the tables were last saved and restored }
+        self.fully_applied_at = {}
+
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
         # of FORWARD and OUTPUT.
@@ -449,20 +461,112 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
-            all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
-                                                run_as_root=True,
-                                                attempts=5)
-            all_lines = all_tables.split('\n')
-            for table_name, table in tables.iteritems():
-                start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                        all_lines[start:end], table, table_name)
-                table.dirty = False
-            self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
-                         process_input='\n'.join(all_lines),
-                         attempts=5)
+            if not self._apply_changed_chains(cmd, tables):
+                self._apply_all_rules(cmd, tables)
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _apply_all_rules(self, cmd, tables):
+        """Save all the tables, replace our rules and restore them."""
+        self.fully_applied_at.pop(cmd, None)
+        all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
+                                            run_as_root=True,
+                                            attempts=5)
+        all_lines = all_tables.split('\n')
+        applied_rules = {}
+        for table_name, table in tables.iteritems():
+            applied_rules[table_name] = self._get_table_rules(table)
+            start, end = self._find_table(all_lines, table_name)
+            all_lines[start:end] = self._modify_rules(
+                    all_lines[start:end], table, table_name)
+            table.dirty = False
+        self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
+                     process_input='\n'.join(all_lines),
+                     attempts=5)
+        for table_name, rules in applied_rules.iteritems():
+            self.applied_rules[(cmd, table_name)] = rules
+        self.fully_applied_at[cmd] = timeutils.utcnow()
+
+    def _apply_changed_chains(self, cmd, tables):
+        """Replace only our wrapped chains which changed since the rules
+        were last applied, without saving the tables first.
+
+        The chains are flushed by declaring them to iptables-restore
+        --noflush, which leaves the other chains alone. Returns False
+        if all the rules must be saved and restored instead, because the
+        unwrapped chains or rules changed, or iptables_full_apply_interval
+        seconds passed since they were.
+        """
+        fully_applied_at = self.fully_applied_at.get(cmd)
+        if (fully_applied_at is None or
+                timeutils.is_older_than(fully_applied_at,
+                                        CONF.iptables_full_apply_interval)):
+            return False
+
+        all_lines = []
+        applied_rules = {}
+        for table_name, table in tables.iteritems():
+            rules = self._get_table_rules(table)
+            previous_rules = self.applied_rules.get((cmd, table_name))
+            if (previous_rules is None or table.remove_chains or
+                    table.remove_rules or
+                    rules['unwrapped'] != previous_rules['unwrapped']):
+                return False
+            all_lines += self._get_changed_chain_lines(
+                    table_name, previous_rules['wrapped'], rules['wrapped'])
+            applied_rules[table_name] = rules
+
+        if all_lines:
+            try:
+                self.execute('%s-restore' % (cmd,), '-c', '--noflush',
+                             run_as_root=True,
+                             process_input='\n'.join(all_lines),
+                             attempts=5)
+            except processutils.ProcessExecutionError as e:
+                LOG.warn(_('Failed to replace the changed %(cmd)s chains, '
+                           'restoring all the rules: %(error)s'),
+                         {'cmd': cmd, 'error': e})
+                return False
+        for table_name, table in tables.iteritems():
+            self.applied_rules[(cmd, table_name)] = applied_rules[table_name]
+            table.dirty = False
+        return True
+
+    @staticmethod
+    def _get_table_rules(table):
+        """Return the rules of a table as they are applied, the wrapped
+        ones grouped by chain.
+        """
+        wrapped = dict((chain, []) for chain in table.chains)
+        unwrapped = []
+        # Rules at the top come first, in the order they were added.
+        for rule in sorted(table.rules, key=lambda rule: not rule.top):
+            if rule.wrap:
+                wrapped.setdefault(rule.chain, []).append(str(rule))
+            else:
+                unwrapped.append(str(rule))
+        return {'wrapped': wrapped,
+                'unwrapped': (sorted(table.unwrapped_chains), unwrapped)}
+
+    @staticmethod
+    def _get_changed_chain_lines(table_name, previous_chains, chains):
+        """Return the iptables-restore --noflush input replacing the
+        wrapped chains of a table which changed.
+        """
+        declarations = []
+        rules = []
+        deletions = []
+        for chain in sorted(chains):
+            if previous_chains.get(chain) != chains[chain]:
+                declarations.append(':%s-%s - [0:0]' % (binary_name, chain))
+                rules += chains[chain]
+        for chain in sorted(set(previous_chains) - set(chains)):
+            declarations.append(':%s-%s - [0:0]' % (binary_name, chain))
+            deletions.append('-X %s-%s' % (binary_name, chain))
+        if not declarations:
+            return []
+        return (['*%s' % table_name] + declarations + rules + deletions +
+                ['COMMIT'])
+
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
             # length only <2 when fake iptables
@@ -624,8 +728,7 @@ class IptablesManager(object):
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
         return new_filter
 
@@ -13,10 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 from neutronclient.common import exceptions
 from neutronclient.v2_0 import client as clientv20
 from oslo.config import cfg
 
+from nova.openstack.common.gettextutils import _
 from nova.openstack.common import local
 from nova.openstack.common import log as logging
 
@@ -46,6 +49,124 @@ def _get_client(token=None):
     return clientv20.Client(**params)
 
 
+class _ClientPool(object):
+    """Neutron clients kept for reuse by the calls made with the same
+    token, along with their keep-alive connections.
+
+    A client is not safe to share between greenthreads, so each call checks
+    an idle client out of the pool and only puts it back once done. Idle
+    clients unused for neutron_client_pool_idle_timeout seconds are
+    dropped, and so are the least recently used ones beyond
+    neutron_client_pool_size.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def checkout(self, token):
+        """Take an idle client out of the pool, or create one."""
+        now = time.time()
+        idle = self._clients.get((CONF.neutron_url, token), [])
+        while idle:
+            client, last_used = idle.pop()
+            if now - last_used <= CONF.neutron_client_pool_idle_timeout:
+                self.hits += 1
+                self._report(now)
+                return client
+            self.evictions += 1
+        self.misses += 1
+        self._report(now)
+        return _get_client(token=token)
+
+    def checkin(self, token, client):
+        """Put a client back in the pool once its call is done."""
+        now = time.time()
+        self._evict(now)
+        key = (CONF.neutron_url, token)
+        self._clients.setdefault(key, []).append((client, now))
+
+    def _evict(self, now):
+        entries = []
+        for key, idle in self._clients.items():
+            kept = []
+            for client, last_used in idle:
+                if now - last_used > CONF.neutron_client_pool_idle_timeout:
+                    self.evictions += 1
+                else:
+                    kept.append((client, last_used))
+                    entries.append((last_used, key))
+            if kept:
+                self._clients[key] = kept
+            else:
+                del self._clients[key]
+        excess = len(entries) + 1 - CONF.neutron_client_pool_size
+        if excess > 0:
+            for last_used, key in sorted(entries)[:excess]:
+                # The clients of a key are kept from the least to the most
+                # recently used.
+                del self._clients[key][0]
+                if not self._clients[key]:
+                    del self._clients[key]
+                self.evictions += 1
+
+    def _report(self, now):
+        interval = CONF.neutron_client_pool_report_interval
+        if interval > 0 and now - self._reported_at >= interval:
+            self._reported_at = now
+            LOG.info(_("Neutron client pool: %(size)d idle clients, "
+                       "%(hits)d hits, %(misses)d misses, %(evictions)d "
+                       "evictions"), self.stats())
+
+    def clear(self):
+        # { (endpoint, token) : [(idle client, last used)] }
+        self._clients = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reported_at = time.time()
+
+    def stats(self):
+        return {'size': sum(len(idle) for idle in self._clients.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+_client_pool = _ClientPool()
+
+
+def get_client_pool_stats():
+    """Return the number of idle clients in the pool and its hit, miss and
+    eviction counters.
+    """
+    return _client_pool.stats()
+
+
+class _PooledClient(object):
+    """Neutron client which runs each call with a client checked out of
+    the pool for it.
+    """
+
+    def __init__(self, token):
+        self._token = token
+
+    def __getattr__(self, name):
+        if not callable(getattr(clientv20.Client, name, None)):
+            client = _client_pool.checkout(self._token)
+            attr = getattr(client, name)
+            _client_pool.checkin(self._token, client)
+            return attr
+
+        def call(*args, **kwargs):
+            client = _client_pool.checkout(self._token)
+            result = getattr(client, name)(*args, **kwargs)
+            # NOTE: a client whose call failed is not put back, as its
+            # connection may be broken.
+            _client_pool.checkin(self._token, client)
+            return result
+        return call
+
+
 def get_client(context, admin=False):
     # NOTE(dprince): In the case where no auth_token is present
     # we allow use of neutron admin tenant credentials if
@@ -67,6 +188,8 @@ def get_client(context, admin=False):
     # We got a user token that we can use that as-is
     if context.auth_token:
         token = context.auth_token
+        if CONF.neutron_client_pool_size > 0:
+            return _PooledClient(token)
         return _get_client(token=token)
 
     # We did not get a user token and we should not be using
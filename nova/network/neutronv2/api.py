@@ -15,6 +15,7 @@
 #    under the License.
 #
 
+import contextlib
 import time
 
 from neutronclient.common import exceptions as neutron_client_exc
@@ -80,6 +81,21 @@ neutron_opts = [
     cfg.StrOpt('neutron_ca_certificates_file',
                 help='Location of CA certificates file to use for '
                      'neutron client requests.'),
+    cfg.IntOpt('neutron_client_pool_size',
+               default=100,
+               help='Maximum number of neutron clients, along with their '
+                    'keep-alive connections, kept idle for reuse by the '
+                    'calls made with the same token. Set to 0 to create a '
+                    'new client for every call'),
+    cfg.IntOpt('neutron_client_pool_idle_timeout',
+               default=60,
+               help='Number of seconds a pooled neutron client may stay '
+                    'unused before it is dropped'),
+    cfg.IntOpt('neutron_client_pool_report_interval',
+               default=600,
+               help='Minimum number of seconds between the reports of the '
+                    'neutron client pool hits and misses in the logs. Set '
+                    'to 0 to disable the reports'),
    ]
 
 CONF = cfg.CONF
@@ -91,6 +107,30 @@ LOG = logging.getLogger(__name__)
 refresh_cache = network_api.refresh_cache
 update_instance_info_cache = network_api.update_instance_cache_with_nw_info
 
+# Maximum number of values given to a single filter of a bulk list call,
+# which keeps the request URLs to a reasonable length.
+_BULK_FILTER_SIZE = 50
+
+
+class _NetworkInfoMemo(object):
+    """Neutron resources used to build the network info of several
+    instances, fetched once for all of them.
+    """
+
+    def __init__(self):
+        # { instance uuid : [port] }
+        self.ports = {}
+        # { (port id, fixed ip address) : [floating ip] }
+        self.floating_ips = {}
+        # { subnet id : subnet }
+        self.subnets = {}
+        # { network id : [dhcp port] }
+        self.dhcp_ports = {}
+        # { network id : network }
+        self.networks = {}
+        # { project id : [network] }
+        self.project_networks = {}
+
 
 class API(base.Base):
     """API for interacting with the neutron 2.x API."""
@@ -486,18 +526,105 @@ class API(base.Base):
                                        update_cells=False)
         return result
 
+    def get_instances_nw_info(self, context, instances):
+        """Return the network information of several instances and update
+        their caches.
+
+        The ports, floating ips, subnets and networks of all the instances
+        are fetched with bulk calls to neutron instead of separate calls
+        for each instance. The refresh_cache lock of every instance is held
+        from then on, so that an interface attached or detached meanwhile
+        is not overwritten with the ports fetched before. The network
+        information of an instance which can't be refreshed is None.
+        """
+        # NOTE: the locks are taken in a fixed order, so that concurrent
+        # bulk refreshes can't deadlock.
+        uuids = sorted(set(instance['uuid'] for instance in instances))
+        locks = [lockutils.lock('refresh_cache-%s' % instance_uuid)
+                 for instance_uuid in uuids]
+        result = []
+        with contextlib.nested(*locks):
+            memo = self._get_network_info_memo(context, instances)
+            for instance in instances:
+                try:
+                    nw_info = self._get_instance_nw_info(context, instance,
+                                                         memo=memo)
+                    update_instance_info_cache(self, context,
+                                               instance,
+                                               nw_info=nw_info,
+                                               update_cells=False)
+                except Exception:
+                    LOG.exception(_('Failed to refresh the network info '
+                                    'cache'), instance=instance)
+                    nw_info = None
+                result.append(nw_info)
+        return result
+
     def _get_instance_nw_info(self, context, instance, networks=None,
-                              port_ids=None):
+                              port_ids=None, memo=None):
         # NOTE(danms): This is an inner method intended to be called
         # by other code that updates instance nwinfo. It *must* be
         # called with the refresh_cache-%(instance_uuid) lock held!
         LOG.debug(_('get_instance_nw_info() for %s'), instance['display_name'])
         nw_info = self._build_network_info_model(context, instance, networks,
-                                                 port_ids)
+                                                 port_ids, memo=memo)
         return network_model.NetworkInfo.hydrate(nw_info)
 
+    def _get_network_info_memo(self, context, instances):
+        """Fetch the neutron resources needed to build the network info of
+        instances, with one bulk call for each kind of resource.
+        """
+        memo = _NetworkInfoMemo()
+        project_ids = dict((instance['uuid'], instance['project_id'])
+                           for instance in instances)
+
+        client = neutronv2.get_client(context, admin=True)
+        ports = _list_by_filter(client.list_ports, 'ports', 'device_id',
+                                project_ids.keys())
+        ports = [port for port in ports
+                 if port['tenant_id'] == project_ids.get(port['device_id'])]
+        for port in ports:
+            memo.ports.setdefault(port['device_id'], []).append(port)
+
+        try:
+            fips = _list_by_filter(client.list_floatingips, 'floatingips',
+                                   'port_id', [port['id'] for port in ports])
+        # If a neutron plugin does not implement the L3 API a 404 from
+        # list_floatingips will be raised.
+        except neutronv2.exceptions.NeutronClientException as e:
+            if e.status_code != 404:
+                raise
+            fips = []
+        for fip in fips:
+            key = (fip['port_id'], fip['fixed_ip_address'])
+            memo.floating_ips.setdefault(key, []).append(fip)
+
+        subnet_ids = set(fixed_ip['subnet_id'] for port in ports
+                         for fixed_ip in port['fixed_ips'])
+        client = neutronv2.get_client(context)
+        subnets = _list_by_filter(client.list_subnets, 'subnets', 'id',
+                                  subnet_ids)
+        memo.subnets = dict((subnet['id'], subnet) for subnet in subnets)
+        dhcp_ports = _list_by_filter(
+            client.list_ports, 'ports', 'network_id',
+            set(subnet['network_id'] for subnet in subnets),
+            device_owner='network:dhcp')
+        for port in dhcp_ports:
+            memo.dhcp_ports.setdefault(port['network_id'], []).append(port)
+
+        net_ids = set()
+        for instance in instances:
+            ifaces = compute_utils.get_nw_info_for_instance(instance)
+            net_ids.update(iface['network']['id'] for iface in ifaces)
+        if net_ids:
+            networks = self._get_available_networks(context, None,
+                                                    list(net_ids),
+                                                    neutron=client)
+            memo.networks = dict((net['id'], net) for net in networks)
+        return memo
+
     def _gather_port_ids_and_networks(self, context, instance, networks=None,
-                                      port_ids=None):
+                                      port_ids=None, memo=None):
         """Return an instance's complete list of port_ids and networks."""
 
         if ((networks is None and port_ids is not None) or
@@ -513,7 +640,17 @@ class API(base.Base):
             port_ids = [iface['id'] for iface in ifaces]
             net_ids = [iface['network']['id'] for iface in ifaces]
 
-        if networks is None:
+        if networks is None and memo is not None:
+            if net_ids:
+                networks = [memo.networks[net_id] for net_id in net_ids
+                            if net_id in memo.networks]
+            else:
+                project_id = instance['project_id']
+                if project_id not in memo.project_networks:
+                    memo.project_networks[project_id] = (
+                        self._get_available_networks(context, project_id))
+                networks = memo.project_networks[project_id]
+        elif networks is None:
             networks = self._get_available_networks(context,
                                                     instance['project_id'],
                                                     net_ids)
@@ -1047,12 +1184,16 @@ class API(base.Base):
         """Force add a network to the project."""
         raise NotImplementedError()
 
-    def _nw_info_get_ips(self, client, port):
+    def _nw_info_get_ips(self, client, port, memo=None):
         network_IPs = []
         for fixed_ip in port['fixed_ips']:
             fixed = network_model.FixedIP(address=fixed_ip['ip_address'])
-            floats = self._get_floating_ips_by_fixed_and_port(
-                client, fixed_ip['ip_address'], port['id'])
+            if memo is None:
+                floats = self._get_floating_ips_by_fixed_and_port(
+                    client, fixed_ip['ip_address'], port['id'])
+            else:
+                floats = memo.floating_ips.get(
+                    (port['id'], fixed_ip['ip_address']), [])
             for ip in floats:
                 fip = network_model.IP(address=ip['floating_ip_address'],
                                        type='floating')
@@ -1060,8 +1201,11 @@ class API(base.Base):
             network_IPs.append(fixed)
         return network_IPs
 
-    def _nw_info_get_subnets(self, context, port, network_IPs):
-        subnets = self._get_subnets_from_port(context, port)
+    def _nw_info_get_subnets(self, context, port, network_IPs, memo=None):
+        if memo is None:
+            subnets = self._get_subnets_from_port(context, port)
+        else:
+            subnets = self._get_subnets_from_port(context, port, memo=memo)
         for subnet in subnets:
             subnet['ips'] = [fixed_ip for fixed_ip in network_IPs
                              if fixed_ip.is_in_subnet(subnet)]
@@ -1117,7 +1261,7 @@ class API(base.Base):
         return network, ovs_interfaceid
 
     def _build_network_info_model(self, context, instance, networks=None,
-                                  port_ids=None):
+                                  port_ids=None, memo=None):
         """Return list of ordered VIFs attached to instance.
 
         :param context - request context.
@@ -1129,16 +1273,22 @@ class API(base.Base):
                           instance in order of attachment. If value is None
                           this value will be populated from the existing
                           cached value.
+        :param memo - _NetworkInfoMemo holding the neutron resources of
+                      the instance. If value is None they are fetched
+                      from neutron.
         """
 
-        search_opts = {'tenant_id': instance['project_id'],
-                       'device_id': instance['uuid'], }
         client = neutronv2.get_client(context, admin=True)
-        data = client.list_ports(**search_opts)
+        if memo is None:
+            search_opts = {'tenant_id': instance['project_id'],
+                           'device_id': instance['uuid'], }
+            data = client.list_ports(**search_opts)
+            current_neutron_ports = data.get('ports', [])
+        else:
+            current_neutron_ports = memo.ports.get(instance['uuid'], [])
 
-        current_neutron_ports = data.get('ports', [])
         networks, port_ids = self._gather_port_ids_and_networks(
-                context, instance, networks, port_ids)
+                context, instance, networks, port_ids, memo=memo)
         nw_info = network_model.NetworkInfo()
 
         current_neutron_port_map = {}
@@ -1155,10 +1305,11 @@ class API(base.Base):
                     vif_active = True
 
                 network_IPs = self._nw_info_get_ips(client,
-                                                    current_neutron_port)
+                                                    current_neutron_port,
+                                                    memo=memo)
                 subnets = self._nw_info_get_subnets(context,
                                                     current_neutron_port,
-                                                    network_IPs)
+                                                    network_IPs, memo=memo)
 
                 devname = "tap" + current_neutron_port['id']
                 devname = devname[:network_model.NIC_NAME_LEN]
@@ -1179,7 +1330,7 @@ class API(base.Base):
 
         return nw_info
 
-    def _get_subnets_from_port(self, context, port):
+    def _get_subnets_from_port(self, context, port, memo=None):
         """Return the subnets for a given port."""
 
         fixed_ips = port['fixed_ips']
@@ -1190,9 +1341,15 @@ class API(base.Base):
         # related to the port. To avoid this, the method returns here.
         if not fixed_ips:
             return []
-        search_opts = {'id': [ip['subnet_id'] for ip in fixed_ips]}
-        data = neutronv2.get_client(context).list_subnets(**search_opts)
-        ipam_subnets = data.get('subnets', [])
+        subnet_ids = [ip['subnet_id'] for ip in fixed_ips]
+        if memo is None:
+            search_opts = {'id': subnet_ids}
+            data = neutronv2.get_client(context).list_subnets(**search_opts)
+            ipam_subnets = data.get('subnets', [])
+        else:
+            ipam_subnets = [memo.subnets[subnet_id]
+                            for subnet_id in sorted(set(subnet_ids))
+                            if subnet_id in memo.subnets]
         subnets = []
 
         for subnet in ipam_subnets:
@@ -1203,10 +1360,14 @@ class API(base.Base):
             }
 
             # attempt to populate DHCP server field
-            search_opts = {'network_id': subnet['network_id'],
-                           'device_owner': 'network:dhcp'}
-            data = neutronv2.get_client(context).list_ports(**search_opts)
-            dhcp_ports = data.get('ports', [])
+            if memo is None:
+                search_opts = {'network_id': subnet['network_id'],
+                               'device_owner': 'network:dhcp'}
+                data = neutronv2.get_client(context).list_ports(
+                    **search_opts)
+                dhcp_ports = data.get('ports', [])
+            else:
+                dhcp_ports = memo.dhcp_ports.get(subnet['network_id'], [])
             for p in dhcp_ports:
                 for ip_pair in p['fixed_ips']:
                     if ip_pair['subnet_id'] == subnet['id']:
@@ -1262,6 +1423,18 @@ class API(base.Base):
         raise NotImplementedError()
 
 
+def _list_by_filter(list_method, resource, key, values, **search_opts):
+    """Return the resources whose key is one of values, listed with as
+    few calls to list_method as the length of the request URLs allows.
+    """
+    values = list(values)
+    result = []
+    for i in range(0, len(values), _BULK_FILTER_SIZE):
+        search_opts[key] = values[i:i + _BULK_FILTER_SIZE]
+        result.extend(list_method(**search_opts).get(resource, []))
+    return result
+
+
 def _ensure_requested_network_ordering(accessor, unordered, preferred):
     """Sort a list with respect to the preferred network ordering."""
     if preferred:
@@ -604,7 +604,8 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
     # Version 1.4: Instance <= version 1.12
     # Version 1.5: Added method get_active_by_window_joined.
     # Version 1.6: Instance <= version 1.13
-    VERSION = '1.6'
+    # Version 1.7: Added method get_uuids_by_info_cache_age.
+    VERSION = '1.7'
 
     fields = {
         'objects': fields.ListOfObjectsField('Instance'),
@@ -617,6 +618,7 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
         '1.4': '1.12',
         '1.5': '1.12',
         '1.6': '1.13',
+        '1.7': '1.13',
         }
 
     @base.remotable_classmethod
@@ -638,6 +640,14 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
         return _make_instance_list(context, cls(), db_inst_list,
                                    expected_attrs)
 
+    @base.remotable_classmethod
+    def get_uuids_by_info_cache_age(cls, context, host, use_slave=False):
+        """Return the uuids of the instances of a host whose network info
+        cache may be healed, least recently refreshed first.
+        """
+        return db.instance_get_uuids_by_info_cache_age(context, host,
+                                                       use_slave=use_slave)
+
     @base.remotable_classmethod
     def get_by_host_and_node(cls, context, host, node, expected_attrs=None):
         db_inst_list = db.instance_get_all_by_host_and_node(
@@ -0,0 +1,100 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory index of the aggregate metadata of each host.
+
+The aggregate filters need the metadata of the aggregates a host belongs
+to, which used to cost one database query per host and per request. The
+index loads every aggregate with a single query and keeps, for each host,
+the same {key: set(values)} dict db.aggregate_metadata_get_by_host
+returns. It is reloaded lazily, on first use after it was invalidated by
+an aggregate API change or after scheduler_aggregate_index_refresh_interval
+seconds.
+"""
+
+from oslo.config import cfg
+
+from nova import db
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+
+aggregate_index_opts = [
+    cfg.IntOpt('scheduler_aggregate_index_refresh_interval',
+               default=60,
+               help='Number of seconds the scheduler may use its index of '
+                    'aggregate metadata before reloading it. The index is '
+                    'also reloaded when the aggregates are changed through '
+                    'the API. A value of 0 reloads it on every request.'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(aggregate_index_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+class AggregateMetadataIndex(object):
+    """Aggregate metadata of each host, loaded in bulk."""
+
+    def __init__(self):
+        # { host : { metadata key : set(values) } }
+        self.host_metadata = {}
+        self.last_refresh = None
+        self.stale = True
+
+    def invalidate(self):
+        """Reload the index the next time it is used."""
+        self.stale = True
+
+    def needs_refresh(self):
+        if self.stale or self.last_refresh is None:
+            return True
+        return timeutils.is_older_than(
+                self.last_refresh,
+                CONF.scheduler_aggregate_index_refresh_interval)
+
+    def refresh(self, context):
+        """Reload the metadata of every aggregate."""
+        # NOTE: clear the flag before querying, so that an invalidation
+        # received while the aggregates are loaded triggers another reload.
+        self.stale = False
+        host_metadata = {}
+        for aggregate in db.aggregate_get_all(context):
+            metadata = aggregate['metadetails']
+            for host in aggregate['hosts']:
+                host_values = host_metadata.setdefault(host, {})
+                for key, value in metadata.iteritems():
+                    host_values.setdefault(key, set()).add(value)
+        self.host_metadata = host_metadata
+        self.last_refresh = timeutils.utcnow()
+        LOG.debug(_("Indexed the aggregate metadata of %d hosts"),
+                  len(host_metadata))
+
+    def get_by_host(self, context, host, key=None):
+        """Return the aggregate metadata of a host.
+
+        The result has the format of db.aggregate_metadata_get_by_host and
+        must not be modified by the caller.
+        """
+        if self.needs_refresh():
+            self.refresh(context)
+        metadata = self.host_metadata.get(host, {})
+        if key is None:
+            return metadata
+        if key in metadata:
+            return {key: metadata[key]}
+        return {}
@@ -13,7 +13,23 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from oslo.config import cfg
+
+from nova import db
 from nova.scheduler import filter_scheduler
+from nova.scheduler import host_state_snapshot
+
+caching_scheduler_opts = [
+    cfg.StrOpt('scheduler_host_state_snapshot_path',
+               help='Path of a compute node snapshot file shared by the '
+                    'caching schedulers running on this host. One of them '
+                    'at a time refreshes it from the database in its '
+                    'periodic task, the others only read it. If unset, '
+                    'each scheduler reads the database itself.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(caching_scheduler_opts)
 
 
 class CachingScheduler(filter_scheduler.FilterScheduler):
@@ -48,15 +64,28 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
     In a similar way, if you have a high number of server deletes, the
     extra capacity from those deletes will not show up until the cache is
     refreshed.
+
+    When scheduler_host_state_snapshot_path is set, the schedulers of a
+    host share one snapshot of the compute nodes, refreshed by a single
+    one of them. Each scheduler picks up a new snapshot on its next
+    request, and keeps the resources it consumed itself on hosts which
+    have not reported since.
     """
 
     def __init__(self, *args, **kwargs):
         super(CachingScheduler, self).__init__(*args, **kwargs)
         self.all_host_states = None
+        self.snapshot = None
+        self.snapshot_generation = None
+        if CONF.scheduler_host_state_snapshot_path:
+            self.snapshot = host_state_snapshot.HostStateSnapshot(
+                    CONF.scheduler_host_state_snapshot_path)
 
     def run_periodic_tasks(self, context):
         """Called from a periodic tasks in the manager."""
         elevated = context.elevated()
+        if self.snapshot is not None and self.snapshot.acquire_writer():
+            self.snapshot.write(db.compute_node_get_all(elevated))
         # NOTE(johngarbutt) Fetching the list of hosts before we get
         # a user request, so no user requests have to wait while we
         # fetch the list of hosts.
@@ -64,6 +93,11 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
 
     def _get_all_host_states(self, context):
         """Called from the filter scheduler, in a template pattern."""
+        if (self.snapshot is not None and self.all_host_states is not None
+                and self.snapshot.get_generation() !=
+                self.snapshot_generation):
+            self.all_host_states = self._get_up_hosts(context)
+
         if self.all_host_states is None:
             # NOTE(johngarbutt) We only get here when we a scheduler request
             # comes in before the first run of the periodic task.
@@ -73,5 +107,15 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
         return self.all_host_states
 
     def _get_up_hosts(self, context):
+        if self.snapshot is not None:
+            generation, compute_nodes = self.snapshot.read(
+                    self.snapshot_generation)
+            if generation is not None:
+                if compute_nodes is None:
+                    return self.all_host_states
+                self.snapshot_generation = generation
+                host_states = self.host_manager.\
+                        get_all_host_states_from_compute_nodes(compute_nodes)
+                return list(host_states)
         all_hosts_iterator = self.host_manager.get_all_host_states(context)
         return list(all_hosts_iterator)
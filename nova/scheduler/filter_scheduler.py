@@ -19,6 +19,8 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import collections
+import heapq
 import random
 
 from oslo.config import cfg
@@ -31,6 +33,7 @@ from nova.openstack.common import log as logging
 from nova.pci import pci_request
 from nova import rpc
 from nova.scheduler import driver
+from nova.scheduler import instance_group_index
 from nova.scheduler import scheduler_options
 from nova.scheduler import utils as scheduler_utils
 
@@ -48,7 +51,14 @@ filter_scheduler_opts = [
                     'chosen from. A value of 1 chooses the '
                     'first host returned by the weighing functions. '
                     'This value must be at least 1. Any value less than 1 '
-                    'will be ignored, and 1 will be used instead')
+                    'will be ignored, and 1 will be used instead'),
+    cfg.BoolOpt('scheduler_batch_placement',
+                default=False,
+                help='Place all instances of a multi-instance request with a '
+                     'single filtering and weighing pass over the hosts. '
+                     'After each placement only the chosen host is filtered '
+                     'and weighed again. Requests with an affinity group '
+                     'policy always use one pass per instance.'),
 ]
 
 CONF.register_opts(filter_scheduler_opts)
@@ -61,6 +71,8 @@ class FilterScheduler(driver.Scheduler):
         self.options = scheduler_options.SchedulerOptions()
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
         self.notifier = rpc.get_notifier('scheduler')
+        self.instance_group_index = (
+                instance_group_index.InstanceGroupHostIndex())
 
     def schedule_run_instance(self, context, request_spec,
                               admin_password, injected_files,
@@ -258,8 +270,7 @@ class FilterScheduler(driver.Scheduler):
                       'instance_uuid': instance_uuid})
             raise exception.NoValidHost(reason=msg)
 
-    @staticmethod
-    def _setup_instance_group(context, filter_properties):
+    def _setup_instance_group(self, context, filter_properties):
         update_group_hosts = False
         scheduler_hints = filter_properties.get('scheduler_hints') or {}
         group_hint = scheduler_hints.get('group', None)
@@ -271,11 +282,19 @@ class FilterScheduler(driver.Scheduler):
                 update_group_hosts = True
                 filter_properties.setdefault('group_hosts', set())
                 user_hosts = set(filter_properties['group_hosts'])
-                group_hosts = set(group.get_hosts(context))
+                group_hosts = self.instance_group_index.get_hosts(context,
+                                                                  group)
                 filter_properties['group_hosts'] = user_hosts | group_hosts
                 filter_properties['group_policies'] = group.policies
+                filter_properties['group_uuid'] = group.uuid
         return update_group_hosts
 
+    def _add_group_host(self, filter_properties, host):
+        filter_properties['group_hosts'].add(host)
+        group_uuid = filter_properties.get('group_uuid')
+        if group_uuid:
+            self.instance_group_index.add_host(group_uuid, host)
+
     def _schedule(self, context, request_spec, filter_properties,
                   instance_uuids=None):
         """Returns a list of hosts that meet the required specs,
@@ -321,6 +340,17 @@ class FilterScheduler(driver.Scheduler):
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+
+        # NOTE: with an affinity policy, placing the first instance changes
+        # which of the other hosts pass the filters, so every host has to be
+        # filtered again for each instance.
+        if (CONF.scheduler_batch_placement and num_instances > 1 and
+                'affinity' not in filter_properties.get('group_policies',
+                                                        [])):
+            return self._schedule_batch(hosts, filter_properties,
+                                        instance_properties, num_instances,
+                                        update_group_hosts)
+
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.get_filtered_hosts(hosts,
@@ -350,7 +380,105 @@ class FilterScheduler(driver.Scheduler):
             # will change for the next instance.
             chosen_host.obj.consume_from_instance(instance_properties)
             if update_group_hosts is True:
-                filter_properties['group_hosts'].add(chosen_host.obj.host)
+                self._add_group_host(filter_properties, chosen_host.obj.host)
+        return selected_hosts
+
+    def _schedule_batch(self, hosts, filter_properties, instance_properties,
+                        num_instances, update_group_hosts):
+        """Returns a list of hosts for num_instances instances, filtering
+        and weighing all hosts only once.
+
+        The weighed hosts are kept in a heap. Once an instance is placed on
+        a host, only that host is filtered and weighed again before going
+        back in the heap. When group hosts are tracked, the other nodes of
+        the same compute host are filtered again as well. All the remaining
+        hosts are weighed again when the new weight of a host can't be
+        compared with the weights of the others.
+        """
+        hosts = self.host_manager.get_filtered_hosts(hosts,
+                filter_properties, index=0)
+        if not hosts:
+            return []
+
+        LOG.debug(_("Filtered %(hosts)s"), {'hosts': hosts})
+
+        # The heap may hold stale entries for a host which has been weighed
+        # again or filtered out since; current maps each host, by its
+        # position in the filtered hosts, to its only valid entry.
+        heap = []
+        current = {}
+        nodes_by_host = collections.defaultdict(list)
+        seqs = {}
+        for seq, host in enumerate(hosts):
+            seqs[id(host)] = seq
+            nodes_by_host[host.host].append(seq)
+
+        def weigh_all(hosts):
+            weighers = self.host_manager.get_weighers()
+            weighed_hosts = self.host_manager.get_weighed_hosts(hosts,
+                    filter_properties, weighers=weighers)
+            LOG.debug(_("Weighed %(hosts)s"), {'hosts': weighed_hosts})
+            del heap[:]
+            current.clear()
+            for weighed_host in weighed_hosts:
+                seq = seqs[id(weighed_host.obj)]
+                entry = (-weighed_host.weight, seq, weighed_host)
+                heap.append(entry)
+                current[seq] = entry
+            heapq.heapify(heap)
+            return weighers
+
+        weighers = weigh_all(hosts)
+
+        scheduler_host_subset_size = max(CONF.scheduler_host_subset_size, 1)
+        selected_hosts = []
+        for num in xrange(num_instances):
+            subset = []
+            while heap and len(subset) < scheduler_host_subset_size:
+                entry = heapq.heappop(heap)
+                if current.get(entry[1]) is entry:
+                    subset.append(entry)
+            if not subset:
+                # Can't get any more locally.
+                break
+
+            chosen = random.choice(subset)
+            for entry in subset:
+                if entry is not chosen:
+                    heapq.heappush(heap, entry)
+            chosen_host = chosen[2]
+            selected_hosts.append(chosen_host)
+
+            # Now consume the resources so the filter/weights
+            # will change for the next instance.
+            chosen_host.obj.consume_from_instance(instance_properties)
+            changed = [chosen[1]]
+            if update_group_hosts is True:
+                self._add_group_host(filter_properties, chosen_host.obj.host)
+                changed = nodes_by_host[chosen_host.obj.host]
+
+            reweighed = []
+            for seq in changed:
+                entry = current.pop(seq, None)
+                if entry is None:
+                    continue
+                host = entry[2].obj
+                if not self.host_manager.get_filtered_hosts([host],
+                        filter_properties, index=num + 1):
+                    continue
+                reweighed.append((seq, host, self.host_manager.reweigh_host(
+                        host, filter_properties, weighers)))
+
+            if any(weighed_host is None
+                   for seq, host, weighed_host in reweighed):
+                weighers = weigh_all(
+                        [entry[2].obj for entry in current.values()] +
+                        [host for seq, host, weighed_host in reweighed])
+                continue
+            for seq, host, weighed_host in reweighed:
+                entry = (-weighed_host.weight, seq, weighed_host)
+                current[seq] = entry
+                heapq.heappush(heap, entry)
         return selected_hosts
 
     def _get_all_host_states(self, context):
@@ -17,11 +17,66 @@
 Scheduler host filters
 """
 
+try:
+    import numpy
+except ImportError:
+    # Vectorized filtering is optional, numpy is not a requirement
+    numpy = None
+
+from oslo.config import cfg
+
 from nova import filters
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+
+scheduler_vectorized_filters_opt = cfg.BoolOpt('scheduler_vectorized_filters',
+        default=False,
+        help='Evaluate the filters that support it against all hosts at '
+             'once using numpy arrays, rather than one host at a time. '
+             'Remaining filters run on the hosts that pass them. '
+             'Requires numpy.')
+
+CONF = cfg.CONF
+CONF.register_opt(scheduler_vectorized_filters_opt)
+
+LOG = logging.getLogger(__name__)
+
+
+class HostStateColumns(object):
+    """Column store of numeric HostState attributes for a list of hosts.
+
+    Columns are built lazily, as numpy float arrays indexed like the host
+    list, the first time a filter asks for them.
+    """
+
+    def __init__(self, host_states):
+        self.host_states = host_states
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def __getitem__(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            column = numpy.fromiter(
+                    (getattr(host_state, name)
+                     for host_state in self.host_states),
+                    dtype=float, count=len(self.host_states))
+            self._columns[name] = column
+        return column
+
+    def hosts_where(self, mask):
+        """Return the host states for which mask is True."""
+        return [self.host_states[i] for i in numpy.flatnonzero(mask)]
 
 
 class BaseHostFilter(filters.BaseFilter):
     """Base class for host filters."""
+
+    # Set to true in a subclass implementing host_passes_vectorized()
+    vectorized = False
+
     def _filter_one(self, obj, filter_properties):
         """Return True if the object passes the filter, otherwise False."""
         return self.host_passes(obj, filter_properties)
@@ -32,10 +87,51 @@ class BaseHostFilter(filters.BaseFilter):
         """
         raise NotImplementedError()
 
+    def host_passes_vectorized(self, columns, filter_properties):
+        """Return a boolean numpy array telling which hosts of a
+        HostStateColumns pass the filter, or None if they all pass.
+        Must give the same result as host_passes() for every host.
+        Override this in a subclass setting vectorized to True.
+        """
+        raise NotImplementedError()
+
 
 class HostFilterHandler(filters.BaseFilterHandler):
     def __init__(self):
         super(HostFilterHandler, self).__init__(BaseHostFilter)
+        if CONF.scheduler_vectorized_filters and numpy is None:
+            LOG.warn(_("scheduler_vectorized_filters is set but numpy is "
+                       "not installed, filtering hosts one at a time"))
+
+    def get_filtered_objects(self, filter_classes, objs,
+            filter_properties, index=0):
+        """Filter hosts, running the vectorized filters first if enabled."""
+        if CONF.scheduler_vectorized_filters and numpy is not None:
+            vectorized_classes = [cls for cls in filter_classes
+                                  if cls.vectorized]
+            if vectorized_classes:
+                objs = self._filter_vectorized(vectorized_classes, objs,
+                                               filter_properties, index)
+                filter_classes = [cls for cls in filter_classes
+                                  if not cls.vectorized]
+        return super(HostFilterHandler, self).get_filtered_objects(
+                filter_classes, objs, filter_properties, index)
+
+    def _filter_vectorized(self, filter_classes, objs, filter_properties,
+                           index):
+        columns = HostStateColumns(list(objs))
+        passes = numpy.ones(len(columns), dtype=bool)
+        for filter_cls in filter_classes:
+            filter = filter_cls()
+            if not filter.run_filter_for_index(index):
+                continue
+            mask = filter.host_passes_vectorized(columns, filter_properties)
+            if mask is not None:
+                passes &= mask
+            LOG.debug(_("Filter %(cls_name)s returned %(obj_len)d host(s)"),
+                      {'cls_name': filter_cls.__name__,
+                       'obj_len': numpy.count_nonzero(passes)})
+        return columns.hosts_where(passes)
 
 
 def all_filters():
@@ -29,6 +29,23 @@ LOG = logging.getLogger(__name__)
 class AffinityFilter(filters.BaseHostFilter):
     def __init__(self):
         self.compute_api = compute.API()
+        # { tuple of instance uuids : set of their hosts }
+        self._instance_hosts = {}
+
+    def _get_instance_hosts(self, context, instance_uuids):
+        """Return the set of hosts the instances are running on.
+
+        A filter is created for each filtering pass, so the instances are
+        only looked up once for all the hosts of a pass.
+        """
+        key = tuple(instance_uuids)
+        if key not in self._instance_hosts:
+            instances = self.compute_api.get_all(context,
+                                                 {'uuid': instance_uuids,
+                                                  'deleted': False})
+            self._instance_hosts[key] = set(instance['host']
+                                            for instance in instances)
+        return self._instance_hosts[key]
 
 
 class DifferentHostFilter(AffinityFilter):
@@ -45,10 +62,8 @@ class DifferentHostFilter(AffinityFilter):
         if isinstance(affinity_uuids, six.string_types):
             affinity_uuids = [affinity_uuids]
         if affinity_uuids:
-            return not self.compute_api.get_all(context,
-                                                {'host': host_state.host,
-                                                 'uuid': affinity_uuids,
-                                                 'deleted': False})
+            return host_state.host not in self._get_instance_hosts(
+                    context, affinity_uuids)
         # With no different_host key
         return True
 
@@ -69,9 +84,8 @@ class SameHostFilter(AffinityFilter):
         if isinstance(affinity_uuids, six.string_types):
             affinity_uuids = [affinity_uuids]
         if affinity_uuids:
-            return self.compute_api.get_all(context, {'host': host_state.host,
-                                                      'uuid': affinity_uuids,
-                                                      'deleted': False})
+            return host_state.host in self._get_instance_hosts(
+                    context, affinity_uuids)
         # With no same_host key
         return True
 
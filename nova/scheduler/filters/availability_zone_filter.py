@@ -15,8 +15,8 @@
 
 from oslo.config import cfg
 
-from nova import db
 from nova.scheduler import filters
+from nova.scheduler.filters import utils
 
 CONF = cfg.CONF
 CONF.import_opt('default_availability_zone', 'nova.availability_zones')
@@ -39,9 +39,8 @@ class AvailabilityZoneFilter(filters.BaseHostFilter):
         availability_zone = props.get('availability_zone')
 
         if availability_zone:
-            context = filter_properties['context'].elevated()
-            metadata = db.aggregate_metadata_get_by_host(
-                         context, host_state.host, key='availability_zone')
+            metadata = utils.aggregate_metadata_get_by_host(
+                    host_state, filter_properties, key='availability_zone')
             if 'availability_zone' in metadata:
                 return availability_zone in metadata['availability_zone']
             else:
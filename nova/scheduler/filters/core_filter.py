@@ -17,10 +17,10 @@
 
 from oslo.config import cfg
 
-from nova import db
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
 from nova.scheduler import filters
+from nova.scheduler.filters import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -67,9 +67,34 @@ class BaseCoreFilter(filters.BaseHostFilter):
 class CoreFilter(BaseCoreFilter):
     """CoreFilter filters based on CPU core utilization."""
 
+    vectorized = True
+
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
         return CONF.cpu_allocation_ratio
 
+    def host_passes_vectorized(self, columns, filter_properties):
+        """Return which hosts have sufficient CPU cores."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return None
+
+        instance_vcpus = instance_type['vcpus']
+        cpu_allocation_ratio = CONF.cpu_allocation_ratio
+        vcpus_total = columns['vcpus_total'] * cpu_allocation_ratio
+
+        # Only provide a VCPU limit to compute if the virt driver is reporting
+        # an accurate count of installed VCPUs. (XenServer driver does not)
+        for host_state in columns.hosts_where(vcpus_total > 0):
+            host_state.limits['vcpu'] = (host_state.vcpus_total *
+                                         cpu_allocation_ratio)
+
+        broken = columns['vcpus_total'] == 0
+        if broken.any():
+            # Fail safe
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+        return broken | (vcpus_total - columns['vcpus_used'] >=
+                         instance_vcpus)
+
 
 class AggregateCoreFilter(BaseCoreFilter):
     """AggregateCoreFilter with per-aggregate CPU subscription flag.
@@ -78,12 +103,8 @@ class AggregateCoreFilter(BaseCoreFilter):
     """
 
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
-        context = filter_properties['context'].elevated()
-        # TODO(uni): DB query in filter is a performance hit, especially for
-        # system with lots of hosts. Will need a general solution here to fix
-        # all filters with aggregate DB call things.
-        metadata = db.aggregate_metadata_get_by_host(
-                     context, host_state.host, key='cpu_allocation_ratio')
+        metadata = utils.aggregate_metadata_get_by_host(
+                host_state, filter_properties, key='cpu_allocation_ratio')
         aggregate_vals = metadata.get('cpu_allocation_ratio', set())
         num_values = len(aggregate_vals)
 
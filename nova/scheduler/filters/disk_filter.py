@@ -31,6 +31,8 @@ CONF.register_opt(disk_allocation_ratio_opt)
 class DiskFilter(filters.BaseHostFilter):
     """Disk Filter with over subscription flag."""
 
+    vectorized = True
+
     def host_passes(self, host_state, filter_properties):
         """Filter based on disk usage."""
         instance_type = filter_properties.get('instance_type')
@@ -56,3 +58,23 @@ class DiskFilter(filters.BaseHostFilter):
         disk_gb_limit = disk_mb_limit / 1024
         host_state.limits['disk_gb'] = disk_gb_limit
         return True
+
+    def host_passes_vectorized(self, columns, filter_properties):
+        """Filter based on disk usage."""
+        instance_type = filter_properties.get('instance_type')
+        requested_disk = (1024 * (instance_type['root_gb'] +
+                                 instance_type['ephemeral_gb']) +
+                         instance_type['swap'])
+        disk_allocation_ratio = CONF.disk_allocation_ratio
+
+        total_usable_disk_mb = columns['total_usable_disk_gb'] * 1024
+        used_disk_mb = total_usable_disk_mb - columns['free_disk_mb']
+        usable_disk_mb = (total_usable_disk_mb * disk_allocation_ratio -
+                          used_disk_mb)
+        passes = usable_disk_mb >= requested_disk
+
+        for host_state in columns.hosts_where(passes):
+            disk_mb_limit = (host_state.total_usable_disk_gb * 1024 *
+                             disk_allocation_ratio)
+            host_state.limits['disk_gb'] = disk_mb_limit / 1024
+        return passes
@@ -32,6 +32,8 @@ CONF.register_opt(max_io_ops_per_host_opt)
 class IoOpsFilter(filters.BaseHostFilter):
     """Filter out hosts with too many concurrent I/O operations."""
 
+    vectorized = True
+
     def host_passes(self, host_state, filter_properties):
         """Use information about current vm and task states collected from
         compute node statistics to decide whether to filter.
@@ -45,3 +47,6 @@ class IoOpsFilter(filters.BaseHostFilter):
                         {'host_state': host_state,
                          'max_io_ops': max_io_ops})
         return passes
+
+    def host_passes_vectorized(self, columns, filter_properties):
+        return columns['num_io_ops'] < CONF.max_io_ops_per_host
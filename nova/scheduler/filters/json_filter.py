@@ -14,66 +14,136 @@
 #    under the License.
 
 
+import collections
 import operator
 import six
 
 from nova.openstack.common import jsonutils
 from nova.scheduler import filters
 
+# Maximum number of compiled queries kept, least recently used first out
+QUERY_CACHE_SIZE = 256
+
+
+def _op_compare(args, op):
+    """Returns True if the specified operator can successfully
+    compare the first item in the args with all the rest. Will
+    return False if only one item is in the list.
+    """
+    if len(args) < 2:
+        return False
+    if op is operator.contains:
+        bad = args[0] not in args[1:]
+    else:
+        bad = [arg for arg in args[1:]
+                if not op(args[0], arg)]
+    return not bool(bad)
+
+
+def _equals(args):
+    """First term is == all the other terms."""
+    return _op_compare(args, operator.eq)
+
+
+def _less_than(args):
+    """First term is < all the other terms."""
+    return _op_compare(args, operator.lt)
+
+
+def _greater_than(args):
+    """First term is > all the other terms."""
+    return _op_compare(args, operator.gt)
+
+
+def _in(args):
+    """First term is in set of remaining terms."""
+    return _op_compare(args, operator.contains)
+
+
+def _less_than_equal(args):
+    """First term is <= all the other terms."""
+    return _op_compare(args, operator.le)
+
+
+def _greater_than_equal(args):
+    """First term is >= all the other terms."""
+    return _op_compare(args, operator.ge)
+
+
+def _not(args):
+    """Flip each of the arguments."""
+    return [not arg for arg in args]
+
+
+def _or(args):
+    """True if any arg is True."""
+    return any(args)
+
+
+def _and(args):
+    """True if all args are True."""
+    return all(args)
+
+
+def _parse_string(string, host_state):
+    """Strings prefixed with $ are capability lookups in the
+    form '$variable' where 'variable' is an attribute in the
+    HostState class.  If $variable is a dictionary, you may
+    use: $variable.dictkey
+    """
+    if not string:
+        return None
+    if not string.startswith("$"):
+        return string
+
+    path = string[1:].split(".")
+    obj = getattr(host_state, path[0], None)
+    if obj is None:
+        return None
+    for item in path[1:]:
+        obj = obj.get(item, None)
+        if obj is None:
+            return None
+    return obj
+
+
+def _compile_arg(commands, arg):
+    """Return a function of a host state giving the value of arg."""
+    if isinstance(arg, list):
+        return _compile_filter(commands, arg)
+    if isinstance(arg, six.string_types) and arg.startswith("$"):
+        return lambda host_state: _parse_string(arg, host_state)
+    if isinstance(arg, six.string_types):
+        arg = _parse_string(arg, None)
+    return lambda host_state: arg
+
+
+def _compile_filter(commands, query):
+    """Turn the query structure into nested functions of a host state
+    evaluating it with the given commands.
+    """
+    if not query:
+        return lambda host_state: True
+    method = commands[query[0]]
+    args = [_compile_arg(commands, arg) for arg in query[1:]]
+
+    def evaluate(host_state):
+        cooked_args = []
+        for arg in args:
+            value = arg(host_state)
+            if value is not None:
+                cooked_args.append(value)
+        return method(cooked_args)
+    return evaluate
+
 
 class JsonFilter(filters.BaseHostFilter):
     """Host Filter to allow simple JSON-based grammar for
     selecting hosts.
     """
-    def _op_compare(self, args, op):
-        """Returns True if the specified operator can successfully
-        compare the first item in the args with all the rest. Will
-        return False if only one item is in the list.
-        """
-        if len(args) < 2:
-            return False
-        if op is operator.contains:
-            bad = args[0] not in args[1:]
-        else:
-            bad = [arg for arg in args[1:]
-                    if not op(args[0], arg)]
-        return not bool(bad)
-
-    def _equals(self, args):
-        """First term is == all the other terms."""
-        return self._op_compare(args, operator.eq)
-
-    def _less_than(self, args):
-        """First term is < all the other terms."""
-        return self._op_compare(args, operator.lt)
-
-    def _greater_than(self, args):
-        """First term is > all the other terms."""
-        return self._op_compare(args, operator.gt)
-
-    def _in(self, args):
-        """First term is in set of remaining terms."""
-        return self._op_compare(args, operator.contains)
-
-    def _less_than_equal(self, args):
-        """First term is <= all the other terms."""
-        return self._op_compare(args, operator.le)
-
-    def _greater_than_equal(self, args):
-        """First term is >= all the other terms."""
-        return self._op_compare(args, operator.ge)
-
-    def _not(self, args):
-        """Flip each of the arguments."""
-        return [not arg for arg in args]
-
-    def _or(self, args):
-        """True if any arg is True."""
-        return any(args)
-
-    def _and(self, args):
-        """True if all args are True."""
-        return all(args)
+
+    # Compiled queries by (filter class, query text), shared by requests
+    _compiled_queries = collections.OrderedDict()
 
     commands = {
         '=': _equals,
@@ -87,43 +157,22 @@ class JsonFilter(filters.BaseHostFilter):
         'and': _and,
     }
 
-    def _parse_string(self, string, host_state):
-        """Strings prefixed with $ are capability lookups in the
-        form '$variable' where 'variable' is an attribute in the
-        HostState class.  If $variable is a dictionary, you may
-        use: $variable.dictkey
-        """
-        if not string:
-            return None
-        if not string.startswith("$"):
-            return string
-
-        path = string[1:].split(".")
-        obj = getattr(host_state, path[0], None)
-        if obj is None:
-            return None
-        for item in path[1:]:
-            obj = obj.get(item, None)
-            if obj is None:
-                return None
-        return obj
-
-    def _process_filter(self, query, host_state):
-        """Recursively parse the query structure."""
-        if not query:
-            return True
-        cmd = query[0]
-        method = self.commands[cmd]
-        cooked_args = []
-        for arg in query[1:]:
-            if isinstance(arg, list):
-                arg = self._process_filter(arg, host_state)
-            elif isinstance(arg, six.string_types):
-                arg = self._parse_string(arg, host_state)
-            if arg is not None:
-                cooked_args.append(arg)
-        result = method(self, cooked_args)
-        return result
+    def _get_compiled_query(self, query):
+        # A filter instance is used for a single request, so avoid the
+        # shared cache lookups for all the hosts after the first one.
+        if getattr(self, '_last_query', None) == query:
+            return self._last_compiled
+
+        key = (self.__class__, query)
+        compiled = self._compiled_queries.pop(key, None)
+        if compiled is None:
+            compiled = _compile_filter(self.commands, jsonutils.loads(query))
+            if len(self._compiled_queries) >= QUERY_CACHE_SIZE:
+                self._compiled_queries.popitem(last=False)
+        self._compiled_queries[key] = compiled
+        self._last_query = query
+        self._last_compiled = compiled
+        return compiled
 
     def host_passes(self, host_state, filter_properties):
         """Return a list of hosts that can fulfill the requirements
@@ -139,7 +188,7 @@ class JsonFilter(filters.BaseHostFilter):
         # NOTE(comstud): Not checking capabilities or service for
         # enabled/disabled so that a provided json filter can decide
 
-        result = self._process_filter(jsonutils.loads(query), host_state)
+        result = self._get_compiled_query(query)(host_state)
         if isinstance(result, list):
             # If any succeeded, include the host
             result = any(result)
@@ -32,6 +32,8 @@ CONF.register_opt(max_instances_per_host_opt)
 class NumInstancesFilter(filters.BaseHostFilter):
     """Filter out hosts with too many instances."""
 
+    vectorized = True
+
     def host_passes(self, host_state, filter_properties):
         num_instances = host_state.num_instances
         max_instances = CONF.max_instances_per_host
@@ -42,3 +44,6 @@ class NumInstancesFilter(filters.BaseHostFilter):
                         {'host_state': host_state,
                          'max_instances': max_instances})
         return passes
+
+    def host_passes_vectorized(self, columns, filter_properties):
+        return columns['num_instances'] < CONF.max_instances_per_host
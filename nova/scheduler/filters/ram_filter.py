@@ -16,10 +16,10 @@
 
 from oslo.config import cfg
 
-from nova import db
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
 from nova.scheduler import filters
+from nova.scheduler.filters import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -68,9 +68,28 @@ class BaseRamFilter(filters.BaseHostFilter):
 class RamFilter(BaseRamFilter):
     """Ram Filter with over subscription flag."""
 
+    vectorized = True
+
     def _get_ram_allocation_ratio(self, host_state, filter_properties):
         return CONF.ram_allocation_ratio
 
+    def host_passes_vectorized(self, columns, filter_properties):
+        """Only return hosts with sufficient available RAM."""
+        instance_type = filter_properties.get('instance_type')
+        requested_ram = instance_type['memory_mb']
+        ram_allocation_ratio = CONF.ram_allocation_ratio
+
+        total_usable_ram_mb = columns['total_usable_ram_mb']
+        used_ram_mb = total_usable_ram_mb - columns['free_ram_mb']
+        usable_ram = total_usable_ram_mb * ram_allocation_ratio - used_ram_mb
+        passes = usable_ram >= requested_ram
+
+        # save oversubscription limit for compute node to test against:
+        for host_state in columns.hosts_where(passes):
+            host_state.limits['memory_mb'] = (host_state.total_usable_ram_mb *
+                                              ram_allocation_ratio)
+        return passes
+
 
 class AggregateRamFilter(BaseRamFilter):
     """AggregateRamFilter with per-aggregate ram subscription flag.
@@ -79,12 +98,8 @@ class AggregateRamFilter(BaseRamFilter):
     """
 
     def _get_ram_allocation_ratio(self, host_state, filter_properties):
-        context = filter_properties['context'].elevated()
-        # TODO(uni): DB query in filter is a performance hit, especially for
-        # system with lots of hosts. Will need a general solution here to fix
-        # all filters with aggregate DB call things.
-        metadata = db.aggregate_metadata_get_by_host(
-                     context, host_state.host, key='ram_allocation_ratio')
+        metadata = utils.aggregate_metadata_get_by_host(
+                host_state, filter_properties, key='ram_allocation_ratio')
         aggregate_vals = metadata.get('ram_allocation_ratio', set())
         num_values = len(aggregate_vals)
 
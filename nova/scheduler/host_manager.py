@@ -18,6 +18,7 @@ Manage hosts in the current zone.
 """
 
 import collections
+import datetime
 import UserDict
 
 from oslo.config import cfg
@@ -32,9 +33,14 @@ from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.pci import pci_request
 from nova.pci import pci_stats
+from nova.scheduler import aggregate_index
 from nova.scheduler import filters
 from nova.scheduler import weights
 
+# Incremental syncs look this far back before the newest timestamp seen so
+# far, to pick up rows whose transaction committed after a newer one did.
+_CHANGED_SINCE_MARGIN = datetime.timedelta(seconds=5)
+
 host_manager_opts = [
     cfg.MultiStrOpt('scheduler_available_filters',
             default=['nova.scheduler.filters.all_filters'],
@@ -58,6 +64,23 @@ host_manager_opts = [
     cfg.ListOpt('scheduler_weight_classes',
                 default=['nova.scheduler.weights.all_weighers'],
                 help='Which weight class names to use for weighing hosts'),
+    cfg.IntOpt('scheduler_host_state_full_sync_interval',
+               default=0,
+               help='Number of seconds between full reloads of the compute '
+                    'node table by the scheduler. In between, only compute '
+                    'nodes created, updated or deleted since the previous '
+                    'sync are fetched. A value of 0 reloads every compute '
+                    'node on every request. Changes committed more than a '
+                    'few seconds after their timestamp, for instance '
+                    'because of clock skew between compute hosts, are only '
+                    'picked up by the next full reload.'),
+    cfg.IntOpt('scheduler_host_state_max_staleness',
+               default=0,
+               help='Number of seconds the scheduler may reuse its host '
+                    'states without checking the database for changed '
+                    'compute nodes. Only used when '
+                    'scheduler_host_state_full_sync_interval is greater '
+                    'than 0.'),
     ]
 
 CONF = cfg.CONF
@@ -124,6 +147,10 @@ class HostState(object):
         self.vcpus_total = 0
         self.vcpus_used = 0
 
+        # Aggregate metadata of the hosts, shared by the host states of a
+        # HostManager. The aggregate filters query the database if unset.
+        self.aggregate_index = None
+
         # Additional host information from the compute node stats:
         self.vm_states = {}
         self.task_states = {}
@@ -331,6 +358,13 @@ class HostManager(object):
         # { (host, hypervisor_hostname) : { <service> : { cap k : v }}}
         self.service_states = {}
         self.host_state_map = {}
+        # { compute_node_id : ((host, hypervisor_hostname), service_id) }
+        self.compute_node_map = {}
+        self.last_full_sync = None
+        self.last_sync = None
+        # Newest created_at/updated_at/deleted_at seen in compute nodes
+        self.changed_since = None
+        self.aggregate_index = aggregate_index.AggregateMetadataIndex()
         self.filter_handler = filters.HostFilterHandler()
         self.filter_classes = self.filter_handler.get_matching_classes(
                 CONF.scheduler_available_filters)
@@ -435,47 +469,161 @@ class HostManager(object):
         return self.filter_handler.get_filtered_objects(filter_classes,
                 hosts, filter_properties, index)
 
-    def get_weighed_hosts(self, hosts, weight_properties):
-        """Weigh the hosts."""
+    def get_weighed_hosts(self, hosts, weight_properties, weighers=None):
+        """Weigh the hosts.
+
+        weighers, from get_weighers(), can be given to weigh the hosts with
+        weigher instances that reweigh_host() can use afterwards.
+        """
+        if weighers is not None:
+            return self.weight_handler.get_weighed_objects_with_weighers(
+                    weighers, hosts, weight_properties)
         return self.weight_handler.get_weighed_objects(self.weight_classes,
                 hosts, weight_properties)
 
+    def get_weighers(self):
+        """Return new instances of the weigher classes."""
+        return [weigher_cls() for weigher_cls in self.weight_classes]
+
+    def reweigh_host(self, host, weight_properties, weighers):
+        """Weigh a single host again after its state changed.
+
+        The weight is comparable with the weights of the hosts weighed by
+        get_weighed_hosts() with the same weighers. None is returned when
+        the hosts must all be weighed again instead.
+        """
+        return self.weight_handler.reweigh_object(weighers, host,
+                                                  weight_properties)
+
     def get_all_host_states(self, context):
         """Returns a list of HostStates that represents all the hosts
         the HostManager knows about. Also, each of the consumable resources
         in HostState are pre-populated and adjusted based on data in the db.
+
+        If scheduler_host_state_full_sync_interval is set, the compute node
+        table is only fully loaded once per interval; in between, only the
+        compute nodes changed since the previous sync are fetched and applied
+        to the existing HostStates.
         """
+        full_sync_interval = CONF.scheduler_host_state_full_sync_interval
+        if (full_sync_interval <= 0 or self.changed_since is None or
+                timeutils.is_older_than(self.last_full_sync,
+                                        full_sync_interval)):
+            self._sync_all_host_states(context)
+        elif timeutils.is_older_than(self.last_sync,
+                CONF.scheduler_host_state_max_staleness):
+            self._sync_changed_host_states(context)
 
-        # Get resource usage across the available compute nodes:
-        compute_nodes = db.compute_node_get_all(context)
+        return self.host_state_map.itervalues()
+
+    def _update_host_state(self, compute, service):
+        host = service['host']
+        node = compute.get('hypervisor_hostname')
+        state_key = (host, node)
+        capabilities = self.service_states.get(state_key, None)
+        host_state = self.host_state_map.get(state_key)
+        if host_state:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+        else:
+            host_state = self.host_state_cls(host, node,
+                    capabilities=capabilities,
+                    service=dict(service.iteritems()))
+            host_state.aggregate_index = self.aggregate_index
+            self.host_state_map[state_key] = host_state
+        host_state.update_from_compute_node(compute)
+        self.compute_node_map[compute['id']] = (state_key,
+                                                compute.get('service_id'))
+        return state_key
+
+    def _remove_dead_node(self, state_key):
+        host, node = state_key
+        LOG.info(_("Removing dead compute node %(host)s:%(node)s "
+                   "from scheduler") % {'host': host, 'node': node})
+        del self.host_state_map[state_key]
+
+    def _track_changes(self, compute_nodes):
+        for compute in compute_nodes:
+            for key in ('created_at', 'updated_at', 'deleted_at'):
+                changed_at = compute.get(key)
+                if changed_at and (self.changed_since is None or
+                                   changed_at > self.changed_since):
+                    self.changed_since = changed_at
+
+    def get_all_host_states_from_compute_nodes(self, compute_nodes):
+        """Like get_all_host_states(), from already fetched compute nodes.
+
+        compute_nodes is the full list returned by db.compute_node_get_all;
+        HostStates of the nodes missing from it are removed.
+        """
+        self._sync_all_host_states(None, compute_nodes)
+        return self.host_state_map.itervalues()
+
+    def _sync_all_host_states(self, context, compute_nodes=None):
+        """Rebuild the HostStates from the full compute node table."""
+
+        if compute_nodes is None:
+            # Get resource usage across the available compute nodes:
+            compute_nodes = db.compute_node_get_all(context)
         seen_nodes = set()
+        self.compute_node_map = {}
         for compute in compute_nodes:
             service = compute['service']
             if not service:
                 LOG.warn(_("No service for compute ID %s") % compute['id'])
                 continue
-            host = service['host']
-            node = compute.get('hypervisor_hostname')
-            state_key = (host, node)
-            capabilities = self.service_states.get(state_key, None)
-            host_state = self.host_state_map.get(state_key)
-            if host_state:
-                host_state.update_capabilities(capabilities,
-                                               dict(service.iteritems()))
-            else:
-                host_state = self.host_state_cls(host, node,
-                        capabilities=capabilities,
-                        service=dict(service.iteritems()))
-                self.host_state_map[state_key] = host_state
-            host_state.update_from_compute_node(compute)
-            seen_nodes.add(state_key)
+            seen_nodes.add(self._update_host_state(compute, service))
 
         # remove compute nodes from host_state_map if they are not active
         dead_nodes = set(self.host_state_map.keys()) - seen_nodes
         for state_key in dead_nodes:
-            host, node = state_key
-            LOG.info(_("Removing dead compute node %(host)s:%(node)s "
-                       "from scheduler") % {'host': host, 'node': node})
-            del self.host_state_map[state_key]
+            self._remove_dead_node(state_key)
 
-        return self.host_state_map.itervalues()
+        # The watermark for the following incremental syncs comes from the
+        # rows themselves, so the scheduler clock is never compared with
+        # timestamps written by other hosts.
+        self.changed_since = None
+        self._track_changes(compute_nodes)
+        self.last_full_sync = self.last_sync = timeutils.utcnow()
+
+    def _sync_changed_host_states(self, context):
+        """Apply compute nodes changed since the previous sync.
+
+        Services are always refreshed, as they carry the heartbeat used to
+        tell whether a host is up.
+        """
+        compute_nodes, services = db.compute_node_get_all_changed_since(
+                context, self.changed_since - _CHANGED_SINCE_MARGIN)
+        for compute in compute_nodes:
+            known = self.compute_node_map.get(compute['id'])
+            service = compute['service']
+            if compute.get('deleted') or not service:
+                if known:
+                    del self.compute_node_map[compute['id']]
+                    if known[0] in self.host_state_map:
+                        self._remove_dead_node(known[0])
+                continue
+            if known and known[0] != (service['host'],
+                                      compute.get('hypervisor_hostname')):
+                # The node was renamed or moved to another service
+                if known[0] in self.host_state_map:
+                    self._remove_dead_node(known[0])
+            self._update_host_state(compute, service)
+
+        services = dict((service['id'], service) for service in services)
+        for compute_id, (state_key, service_id) in (
+                self.compute_node_map.items()):
+            service = services.get(service_id)
+            if service is None:
+                del self.compute_node_map[compute_id]
+                if state_key in self.host_state_map:
+                    self._remove_dead_node(state_key)
+                continue
+            host_state = self.host_state_map.get(state_key)
+            if host_state:
+                host_state.update_capabilities(
+                        self.service_states.get(state_key, None),
+                        dict(service.iteritems()))
+
+        self._track_changes(compute_nodes)
+        self.last_sync = timeutils.utcnow()
@@ -0,0 +1,146 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Snapshot of the compute node table shared by the schedulers of a host.
+
+The snapshot is a single file holding a header (magic, generation and
+payload length) followed by the compute nodes, with their services, as
+returned by db.compute_node_get_all. One writer, elected with a
+non-blocking file lock, replaces the file atomically on each refresh.
+Readers read the header first, and only read and decode the payload when
+the generation differs from the one they last loaded.
+"""
+
+import errno
+import fcntl
+import os
+import struct
+import tempfile
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+
+LOG = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!8sQQ')
+_MAGIC = 'novahs01'
+_DATETIME_KEYS = ('created_at', 'updated_at', 'deleted_at')
+
+
+def _parse_datetimes(values):
+    for key in _DATETIME_KEYS:
+        if values.get(key):
+            values[key] = timeutils.parse_strtime(values[key])
+
+
+class HostStateSnapshot(object):
+    """A versioned compute node snapshot file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_file = None
+
+    def acquire_writer(self):
+        """Try to become the single writer of the snapshot.
+
+        The lock is kept until this process exits, so that another
+        process takes over the refreshes only if the writer dies.
+
+        :returns: True if this process is the writer.
+        """
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            lock_file.close()
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        LOG.info(_("Refreshing the host state snapshot %s"), self.path)
+        self._lock_file = lock_file
+        return True
+
+    def _read_header(self, snapshot):
+        magic, generation, length = _HEADER.unpack_from(snapshot)
+        if magic != _MAGIC:
+            raise ValueError(_("%s is not a host state snapshot") %
+                             self.path)
+        return generation, length
+
+    def get_generation(self):
+        """Return the generation of the snapshot, or None if missing."""
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(_HEADER.size)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        if len(header) < _HEADER.size:
+            return None
+        return self._read_header(header)[0]
+
+    def write(self, compute_nodes):
+        """Replace the snapshot with a new generation of compute nodes.
+
+        :returns: the new generation
+        """
+        generation = (self.get_generation() or 0) + 1
+        payload = jsonutils.dumps(compute_nodes)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                        prefix='.host-states-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, generation, len(payload)))
+                f.write(payload)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return generation
+
+    def read(self, known_generation=None):
+        """Read the compute nodes of the snapshot.
+
+        :param known_generation: generation already loaded by the caller
+        :returns: a (generation, compute_nodes) tuple. compute_nodes is None
+                  if the generation is known_generation, and both are None
+                  if there is no snapshot yet.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None, None
+            raise
+        with f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return None, None
+            generation, length = self._read_header(header)
+            if generation == known_generation:
+                return generation, None
+            compute_nodes = jsonutils.loads(f.read(length))
+
+        for compute in compute_nodes:
+            _parse_datetimes(compute)
+            if compute.get('service'):
+                _parse_datetimes(compute['service'])
+        return generation, compute_nodes
@@ -0,0 +1,75 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory index of the hosts chosen for the members of each instance group.
+
+The hosts of the members of a group are loaded with a single query on
+each request, so that members which were migrated, evacuated or deleted
+are accounted on the host they are on now. A member only shows a host
+once its compute node starts building it though, so the hosts chosen by
+the scheduler are remembered until a member shows up on them, or for at
+most scheduler_instance_group_placement_timeout seconds.
+"""
+
+from oslo.config import cfg
+
+from nova.openstack.common import timeutils
+
+instance_group_index_opts = [
+    cfg.IntOpt('scheduler_instance_group_placement_timeout',
+               default=60,
+               help='Number of seconds for which a host chosen for a member '
+                    'of an instance group counts as a host of the group '
+                    'before the member shows up on it.'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(instance_group_index_opts)
+
+
+class InstanceGroupHostIndex(object):
+    """Hosts chosen for the members of each instance group."""
+
+    def __init__(self):
+        # { group uuid : { host : time it was chosen } }
+        self.placed_hosts = {}
+
+    def _expire(self):
+        timeout = CONF.scheduler_instance_group_placement_timeout
+        for group_uuid, placed_hosts in self.placed_hosts.items():
+            for host, placed_at in placed_hosts.items():
+                if timeutils.is_older_than(placed_at, timeout):
+                    del placed_hosts[host]
+            if not placed_hosts:
+                del self.placed_hosts[group_uuid]
+
+    def get_hosts(self, context, group):
+        """Return the set of hosts of the members of group."""
+        hosts = set(group.get_hosts(context))
+        self._expire()
+        placed_hosts = self.placed_hosts.get(group.uuid)
+        if placed_hosts:
+            # NOTE: A host a member showed up on is known from the members
+            # from now on, even once the member moves away.
+            for host in hosts.intersection(placed_hosts):
+                del placed_hosts[host]
+            hosts.update(placed_hosts)
+        return hosts
+
+    def add_host(self, group_uuid, host):
+        """Record that a member of a group was placed on host."""
+        self.placed_hosts.setdefault(group_uuid, {})[host] = (
+                timeutils.utcnow())
@@ -298,10 +298,14 @@ class SchedulerManager(manager.Manager):
             filter_properties)
         return jsonutils.to_primitive(dests)
 
+    def aggregates_changed(self, context):
+        """Reload the aggregate metadata on the next request."""
+        self.driver.host_manager.aggregate_index.invalidate()
+
 
 class _SchedulerManagerV3Proxy(object):
 
-    target = messaging.Target(version='3.0')
+    target = messaging.Target(version='3.1')
 
     def __init__(self, manager):
         self.manager = manager
@@ -326,3 +330,6 @@ class _SchedulerManagerV3Proxy(object):
                 instance_type=instance_type, image=image,
                 request_spec=request_spec, filter_properties=filter_properties,
                 reservations=reservations)
+
+    def aggregates_changed(self, ctxt):
+        return self.manager.aggregates_changed(ctxt)
@@ -80,6 +80,7 @@ class SchedulerAPI(object):
         ... - Deprecated select_hosts()
 
         3.0 - Removed backwards compat
+        3.1 - Added aggregates_changed()
     '''
 
     VERSION_ALIASES = {
@@ -102,6 +103,14 @@ class SchedulerAPI(object):
         return cctxt.call(ctxt, 'select_destinations',
             request_spec=request_spec, filter_properties=filter_properties)
 
+    def aggregates_changed(self, ctxt):
+        # NOTE: schedulers older than 3.1 only reload their aggregate
+        # metadata periodically.
+        if not self.client.can_send_version('3.1'):
+            return
+        cctxt = self.client.prepare(fanout=True, version='3.1')
+        cctxt.cast(ctxt, 'aggregates_changed')
+
     def run_instance(self, ctxt, request_spec, admin_password,
             injected_files, requested_networks, is_first_time,
             filter_properties, legacy_bdm_in_spec=True):
@@ -32,6 +32,7 @@ from nova.api.openstack.compute import ips
 from nova.api.openstack.compute import servers
 from nova.api.openstack.compute import views
 from nova.api.openstack import extensions
+from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
 from nova import block_device
 from nova.compute import api as compute_api
@@ -617,12 +618,94 @@ class ServersControllerTest(ControllerTest):
         self.assertRaises(webob.exc.HTTPBadRequest,
                           self.controller.index, req)
 
+    def test_get_servers_index_loads_no_joined_attrs(self):
+        calls = []
+
+        def fake_get_all(compute_self, context, search_opts=None,
+                         sort_key=None, sort_dir='desc',
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
+            calls.append(default_attrs)
+            return instance_obj.InstanceList(objects=[])
+
+        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+
+        req = fakes.HTTPRequest.blank('/fake/servers')
+        self.controller.index(req)
+        req = fakes.HTTPRequest.blank('/fake/servers/detail')
+        self.controller.detail(req)
+        self.assertEqual([False, True], calls)
+
+    def test_get_servers_paged(self):
+        self.flags(osapi_compute_server_list_page_size=2)
+        req = fakes.HTTPRequest.blank('/fake/servers/detail')
+        resp_obj = self.controller.detail(req)
+
+        self.assertIsInstance(resp_obj, wsgi.StreamingResponseObject)
+        self.assertEqual('servers', resp_obj.collection_name)
+        pages = [[server['id'] for server in page]
+                 for page in resp_obj.pages]
+        self.assertEqual([[fakes.get_fake_uuid(0), fakes.get_fake_uuid(1)],
+                          [fakes.get_fake_uuid(2), fakes.get_fake_uuid(3)],
+                          [fakes.get_fake_uuid(4)]], pages)
+        self.assertEqual([], resp_obj.get_links())
+
+    def test_get_servers_paged_reads_deleted_markers(self):
+        self.flags(osapi_compute_server_list_page_size=2)
+        calls = []
+        orig_get_all = compute_api.API.get_all
+
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
+            calls.append((kwargs['marker'],
+                          search_opts.get('deleted_marker', False)))
+            return orig_get_all(compute_self, context,
+                                search_opts=search_opts, **kwargs)
+
+        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+
+        req = fakes.HTTPRequest.blank('/fake/servers')
+        resp_obj = self.controller.index(req)
+        list(resp_obj.pages)
+        self.assertEqual([(None, False),
+                          (fakes.get_fake_uuid(1), True),
+                          (fakes.get_fake_uuid(3), True)], calls)
+
+    def test_get_servers_paged_with_limit(self):
+        self.flags(osapi_compute_server_list_page_size=2)
+        req = fakes.HTTPRequest.blank('/fake/servers?limit=3')
+        resp_obj = self.controller.index(req)
+
+        pages = [[server['id'] for server in page]
+                 for page in resp_obj.pages]
+        self.assertEqual([[fakes.get_fake_uuid(0), fakes.get_fake_uuid(1)],
+                          [fakes.get_fake_uuid(2)]], pages)
+        servers_links = resp_obj.get_links()
+        self.assertEqual(servers_links[0]['rel'], 'next')
+        href_parts = urlparse.urlparse(servers_links[0]['href'])
+        params = urlparse.parse_qs(href_parts.query)
+        expected_params = {'limit': ['3'],
+                           'marker': [fakes.get_fake_uuid(2)]}
+        self.assertThat(params, matchers.DictMatches(expected_params))
+
+    def test_get_servers_paged_not_used_for_short_lists(self):
+        self.flags(osapi_compute_server_list_page_size=2)
+        req = fakes.HTTPRequest.blank('/fake/servers?limit=2')
+        res_dict = self.controller.index(req)
+        self.assertEqual(2, len(res_dict['servers']))
+
+    def test_get_servers_paged_with_bad_marker(self):
+        self.flags(osapi_compute_server_list_page_size=2)
+        req = fakes.HTTPRequest.blank('/fake/servers?marker=foo')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.index, req)
+
     def test_get_servers_with_bad_option(self):
         server_uuid = str(uuid.uuid4())
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             db_list = [fakes.stub_instance(100, uuid=server_uuid)]
             return instance_obj._make_instance_list(
                 context, instance_obj.InstanceList(), db_list, FIELDS)
@@ -640,7 +723,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('image', search_opts)
             self.assertEqual(search_opts['image'], '12345')
@@ -823,7 +907,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('flavor', search_opts)
             # flavor is an integer ID
@@ -857,7 +942,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('vm_state', search_opts)
             self.assertEqual(search_opts['vm_state'], [vm_states.ACTIVE])
@@ -879,7 +965,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('task_state', search_opts)
             self.assertEqual([task_states.REBOOT_PENDING,
@@ -905,7 +992,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIn('vm_state', search_opts)
             self.assertEqual(search_opts['vm_state'],
                              [vm_states.ACTIVE, vm_states.STOPPED])
@@ -940,7 +1028,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIn('vm_state', search_opts)
             self.assertEqual(search_opts['vm_state'], ['deleted'])
 
@@ -962,7 +1051,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('name', search_opts)
             self.assertEqual(search_opts['name'], 'whee.*')
@@ -983,7 +1073,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('changes-since', search_opts)
             changes_since = datetime.datetime(2011, 1, 24, 17, 8, 1,
@@ -1017,7 +1108,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             # Allowed by user
             self.assertIn('name', search_opts)
@@ -1048,7 +1140,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             # Allowed by user
             self.assertIn('name', search_opts)
@@ -1077,7 +1170,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('ip', search_opts)
             self.assertEqual(search_opts['ip'], '10\..*')
@@ -1101,7 +1195,8 @@ class ServersControllerTest(ControllerTest):
 
         def fake_get_all(compute_self, context, search_opts=None,
                          sort_key=None, sort_dir='desc',
-                         limit=None, marker=None, want_objects=False):
+                         limit=None, marker=None, want_objects=False,
+                         default_attrs=True):
             self.assertIsNotNone(search_opts)
             self.assertIn('ip6', search_opts)
             self.assertEqual(search_opts['ip6'], 'ffff.*')
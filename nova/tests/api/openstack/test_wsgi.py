@@ -17,6 +17,7 @@ from nova.api.openstack import extensions
 from nova.api.openstack import wsgi
 from nova import exception
 from nova.openstack.common import gettextutils
+from nova.openstack.common import jsonutils
 from nova import test
 from nova.tests.api.openstack import fakes
 from nova.tests import utils
@@ -1034,6 +1035,64 @@ class ResourceTest(test.NoDBTestCase):
         self.assertEqual(called, [2])
         self.assertEqual(response, 'foo')
 
+    def _streaming_resource(self, extension):
+        class Controller(wsgi.Controller):
+            def index(self, req):
+                def pages():
+                    for page in ([{'id': 1}, {'id': 2}], [], [{'id': 3}]):
+                        req.cache_db_items('tests', page)
+                        yield page
+
+                return wsgi.StreamingResponseObject(
+                        'tests', pages(), lambda: [{'rel': 'next'}])
+
+        class ControllerExtended(wsgi.Controller):
+            index = wsgi.extends(extension)
+
+        resource = wsgi.Resource(Controller())
+        resource.register_extensions(ControllerExtended())
+        return resource
+
+    def test_resource_streaming_response(self):
+        called = []
+
+        def index(self, req, resp_obj):
+            page = resp_obj.obj['tests']
+            called.append(len(req.get_db_items('tests')))
+            for item in page:
+                item['extended'] = True
+
+        resource = self._streaming_resource(index)
+        req = wsgi.Request.blank('/tests')
+        response = resource._process_stack(req, 'index', {}, None, '',
+                                           'application/json')
+
+        self.assertEqual([], called)
+        self.assertEqual({'tests': [{'id': 1, 'extended': True},
+                                    {'id': 2, 'extended': True},
+                                    {'id': 3, 'extended': True}],
+                          'tests_links': [{'rel': 'next'}]},
+                         jsonutils.loads(response.body))
+        self.assertEqual([2, 0, 1], called)
+        self.assertEqual('application/json', response.content_type)
+
+    def test_resource_streaming_response_with_generator_extension(self):
+        called = []
+
+        def index(self, req):
+            resp_obj = yield
+            called.append(len(resp_obj.obj['tests']))
+
+        resource = self._streaming_resource(index)
+        req = wsgi.Request.blank('/tests')
+        response = resource._process_stack(req, 'index', {}, None, '',
+                                           'application/json')
+
+        self.assertEqual([3], called)
+        self.assertEqual({'tests': [{'id': 1}, {'id': 2}, {'id': 3}],
+                          'tests_links': [{'rel': 'next'}]},
+                         jsonutils.loads(response.body))
+
     def test_resource_exception_handler_type_error(self):
         # A TypeError should be translated to a Fault/HTTP 400.
         def foo(a,):
@@ -5802,7 +5802,8 @@ class ComputeTestCase(BaseTestCase):
 
     def test_heal_instance_info_cache(self):
         # Update on every call for the test
-        self.flags(heal_instance_info_cache_interval=-1)
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=1)
         ctxt = context.get_admin_context()
 
         instance_map = {}
@@ -5817,37 +5818,42 @@ class ComputeTestCase(BaseTestCase):
         call_info = {'get_all_by_host': 0, 'get_by_uuid': 0,
                 'get_nw_info': 0, 'expected_instance': None}
 
-        def fake_instance_get_all_by_host(context, host,
-                                          columns_to_join, use_slave=False):
+        def fake_instance_get_uuids_by_info_cache_age(context, host,
+                                                      use_slave=False):
             call_info['get_all_by_host'] += 1
-            self.assertEqual([], columns_to_join)
-            return instances[:]
-
-        def fake_instance_get_by_uuid(context, instance_uuid,
-                                      columns_to_join, use_slave=False):
-            if instance_uuid not in instance_map:
-                raise exception.InstanceNotFound(instance_id=instance_uuid)
-            call_info['get_by_uuid'] += 1
+            return [inst['uuid'] for inst in instances
+                    if inst['vm_state'] != vm_states.BUILDING and
+                    inst['task_state'] != task_states.DELETING]
+
+        def fake_instance_get_all_by_filters(context, filters, sort_key,
+                                             sort_dir, limit=None,
+                                             marker=None,
+                                             columns_to_join=None,
+                                             use_slave=False):
             self.assertEqual(['system_metadata', 'info_cache'],
                              columns_to_join)
-            return instance_map[instance_uuid]
+            found = [instance_map[inst_uuid]
+                     for inst_uuid in filters['uuid']
+                     if inst_uuid in instance_map]
+            call_info['get_by_uuid'] += len(found)
+            return found
 
         # NOTE(comstud): Override the stub in setUp()
-        def fake_get_instance_nw_info(context, instance, use_slave=False):
+        def fake_get_instances_nw_info(context, instances, use_slave=False):
             # Note that this exception gets caught in compute/manager
             # and is ignored.  However, the below increment of
             # 'get_nw_info' won't happen, and you'll get an assert
             # failure checking it below.
-            self.assertEqual(call_info['expected_instance']['uuid'],
-                             instance['uuid'])
+            self.assertEqual([call_info['expected_instance']['uuid']],
+                             [instance['uuid'] for instance in instances])
             call_info['get_nw_info'] += 1
 
-        self.stubs.Set(db, 'instance_get_all_by_host',
-                fake_instance_get_all_by_host)
-        self.stubs.Set(db, 'instance_get_by_uuid',
-                fake_instance_get_by_uuid)
-        self.stubs.Set(self.compute, '_get_instance_nw_info',
-                fake_get_instance_nw_info)
+        self.stubs.Set(db, 'instance_get_uuids_by_info_cache_age',
+                fake_instance_get_uuids_by_info_cache_age)
+        self.stubs.Set(db, 'instance_get_all_by_filters',
+                fake_instance_get_all_by_filters)
+        self.stubs.Set(self.compute, '_get_instances_nw_info',
+                fake_get_instances_nw_info)
 
         # Make an instance appear to be still Building
         instances[0]['vm_state'] = vm_states.BUILDING
@@ -5857,13 +5863,13 @@ class ComputeTestCase(BaseTestCase):
         call_info['expected_instance'] = instances[2]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(1, call_info['get_all_by_host'])
-        self.assertEqual(0, call_info['get_by_uuid'])
+        self.assertEqual(1, call_info['get_by_uuid'])
         self.assertEqual(1, call_info['get_nw_info'])
 
         call_info['expected_instance'] = instances[3]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(1, call_info['get_all_by_host'])
-        self.assertEqual(1, call_info['get_by_uuid'])
+        self.assertEqual(2, call_info['get_by_uuid'])
         self.assertEqual(2, call_info['get_nw_info'])
 
         # Make an instance switch hosts
@@ -5876,7 +5882,7 @@ class ComputeTestCase(BaseTestCase):
         call_info['expected_instance'] = instances[7]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(1, call_info['get_all_by_host'])
-        self.assertEqual(4, call_info['get_by_uuid'])
+        self.assertEqual(5, call_info['get_by_uuid'])
         self.assertEqual(3, call_info['get_nw_info'])
         # Should be no more left.
         self.assertEqual(0, len(self.compute._instance_uuids_to_heal))
@@ -5890,7 +5896,7 @@ class ComputeTestCase(BaseTestCase):
         # Should have called the list once more
         self.assertEqual(2, call_info['get_all_by_host'])
         # Stays the same because we remove invalid entries from the list
-        self.assertEqual(4, call_info['get_by_uuid'])
+        self.assertEqual(5, call_info['get_by_uuid'])
         # Stays the same because we didn't find anything to process
         self.assertEqual(3, call_info['get_nw_info'])
 
@@ -6100,7 +6106,8 @@ class ComputeTestCase(BaseTestCase):
                                             marker=None,
                                             columns_to_join=[],
                                             use_slave=True,
-                                            limit=None)
+                                            limit=None,
+                                            columns=None)
             self.assertThat(conductor_instance_update.mock_calls,
                             testtools_matchers.HasLength(len(old_instances)))
             self.assertThat(node_is_available.mock_calls,
@@ -6482,9 +6489,11 @@ class ComputeTestCase(BaseTestCase):
         self._create_fake_instance({'host': self.compute.host})
         self._create_fake_instance({'host': self.compute.host})
         self._create_fake_instance({'host': self.compute.host})
+        self.mox.StubOutWithMock(self.compute.driver, 'get_power_states')
         self.mox.StubOutWithMock(self.compute.driver, 'get_info')
         self.mox.StubOutWithMock(self.compute, '_sync_instance_power_state')
 
+        self.compute.driver.get_power_states().AndRaise(NotImplementedError())
         # Check to make sure task continues on error.
         self.compute.driver.get_info(mox.IgnoreArg()).AndRaise(
             exception.InstanceNotFound(instance_id='fake-uuid'))
@@ -9567,6 +9576,25 @@ class ComputeAPIAggrTestCase(BaseTestCase):
                          'aggregate.addhost.end')
         self.assertEqual(len(aggr['hosts']), 1)
 
+    def test_aggregate_changes_notify_schedulers(self):
+        values = _create_service_entries(self.context)
+        fake_zone = values.keys()[0]
+        fake_host = values[fake_zone][0]
+        aggr = self.api.create_aggregate(self.context,
+                                         'fake_aggregate', fake_zone)
+        with mock.patch.object(self.api.scheduler_rpcapi,
+                               'aggregates_changed') as aggregates_changed:
+            self.api.add_host_to_aggregate(self.context, aggr['id'],
+                                           fake_host)
+            self.api.update_aggregate_metadata(self.context, aggr['id'],
+                                               {'foo': 'bar'})
+            self.api.update_aggregate(self.context, aggr['id'],
+                                      {'name': 'new_fake_aggregate'})
+            self.api.remove_host_from_aggregate(self.context, aggr['id'],
+                                                fake_host)
+            self.assertEqual([mock.call(self.context)] * 4,
+                             aggregates_changed.call_args_list)
+
     def test_add_host_to_aggr_with_no_az(self):
         values = _create_service_entries(self.context)
         fake_zone = values.keys()[0]
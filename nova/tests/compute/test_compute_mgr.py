@@ -16,6 +16,7 @@ import contextlib
 import time
 
 from eventlet import event as eventlet_event
+from eventlet import greenthread
 import mock
 import mox
 from oslo.config import cfg
@@ -747,6 +748,149 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
                 self._test_sync_to_stop(power_state.RUNNING, vs, ps,
                                         stop=False)
 
+    def _test_sync_power_states(self, vm_power_states, synced):
+        instances = []
+        for uuid, vm_state in (('uuid1', vm_states.ACTIVE),
+                               ('uuid2', vm_states.ACTIVE),
+                               ('uuid3', vm_states.STOPPED)):
+            instances.append(fake_instance.fake_instance_obj(
+                self.context, uuid=uuid, vm_state=vm_state,
+                power_state=power_state.RUNNING, task_state=None))
+        instances[2].power_state = power_state.SHUTDOWN
+
+        with contextlib.nested(
+            mock.patch.object(instance_obj.InstanceList, 'get_by_host',
+                              return_value=instances),
+            mock.patch.object(self.compute.driver, 'get_power_states',
+                              return_value=vm_power_states),
+            mock.patch.object(self.compute.driver, 'get_info'),
+            mock.patch.object(self.compute, '_sync_instance_power_state'),
+        ) as (get_by_host, get_power_states, get_info, sync_power_state):
+            self.compute._sync_power_states(self.context)
+            get_by_host.assert_called_once_with(self.context,
+                                                self.compute.host,
+                                                use_slave=True)
+            self.assertFalse(get_info.called)
+            self.assertEqual(
+                [mock.call(self.context, instances[int(uuid[-1]) - 1],
+                           state, use_slave=True)
+                 for uuid, state in synced],
+                sync_power_state.call_args_list)
+
+    def test_sync_power_states_bulk(self):
+        self._test_sync_power_states(
+            {'uuid1': power_state.RUNNING, 'uuid2': power_state.SHUTDOWN,
+             'uuid3': power_state.SHUTDOWN},
+            [('uuid2', power_state.SHUTDOWN)])
+
+    def test_sync_power_states_bulk_missing_instance(self):
+        self._test_sync_power_states(
+            {'uuid2': power_state.RUNNING},
+            [('uuid1', power_state.NOSTATE), ('uuid3', power_state.NOSTATE)])
+
+    def test_sync_power_states_event_interval(self):
+        self.flags(sync_power_state_event_interval=3600)
+        self.stubs.Set(self.compute.driver, 'capabilities',
+                       {'emits_lifecycle_events': True})
+        with mock.patch.object(instance_obj.InstanceList, 'get_by_host',
+                               return_value=[]) as get_by_host:
+            self.compute._sync_power_states(self.context)
+            self.compute._sync_power_states(self.context)
+            self.assertEqual(1, get_by_host.call_count)
+
+            self.compute._last_power_state_sync -= 3601
+            self.compute._sync_power_states(self.context)
+            self.assertEqual(2, get_by_host.call_count)
+
+    def _heal_instances(self, count):
+        return [fake_instance.fake_instance_obj(
+                    self.context, uuid='uuid%d' % i, host=self.compute.host,
+                    vm_state=vm_states.ACTIVE, task_state=None,
+                    expected_attrs=['system_metadata', 'info_cache'])
+                for i in xrange(count)]
+
+    def _heal_get_by_filters(self, instances):
+        def get_by_filters(context, filters, **kwargs):
+            # The database does not return instances in the requested order
+            return [instance for instance in reversed(instances)
+                    if instance.uuid in filters['uuid']]
+        return get_by_filters
+
+    def test_heal_instance_info_cache_batches(self):
+        self.flags(heal_instance_info_cache_batch_size=2)
+        instances = self._heal_instances(4)
+        with contextlib.nested(
+            mock.patch.object(instance_obj.InstanceList,
+                              'get_uuids_by_info_cache_age',
+                              return_value=['uuid1', 'uuid2',
+                                            'uuid3', 'uuid0']),
+            mock.patch.object(instance_obj.InstanceList, 'get_by_filters',
+                              side_effect=self._heal_get_by_filters(
+                                  instances)),
+            mock.patch.object(self.compute, '_get_instances_nw_info'),
+        ) as (get_uuids, get_by_filters, get_nw_info):
+            self.compute._heal_instance_info_cache(self.context)
+            get_uuids.assert_called_once_with(self.context,
+                                              self.compute.host,
+                                              use_slave=True)
+            get_by_filters.assert_called_once_with(
+                self.context, {'uuid': ['uuid1', 'uuid2']},
+                expected_attrs=['system_metadata', 'info_cache'],
+                use_slave=True)
+            self.assertEqual(set(['uuid1', 'uuid2']),
+                             set(instance.uuid
+                                 for call in get_nw_info.call_args_list
+                                 for instance in call[0][1]))
+            self.assertEqual(['uuid3', 'uuid0'],
+                             self.compute._instance_uuids_to_heal)
+
+            get_nw_info.reset_mock()
+            get_by_filters.reset_mock()
+            self.compute._heal_instance_info_cache(self.context)
+            get_by_filters.assert_called_once_with(
+                self.context, {'uuid': ['uuid3', 'uuid0']},
+                expected_attrs=['system_metadata', 'info_cache'],
+                use_slave=True)
+            self.assertEqual(set(['uuid0', 'uuid3']),
+                             set(instance.uuid
+                                 for call in get_nw_info.call_args_list
+                                 for instance in call[0][1]))
+            self.assertEqual([], self.compute._instance_uuids_to_heal)
+            self.assertEqual(1, get_uuids.call_count)
+
+    def test_heal_instance_info_cache_workers(self):
+        self.flags(heal_instance_info_cache_batch_size=5,
+                   heal_instance_info_cache_workers=2)
+        instances = self._heal_instances(5)
+        running = {'now': 0, 'max': 0, 'healed': []}
+
+        def fake_get_nw_info(context, instances, use_slave=False):
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+            greenthread.sleep(0)
+            running['now'] -= 1
+            running['healed'].append([instance.uuid
+                                      for instance in instances])
+            if instances[0].uuid == 'uuid0':
+                raise test.TestingException()
+            return [None] * len(instances)
+
+        with contextlib.nested(
+            mock.patch.object(instance_obj.InstanceList,
+                              'get_uuids_by_info_cache_age',
+                              return_value=[instance.uuid
+                                            for instance in instances]),
+            mock.patch.object(instance_obj.InstanceList, 'get_by_filters',
+                              side_effect=self._heal_get_by_filters(
+                                  instances)),
+            mock.patch.object(self.compute, '_get_instances_nw_info',
+                              side_effect=fake_get_nw_info),
+        ):
+            self.compute._heal_instance_info_cache(self.context)
+        self.assertEqual([['uuid0', 'uuid2', 'uuid4'], ['uuid1', 'uuid3']],
+                         sorted(running['healed']))
+        self.assertEqual(2, running['max'])
+
     def test_run_pending_deletes(self):
         self.flags(instance_delete_interval=10)
 
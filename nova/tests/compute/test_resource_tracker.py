@@ -421,6 +421,7 @@ class BaseTrackerTestCase(BaseTestCase):
 
         self.updated = False
         self.deleted = False
+        self.update_calls = []
 
         self.tracker = self._tracker()
         self._migrations = {}
@@ -447,6 +448,7 @@ class BaseTrackerTestCase(BaseTestCase):
     def _fake_compute_node_update(self, ctx, compute_node_id, values,
             prune_stats=False):
         self.updated = True
+        self.update_calls.append(dict(values))
         values['stats'] = [{"key": "num_instances", "value": "1"}]
 
         self.compute.update(values)
@@ -535,6 +537,46 @@ class TrackerTestCase(BaseTrackerTestCase):
         self.assertEqual(driver.pci_stats,
             jsonutils.loads(self.tracker.compute_node['pci_stats']))
 
+    def test_update_sends_changed_fields(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.update_calls = []
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual([{}], self.update_calls)
+
+        self.update_calls = []
+        self.tracker.driver.memory_mb += 10
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual(1, len(self.update_calls))
+        self.assertEqual(set(['memory_mb', 'free_ram_mb']),
+                         set(self.update_calls[0]))
+        self._assert(FAKE_VIRT_MEMORY_MB + 10, 'free_ram_mb')
+
+    def test_update_sends_all_fields_periodically(self):
+        self.flags(compute_node_full_update_interval=60)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.tracker.update_available_resource(self.context)
+        self.update_calls = []
+
+        timeutils.advance_time_seconds(61)
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual(1, len(self.update_calls))
+        self.assertIn('memory_mb', self.update_calls[0])
+        self.assertIn('hypervisor_hostname', self.update_calls[0])
+
+        timeutils.advance_time_seconds(30)
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual(2, len(self.update_calls))
+        self.assertEqual({}, self.update_calls[1])
+
+    def test_update_sends_all_fields_without_interval(self):
+        self.flags(compute_node_full_update_interval=0)
+        self.update_calls = []
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual(1, len(self.update_calls))
+        self.assertIn('memory_mb', self.update_calls[0])
+
 
 class TrackerPciStatsTestCase(BaseTrackerTestCase):
 
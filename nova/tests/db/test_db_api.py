@@ -37,6 +37,7 @@ from sqlalchemy.orm import query
 from sqlalchemy.sql.expression import select
 
 from nova import block_device
+from nova.compute import task_states
 from nova.compute import vm_states
 from nova import context
 from nova import db
@@ -1537,6 +1538,69 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
             sys_meta = utils.metadata_to_dict(inst['system_metadata'])
             self.assertEqual(sys_meta, {})
 
+    def test_instance_get_all_by_filters_columns(self):
+        inst = self.create_instance_with_args(display_name='test1',
+                                              host='host1')
+        self.create_instance_with_args(display_name='test2', host='host2')
+        result = db.instance_get_all_by_filters(self.ctxt, {'host': 'host1'},
+                columns=['display_name', 'host'])
+        self.assertEqual([{'uuid': inst['uuid'], 'display_name': 'test1',
+                           'host': 'host1'}], result)
+
+    def test_instance_get_all_by_filters_columns_with_meta(self):
+        self.create_instance_with_args()
+        result = db.instance_get_all_by_filters(self.ctxt, {},
+                columns=['uuid'], columns_to_join=['system_metadata'])
+        self.assertEqual(1, len(result))
+        sys_meta = utils.metadata_to_dict(result[0]['system_metadata'])
+        self.assertEqual(sys_meta, self.sample_data['system_metadata'])
+
+    def test_instance_get_all_by_filters_columns_with_join(self):
+        self.create_instance_with_args()
+        self.assertRaises(ValueError, db.instance_get_all_by_filters,
+                          self.ctxt, {}, columns=['host'],
+                          columns_to_join=['system_metadata', 'info_cache'])
+
+    def test_instance_get_all_by_filters_keyset_paginate(self):
+        instances = [self.create_instance_with_args(host='host%d' % (i % 2))
+                     for i in range(5)]
+        expected = sorted(instances,
+                          key=lambda inst: (inst['host'], inst['created_at'],
+                                            inst['id']))
+        for sort_dir in ('asc', 'desc'):
+            pages = []
+            marker = None
+            while True:
+                page = db.instance_get_all_by_filters(self.ctxt, {},
+                        sort_key='host', sort_dir=sort_dir, limit=2,
+                        marker=marker, columns=['host'])
+                if not page:
+                    break
+                pages.extend(inst['uuid'] for inst in page)
+                marker = page[-1]['uuid']
+            if sort_dir == 'desc':
+                pages.reverse()
+            self.assertEqual([inst['uuid'] for inst in expected], pages)
+
+    def test_instance_get_all_by_filters_deleted_marker(self):
+        instances = [self.create_instance_with_args() for i in range(3)]
+        db.instance_destroy(self.ctxt, instances[1]['uuid'])
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'deleted': False,
+                                                 'deleted_marker': True},
+                                                sort_key='id',
+                                                sort_dir='asc',
+                                                marker=instances[1]['uuid'])
+        self._assertEqualListsOfInstances([instances[2]], result)
+
+    def test_instance_get_all_by_filters_deleted_marker_not_found(self):
+        instances = [self.create_instance_with_args() for i in range(3)]
+        db.instance_destroy(self.ctxt, instances[1]['uuid'])
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters,
+                          self.ctxt, {'deleted': False}, sort_key='id',
+                          sort_dir='asc', marker=instances[1]['uuid'])
+
     def test_instance_get_all_by_filters(self):
         instances = [self.create_instance_with_args() for i in range(3)]
         filtered_instances = db.instance_get_all_by_filters(self.ctxt, {})
@@ -1791,6 +1855,24 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
         results = db.instance_get_all_hung_in_rebooting(self.ctxt, 10)
         self.assertEqual([], results)
 
+    def test_instance_get_uuids_by_info_cache_age(self):
+        refreshed = self.create_instance_with_args(host='h1')
+        stale = self.create_instance_with_args(host='h1')
+        self.create_instance_with_args(host='h1',
+                                       vm_state=vm_states.BUILDING)
+        self.create_instance_with_args(host='h1',
+                                       task_state=task_states.DELETING)
+        self.create_instance_with_args(host='h2')
+
+        timeutils.set_time_override(timeutils.utcnow() +
+                                    datetime.timedelta(minutes=5))
+        self.addCleanup(timeutils.clear_time_override)
+        db.instance_info_cache_update(self.ctxt, refreshed['uuid'],
+                                      {'network_info': '[]'})
+
+        results = db.instance_get_uuids_by_info_cache_age(self.ctxt, 'h1')
+        self.assertEqual([stale['uuid'], refreshed['uuid']], results)
+
     def test_instance_update_with_expected_vm_state(self):
         instance = self.create_instance_with_args(vm_state='foo')
         db.instance_update(self.ctxt, instance['uuid'], {'host': 'h1',
@@ -5612,6 +5694,34 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
         self._assertEqualListsOfObjects(expected, result,
                                         ignored_keys=['stats'])
 
+    def test_compute_node_get_all_changed_since(self):
+        timeutils.set_time_override(self.item['created_at'] +
+                                    datetime.timedelta(minutes=5))
+        self.addCleanup(timeutils.clear_time_override)
+        changed_since = timeutils.utcnow()
+
+        nodes, services = db.compute_node_get_all_changed_since(
+                self.ctxt, changed_since)
+        self.assertEqual([], nodes)
+        self.assertEqual([self.service['id']],
+                         [service['id'] for service in services])
+
+        db.compute_node_update(self.ctxt, self.item['id'], {'vcpus': 4})
+        nodes, services = db.compute_node_get_all_changed_since(
+                self.ctxt, changed_since)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(4, nodes[0]['vcpus'])
+        self.assertEqual(self.service['id'], nodes[0]['service']['id'])
+
+    def test_compute_node_get_all_changed_since_deleted(self):
+        changed_since = self.item['created_at']
+        db.compute_node_delete(self.ctxt, self.item['id'])
+        nodes, services = db.compute_node_get_all_changed_since(
+                self.ctxt, changed_since)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(self.item['id'], nodes[0]['id'])
+        self.assertTrue(nodes[0]['deleted'])
+
     def test_compute_node_get(self):
         compute_node_id = self.item['id']
         node = db.compute_node_get(self.ctxt, compute_node_id)
@@ -6611,6 +6721,90 @@ class ArchiveTestCase(test.TestCase):
         si_rows = self.conn.execute(qsi).fetchall()
         self.assertEqual(len(siim_rows) + len(si_rows), 8)
 
+    def _create_deleted_instances(self):
+        for uuidstr in self.uuidstrs:
+            ins_stmt = self.instance_id_mappings.insert().values(uuid=uuidstr)
+            self.conn.execute(ins_stmt)
+            ins_stmt2 = self.instances.insert().values(uuid=uuidstr)
+            self.conn.execute(ins_stmt2)
+        for table in (self.instance_id_mappings, self.instances):
+            update_statement = table.update().\
+                    where(table.c.uuid.in_(self.uuidstrs[:4])).\
+                    values(deleted=1)
+            self.conn.execute(update_statement)
+
+    def _count_rows(self, table):
+        query = select([table]).where(table.c.uuid.in_(self.uuidstrs))
+        return len(self.conn.execute(query).fetchall())
+
+    def test_archive_table_levels(self):
+        levels = dict((tablename, level) for level, tablenames
+                      in enumerate(sqlalchemy_api._archive_table_levels())
+                      for tablename in tablenames)
+        self.assertLess(levels['consoles'], levels['console_pools'])
+        self.assertLess(levels['consoles'], levels['instances'])
+        self.assertLess(levels['instance_actions_events'],
+                        levels['instance_actions'])
+        self.assertLess(levels['instance_actions'], levels['instances'])
+        self.assertEqual(0, levels['instance_id_mappings'])
+
+    def test_archive_deleted_rows_for_table_batches(self):
+        self._create_deleted_instances()
+        num = db.archive_deleted_rows_for_table(self.context,
+                                                'instance_id_mappings',
+                                                batch_size=3)
+        self.assertEqual(4, num)
+        self.assertEqual(2, self._count_rows(self.instance_id_mappings))
+        self.assertEqual(4, self._count_rows(
+                self.shadow_instance_id_mappings))
+
+    def test_archive_deleted_rows_workers(self):
+        self._create_deleted_instances()
+        progress = {}
+
+        def _progress(tablename, rows, seconds):
+            progress[tablename] = rows
+
+        num = db.archive_deleted_rows(self.context, max_rows=5, batch_size=2,
+                                      workers=4, progress=_progress)
+        self.assertEqual(5, num)
+        self.assertEqual(5, self._count_rows(self.shadow_instance_id_mappings)
+                         + self._count_rows(self.shadow_instances))
+        self.assertEqual(5, progress.get('instance_id_mappings', 0) +
+                         progress.get('instances', 0))
+
+        num = db.archive_deleted_rows(self.context, batch_size=2, workers=4)
+        self.assertEqual(3, num)
+        self.assertEqual(4, self._count_rows(self.instance_id_mappings) +
+                         self._count_rows(self.instances))
+
+    def test_archive_deleted_rows_fk_constraint_skips_rows(self):
+        dialect = self.engine.url.get_dialect()
+        if dialect == sqlite.dialect:
+            import sqlite3
+            tup = sqlite3.sqlite_version_info
+            if tup[0] < 3 or (tup[0] == 3 and tup[1] < 7):
+                self.skipTest(
+                    'sqlite version too old for reliable SQLA foreign_keys')
+            self.conn.execute("PRAGMA foreign_keys = ON")
+        pool_ids = []
+        for unused in range(3):
+            ins_stmt = self.console_pools.insert().values(deleted=1)
+            result = self.conn.execute(ins_stmt)
+            pool_ids.append(result.inserted_primary_key[0])
+        self.ids.extend(pool_ids)
+        ins_stmt = self.consoles.insert().values(pool_id=pool_ids[1])
+        result = self.conn.execute(ins_stmt)
+        self.ids.append(result.inserted_primary_key[0])
+
+        # The pool still used by a console is left behind.
+        num = db.archive_deleted_rows_for_table(self.context, "console_pools")
+        self.assertEqual(2, num)
+        query = select([self.console_pools.c.id]).where(
+                self.console_pools.c.id.in_(pool_ids))
+        self.assertEqual([(pool_ids[1],)],
+                         self.conn.execute(query).fetchall())
+
 
 class InstanceGroupDBApiTestCase(test.TestCase, ModelsObjectComparatorMixin):
     def setUp(self):
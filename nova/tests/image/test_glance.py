@@ -14,8 +14,10 @@
 #    under the License.
 
 
+import contextlib
 import datetime
 import filecmp
+import hashlib
 import os
 import random
 import tempfile
@@ -24,6 +26,7 @@ import time
 import sys
 import testtools
 
+import fixtures
 import mock
 import mox
 
@@ -33,6 +36,7 @@ from oslo.config import cfg
 from nova import context
 from nova import exception
 from nova.image import glance
+from nova.openstack.common import timeutils
 from nova import test
 from nova.tests.api.openstack import fakes
 from nova.tests.glance import stubs as glance_stubs
@@ -112,6 +116,9 @@ class TestGlanceImageService(test.NoDBTestCase):
     def setUp(self):
         super(TestGlanceImageService, self).setUp()
         fakes.stub_out_compute_api_snapshot(self.stubs)
+        # Other tests show images of the same fake glance server.
+        glance._image_meta_cache.clear()
+        self.addCleanup(glance._image_meta_cache.clear)
 
         self.client = glance_stubs.StubGlanceClient()
         self.service = self._create_image_service(self.client)
@@ -325,6 +332,85 @@ class TestGlanceImageService(test.NoDBTestCase):
         self.flags(glance_num_retries=1)
         service.download(self.context, image_id, data=writer)
 
+    def _create_checksum_client(self, checksum):
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            """A client that returns the data of an image with a checksum."""
+            def get(self, image_id):
+                return type('GlanceTestChecksumMeta', (object,),
+                            {'status': 'active', 'checksum': checksum})
+
+            def data(self, image_id):
+                return iter(['some', 'Data'])
+
+        return MyGlanceStubClient()
+
+    def test_download_checksum(self):
+        checksum = hashlib.md5('someData').hexdigest()
+        service = self._create_image_service(
+                self._create_checksum_client(checksum))
+        writer = NullWriter()
+        service.download(self.context, 1, data=writer)
+
+    def test_download_checksum_mismatch(self):
+        service = self._create_image_service(
+                self._create_checksum_client('bad'))
+        (outfd, tmpfname) = self._get_tempfile()
+        os.close(outfd)
+        self.assertRaises(exception.ImageUnacceptable, service.download,
+                          self.context, 1, dst_path=tmpfname)
+
+    def test_download_checksum_fails_before_open(self):
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            """A client that fails to show images."""
+            def get(self, image_id):
+                raise glanceclient.exc.NotFound()
+
+        service = self._create_image_service(MyGlanceStubClient())
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        dst_path = os.path.join(tmpdir, 'image')
+        self.assertRaises(exception.ImageNotFound, service.download,
+                          self.context, 1, dst_path=dst_path)
+        self.assertFalse(os.path.exists(dst_path))
+
+    def _download_direct_url(self, xfer_data):
+        self.flags(allowed_direct_url_schemes=['fake'])
+        checksum = hashlib.md5('someData').hexdigest()
+        service = self._create_image_service(
+                self._create_checksum_client(checksum))
+        (outfd, tmpfname) = self._get_tempfile()
+        os.close(outfd)
+
+        def fake_download(context, url_parts, dst_path, metadata):
+            with open(dst_path, 'wb') as f:
+                f.write(xfer_data)
+
+        xfer_mod = mock.Mock()
+        xfer_mod.download.side_effect = fake_download
+        with contextlib.nested(
+                mock.patch.object(service, '_get_locations',
+                                  return_value=[{'url': 'fake://image',
+                                                 'metadata': {}}]),
+                mock.patch.object(service, '_get_transfer_module',
+                                  return_value=xfer_mod),
+                mock.patch.object(service._client, 'call',
+                                  wraps=service._client.call)
+                ) as (_locations, _xfer_mod, call):
+            service.download(self.context, 1, dst_path=tmpfname)
+        with open(tmpfname) as f:
+            return f.read(), call
+
+    def test_download_direct_url_checksum(self):
+        data, call = self._download_direct_url('someData')
+        self.assertEqual('someData', data)
+        self.assertNotIn(mock.call(self.context, 1, 'data', 1),
+                         call.call_args_list)
+
+    def test_download_direct_url_checksum_mismatch(self):
+        data, call = self._download_direct_url('corrupted')
+        # The image was downloaded from glance again
+        self.assertEqual('someData', data)
+        call.assert_any_call(self.context, 1, 'data', 1)
+
     def test_download_file_url(self):
         self.flags(allowed_direct_url_schemes=['file'])
 
@@ -761,7 +847,7 @@ class TestShow(test.NoDBTestCase):
         trans_from_mock.return_value = mock.sentinel.trans_from
         client = mock.MagicMock()
         client.call.return_value = mock.sentinel.images_0
-        ctx = mock.sentinel.ctx
+        ctx = context.RequestContext('fake', 'fake')
         service = glance.GlanceImageService(client)
         info = service.show(ctx, mock.sentinel.image_id)
 
@@ -777,7 +863,7 @@ class TestShow(test.NoDBTestCase):
         is_avail_mock.return_value = False
         client = mock.MagicMock()
         client.call.return_value = mock.sentinel.images_0
-        ctx = mock.sentinel.ctx
+        ctx = context.RequestContext('fake', 'fake')
         service = glance.GlanceImageService(client)
 
         with testtools.ExpectedException(exception.ImageNotFound):
@@ -796,7 +882,7 @@ class TestShow(test.NoDBTestCase):
         raised = exception.ImageNotAuthorized(image_id=123)
         client = mock.MagicMock()
         client.call.side_effect = glanceclient.exc.Forbidden
-        ctx = mock.sentinel.ctx
+        ctx = context.RequestContext('fake', 'fake')
         reraise_mock.side_effect = raised
         service = glance.GlanceImageService(client)
 
@@ -828,7 +914,7 @@ class TestShow(test.NoDBTestCase):
             updated_at = '2014-05-20T08:16:48'
         glance_image = fake_image_cls()
         client.call.return_value = glance_image
-        ctx = mock.sentinel.ctx
+        ctx = context.RequestContext('fake', 'fake')
         service = glance.GlanceImageService(client)
         image_info = service.show(ctx, glance_image.id)
         client.call.assert_called_once_with(ctx, 1, 'get',
@@ -843,6 +929,96 @@ class TestShow(test.NoDBTestCase):
         self.assertEqual(NOVA_IMAGE_ATTRIBUTES, set(image_info.keys()))
 
 
+@mock.patch('nova.image.glance._translate_from_glance',
+            lambda image: image.id)
+class TestShowCache(test.NoDBTestCase):
+
+    """Tests the image metadata cache of the show method."""
+
+    def setUp(self):
+        super(TestShowCache, self).setUp()
+        self.flags(glance_image_metadata_cache_ttl=60)
+        glance._image_meta_cache.clear()
+        self.addCleanup(glance._image_meta_cache.clear)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.client = mock.MagicMock()
+        self.client.call.side_effect = self._fake_call
+        self.service = glance.GlanceImageService(self.client)
+        self.ctx = context.RequestContext('fake', 'project1')
+        self.status = 'active'
+        self.owner = 'project1'
+
+    def _fake_call(self, context, version, method, image_id, **kwargs):
+        return mock.Mock(id=image_id, status=self.status, is_public=False,
+                         properties={'owner_id': self.owner})
+
+    def _show(self, ctx=None, image_id='image1'):
+        return self.service.show(ctx or self.ctx, image_id)
+
+    def test_show_cached(self):
+        self.assertEqual('image1', self._show())
+        self.assertEqual('image1', self._show())
+        self.assertEqual('image2', self._show(image_id='image2'))
+        self.assertEqual(2, self.client.call.call_count)
+
+    def test_show_cache_disabled(self):
+        self.flags(glance_image_metadata_cache_ttl=0)
+        self._show()
+        self._show()
+        self.assertEqual(2, self.client.call.call_count)
+
+    def test_show_cache_expired(self):
+        self._show()
+        timeutils.advance_time_seconds(61)
+        self._show()
+        self.assertEqual(2, self.client.call.call_count)
+
+    def test_show_not_active_not_cached(self):
+        self.status = 'saving'
+        self._show()
+        self._show()
+        self.assertEqual(2, self.client.call.call_count)
+
+    def test_show_cached_per_project(self):
+        self._show()
+        other_ctx = context.RequestContext('fake', 'project2')
+        self.assertRaises(exception.ImageNotFound, self._show, other_ctx)
+        self.assertEqual(2, self.client.call.call_count)
+
+        admin_ctx = context.RequestContext('fake', 'project2', is_admin=True)
+        self._show(admin_ctx)
+        self._show(context.RequestContext('admin', 'project3',
+                                          is_admin=True))
+        self.assertEqual(3, self.client.call.call_count)
+
+    def test_show_cached_checks_availability(self):
+        self._show(context.RequestContext('fake', 'project2', is_admin=True))
+        self.assertRaises(exception.ImageNotFound, self._show,
+                          context.RequestContext('fake', 'project2'))
+
+    def test_show_cache_size(self):
+        self.flags(glance_image_metadata_cache_size=2)
+        for image_id in ('image1', 'image2', 'image3'):
+            self._show(image_id=image_id)
+            timeutils.advance_time_seconds(1)
+        self._show(image_id='image3')
+        self._show(image_id='image1')
+        self.assertEqual(4, self.client.call.call_count)
+
+    def test_update_invalidates(self):
+        self._show()
+        self.service.update(self.ctx, 'image1', {})
+        self._show()
+        self.assertEqual(3, self.client.call.call_count)
+
+    def test_delete_invalidates(self):
+        self._show()
+        self.service.delete(self.ctx, 'image1')
+        self._show()
+        self.assertEqual(3, self.client.call.call_count)
+
+
 class TestDetail(test.NoDBTestCase):
 
     """Tests the show method of the GlanceImageService."""
@@ -933,6 +1109,10 @@ class TestGlanceClientWrapper(test.NoDBTestCase):
         # host1 has no scheme, which is http by default
         self.flags(glance_api_servers=['host1:9292', 'https://host2:9293',
             'http://host3:9294'])
+        glance._api_server_health.clear()
+        glance._client_pool.clear()
+        self.addCleanup(glance._api_server_health.clear)
+        self.addCleanup(glance._client_pool.clear)
 
         # Make the test run fast
         def _fake_sleep(secs):
@@ -1098,6 +1278,8 @@ class TestGlanceClientWrapper(test.NoDBTestCase):
             servers.append(servers.pop(0))
 
         self.stubs.Set(random, 'shuffle', _fake_shuffle2)
+        # The pooled client of host2 counts the calls of the first round.
+        glance._client_pool.clear()
 
         info = {'num_calls': 0,
                 'host0': 'host2',
@@ -1110,6 +1292,116 @@ class TestGlanceClientWrapper(test.NoDBTestCase):
         client2.call(ctxt, 1, 'get', 'meow')
         self.assertEqual(info['num_calls'], 2)
 
+    def _stub_pooled_clients(self):
+        created = []
+
+        def _fake_create_glance_client(context, host, port, use_ssl, version):
+            client = glance_stubs.StubGlanceClient()
+            created.append((host, client))
+            return client
+
+        self.stubs.Set(random, 'shuffle', lambda servers: None)
+        self.stubs.Set(glance, '_create_glance_client',
+                       _fake_create_glance_client)
+        return created
+
+    def test_default_client_pooled(self):
+        self.flags(glance_client_pool_size=10, auth_strategy='keystone')
+        created = self._stub_pooled_clients()
+        ctxt = context.RequestContext('fake', 'fake', auth_token='token1')
+
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        self.assertEqual(1, len(created))
+
+        ctxt2 = context.RequestContext('fake', 'fake', auth_token='token2')
+        glance.GlanceClientWrapper().call(ctxt2, 1, 'list')
+        self.assertEqual(2, len(created))
+
+    def test_default_client_checked_out(self):
+        self.flags(glance_client_pool_size=10)
+        created = self._stub_pooled_clients()
+        ctxt = context.RequestContext('fake', 'fake')
+        calls = []
+
+        def _fake_list(client, **kwargs):
+            calls.append(client)
+            if len(calls) == 1:
+                # A concurrent call does not get the client in use
+                glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+            return []
+
+        self.stubs.Set(glance_stubs.StubGlanceClient, 'list', _fake_list)
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        self.assertEqual(2, len(created))
+        self.assertIsNot(calls[0], calls[1])
+
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        self.assertEqual(2, len(created))
+
+    def test_default_client_pool_disabled(self):
+        self.flags(glance_client_pool_size=0)
+        created = self._stub_pooled_clients()
+        ctxt = context.RequestContext('fake', 'fake')
+
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+        self.assertEqual(2, len(created))
+
+    def test_default_client_pool_eviction(self):
+        self.flags(glance_client_pool_size=2,
+                   glance_client_pool_idle_timeout=60,
+                   auth_strategy='keystone')
+        created = self._stub_pooled_clients()
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        ctxts = [context.RequestContext('fake', 'fake', auth_token=token)
+                 for token in ('token1', 'token2', 'token3')]
+
+        for ctxt in ctxts:
+            glance.GlanceClientWrapper().call(ctxt, 1, 'list')
+            now[0] += 1
+        # The least recently used client was dropped for token3
+        glance.GlanceClientWrapper().call(ctxts[0], 1, 'list')
+        self.assertEqual(4, len(created))
+
+        now[0] += 61
+        glance.GlanceClientWrapper().call(ctxts[2], 1, 'list')
+        self.assertEqual(5, len(created))
+
+    def test_default_client_unreachable_server_tried_last(self):
+        self.flags(glance_num_retries=1, glance_client_pool_size=10,
+                   glance_api_server_down_time=60)
+        created = self._stub_pooled_clients()
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        ctxt = context.RequestContext('fake', 'fake')
+        failing = set(['host1'])
+
+        def _fake_list(client, **kwargs):
+            host = [h for h, c in created if c is client][-1]
+            if host in failing:
+                raise glanceclient.exc.CommunicationError('')
+            return host
+
+        self.stubs.Set(glance_stubs.StubGlanceClient, 'list', _fake_list)
+
+        self.assertEqual('host2', glance.GlanceClientWrapper().call(
+                ctxt, 1, 'list'))
+        self.assertEqual(['host1', 'host2'], [h for h, c in created])
+
+        # host1 is only tried after the others, and its client was dropped
+        failing = set()
+        self.assertEqual('host2', glance.GlanceClientWrapper().call(
+                ctxt, 1, 'list'))
+        self.assertEqual(2, len(created))
+
+        now[0] += 61
+        self.assertEqual('host1', glance.GlanceClientWrapper().call(
+                ctxt, 1, 'list'))
+        self.assertEqual(['host1', 'host2', 'host1'], [h for h, c in created])
+
 
 class TestGlanceUrl(test.NoDBTestCase):
 
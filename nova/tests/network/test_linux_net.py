@@ -699,15 +699,14 @@ class LinuxNetworkTestCase(test.NoDBTestCase):
                        'remove_bridge', fake_remove)
 
         driver.unplug(network)
+        # Only the changed IPv4 chains are replaced, as the rules were
+        # fully applied by plug() just before.
         expected = [
             ('ebtables', '-t', 'filter', '-D', 'INPUT', '-p', 'ARP', '-i',
              iface, '--arp-ip-dst', dhcp, '-j', 'DROP'),
             ('ebtables', '-t', 'filter', '-D', 'OUTPUT', '-p', 'ARP', '-o',
              iface, '--arp-ip-src', dhcp, '-j', 'DROP'),
-            ('iptables-save', '-c'),
-            ('iptables-restore', '-c'),
-            ('ip6tables-save', '-c'),
-            ('ip6tables-restore', '-c'),
+            ('iptables-restore', '-c', '--noflush'),
         ]
         self.assertEqual(executes, expected)
         for inp in expected_inputs:
@@ -790,15 +789,14 @@ class LinuxNetworkTestCase(test.NoDBTestCase):
                        'remove_bridge', fake_remove)
 
         driver.unplug(network)
+        # Only the changed IPv4 chains are replaced, as the rules were
+        # fully applied by plug() just before.
         expected = [
             ('ebtables', '-t', 'filter', '-D', 'INPUT', '-p', 'ARP', '-i',
              iface, '--arp-ip-dst', dhcp, '-j', 'DROP'),
             ('ebtables', '-t', 'filter', '-D', 'OUTPUT', '-p', 'ARP', '-o',
              iface, '--arp-ip-src', dhcp, '-j', 'DROP'),
-            ('iptables-save', '-c'),
-            ('iptables-restore', '-c'),
-            ('ip6tables-save', '-c'),
-            ('ip6tables-restore', '-c'),
+            ('iptables-restore', '-c', '--noflush'),
         ]
         self.assertEqual(executes, expected)
         for inp in expected_inputs:
@@ -16,6 +16,7 @@
 import copy
 import uuid
 
+import fixtures
 import mock
 import mox
 from neutronclient.common import exceptions
@@ -94,9 +95,15 @@ class MyComparator(mox.Comparator):
 
 
 class TestNeutronClient(test.TestCase):
+    def setUp(self):
+        super(TestNeutronClient, self).setUp()
+        neutronv2._client_pool.clear()
+        self.addCleanup(neutronv2._client_pool.clear)
+
     def test_withtoken(self):
         self.flags(neutron_url='http://anyhost/')
         self.flags(neutron_url_timeout=30)
+        self.flags(neutron_client_pool_size=0)
         my_context = context.RequestContext('userid',
                                             'my_tenantid',
                                             auth_token='token')
@@ -120,6 +127,7 @@ class TestNeutronClient(test.TestCase):
     def test_withtoken_context_is_admin(self):
         self.flags(neutron_url='http://anyhost/')
         self.flags(neutron_url_timeout=30)
+        self.flags(neutron_client_pool_size=0)
         my_context = context.RequestContext('userid',
                                             'my_tenantid',
                                             auth_token='token',
@@ -2157,6 +2165,116 @@ class TestNeutronv2WithMock(test.TestCase):
                           api.get_instance_nw_info, 'context', instance)
         mock_lock.assert_called_once_with('refresh_cache-%s' % instance.uuid)
 
+    def _bulk_instance(self, instance_uuid, project_id, port_id, net_id):
+        network_info = [{'id': port_id, 'network': {'id': net_id}}]
+        return {'uuid': instance_uuid, 'project_id': project_id,
+                'display_name': instance_uuid,
+                'info_cache': {'network_info': network_info}}
+
+    def _bulk_port(self, port_id, instance_uuid, project_id, net_id,
+                   subnet_id, address):
+        return {'id': port_id, 'device_id': instance_uuid,
+                'tenant_id': project_id, 'network_id': net_id,
+                'admin_state_up': True, 'status': 'ACTIVE',
+                'mac_address': 'de:ad:be:ef:00:01',
+                'fixed_ips': [{'subnet_id': subnet_id,
+                               'ip_address': address}]}
+
+    @mock.patch.object(neutronapi, 'update_instance_info_cache')
+    @mock.patch.object(neutronv2, 'get_client')
+    def test_get_instances_nw_info(self, mock_get_client, mock_update_cache):
+        instances = [self._bulk_instance('uuid1', 'project1', 'port1',
+                                         'net1'),
+                     self._bulk_instance('uuid2', 'project2', 'port2',
+                                         'net2')]
+        ports = [self._bulk_port('port1', 'uuid1', 'project1', 'net1',
+                                 'subnet1', '10.0.1.2'),
+                 self._bulk_port('port2', 'uuid2', 'project2', 'net2',
+                                 'subnet2', '10.0.2.2'),
+                 # Not a port of the project of the instance
+                 self._bulk_port('port3', 'uuid2', 'project3', 'net2',
+                                 'subnet2', '10.0.2.3')]
+        dhcp_port = {'id': 'dhcp1', 'network_id': 'net1',
+                     'fixed_ips': [{'subnet_id': 'subnet1',
+                                    'ip_address': '10.0.1.1'}]}
+
+        def list_ports(**search_opts):
+            if 'device_owner' in search_opts:
+                return {'ports': [dhcp_port]}
+            return {'ports': ports}
+
+        client = mock_get_client.return_value
+        client.list_ports.side_effect = list_ports
+        client.list_floatingips.return_value = {'floatingips': [
+            {'port_id': 'port2', 'fixed_ip_address': '10.0.2.2',
+             'floating_ip_address': '172.24.4.2'}]}
+        client.list_subnets.return_value = {'subnets': [
+            {'id': 'subnet1', 'network_id': 'net1', 'cidr': '10.0.1.0/24',
+             'gateway_ip': '10.0.1.254'},
+            {'id': 'subnet2', 'network_id': 'net2', 'cidr': '10.0.2.0/24',
+             'gateway_ip': '10.0.2.254'}]}
+        client.list_networks.return_value = {'networks': [
+            {'id': 'net1', 'name': 'one', 'tenant_id': 'project1'},
+            {'id': 'net2', 'name': 'two', 'tenant_id': 'project2'}]}
+
+        nw_infos = self.api.get_instances_nw_info(self.context, instances)
+
+        self.assertEqual(2, client.list_ports.call_count)
+        client.list_floatingips.assert_called_once_with(
+            port_id=['port1', 'port2'])
+        self.assertEqual(1, client.list_subnets.call_count)
+        self.assertEqual(1, client.list_networks.call_count)
+        self.assertEqual(2, mock_update_cache.call_count)
+
+        self.assertEqual(['port1'], [vif['id'] for vif in nw_infos[0]])
+        self.assertEqual('one', nw_infos[0][0]['network']['label'])
+        self.assertEqual('10.0.1.1',
+                         nw_infos[0][0]['network']['subnets'][0]['meta'][
+                             'dhcp_server'])
+        self.assertEqual([], nw_infos[0][0].floating_ips())
+        self.assertEqual(['port2'], [vif['id'] for vif in nw_infos[1]])
+        self.assertEqual(['172.24.4.2'],
+                         [ip['address']
+                          for ip in nw_infos[1][0].floating_ips()])
+
+    @mock.patch.object(neutronapi.API, '_get_network_info_memo')
+    @mock.patch('nova.openstack.common.lockutils.lock')
+    def test_get_instances_nw_info_locks_before_fetching(self, mock_lock,
+                                                          mock_get_memo):
+        instances = [self._bulk_instance('uuid2', 'project1', 'port2',
+                                         'net1'),
+                     self._bulk_instance('uuid1', 'project1', 'port1',
+                                         'net1')]
+        mock_get_memo.side_effect = test.TestingException
+        self.assertRaises(test.TestingException,
+                          self.api.get_instances_nw_info,
+                          self.context, instances)
+        self.assertEqual([mock.call('refresh_cache-uuid1'),
+                          mock.call('refresh_cache-uuid2')],
+                         mock_lock.call_args_list)
+        self.assertEqual(2, mock_lock.return_value.__enter__.call_count)
+        self.assertEqual(2, mock_lock.return_value.__exit__.call_count)
+
+    @mock.patch.object(neutronapi, 'update_instance_info_cache')
+    @mock.patch.object(neutronapi.API, '_get_instance_nw_info')
+    @mock.patch.object(neutronapi.API, '_get_network_info_memo')
+    def test_get_instances_nw_info_failure(self, mock_get_memo,
+                                          mock_get_nw_info,
+                                          mock_update_cache):
+        instances = [self._bulk_instance('uuid1', 'project1', 'port1',
+                                         'net1'),
+                     self._bulk_instance('uuid2', 'project1', 'port2',
+                                         'net1')]
+        nw_info = model.NetworkInfo()
+        mock_get_nw_info.side_effect = [test.TestingException(), nw_info]
+
+        nw_infos = self.api.get_instances_nw_info(self.context, instances)
+
+        self.assertEqual([None, nw_info], nw_infos)
+        mock_update_cache.assert_called_once_with(
+            self.api, self.context, instances[1], nw_info=nw_info,
+            update_cells=False)
+
 
 class TestNeutronv2ModuleMethods(test.TestCase):
 
@@ -2175,6 +2293,20 @@ class TestNeutronv2ModuleMethods(test.TestCase):
                           'fake_context', 'fake_instance',
                           None, ['list', 'of', 'port_ids'])
 
+    def test_list_by_filter(self):
+        list_method = mock.Mock(return_value={'ports': [{'id': 'port'}]})
+        self.stubs.Set(neutronapi, '_BULK_FILTER_SIZE', 2)
+        ports = neutronapi._list_by_filter(list_method, 'ports', 'device_id',
+                                           ['a', 'b', 'c'],
+                                           tenant_id='fake')
+        self.assertEqual([{'id': 'port'}] * 2, ports)
+        self.assertEqual([mock.call(device_id=['a', 'b'], tenant_id='fake'),
+                          mock.call(device_id=['c'], tenant_id='fake')],
+                         list_method.call_args_list)
+        self.assertEqual([], neutronapi._list_by_filter(list_method, 'ports',
+                                                        'device_id', []))
+        self.assertEqual(2, list_method.call_count)
+
     def test_ensure_requested_network_ordering_no_preference_ids(self):
         l = [1, 2, 3]
 
@@ -2302,6 +2434,11 @@ class TestNeutronv2ExtraDhcpOpts(TestNeutronv2Base):
 
 
 class TestNeutronClientForAdminScenarios(test.TestCase):
+    def setUp(self):
+        super(TestNeutronClientForAdminScenarios, self).setUp()
+        neutronv2._client_pool.clear()
+        self.addCleanup(neutronv2._client_pool.clear)
+
     def test_get_cached_neutron_client_for_admin(self):
         self.flags(neutron_url='http://anyhost/')
         self.flags(neutron_url_timeout=30)
@@ -2327,6 +2464,7 @@ class TestNeutronClientForAdminScenarios(test.TestCase):
     def test_get_neutron_client_for_non_admin(self):
         self.flags(neutron_url='http://anyhost/')
         self.flags(neutron_url_timeout=30)
+        self.flags(neutron_client_pool_size=0)
         my_context = context.RequestContext('userid',
                                             'my_tenantid',
                                             auth_token='token')
@@ -2336,6 +2474,107 @@ class TestNeutronClientForAdminScenarios(test.TestCase):
         client2 = neutronv2.get_client(my_context)
         self.assertNotEqual(client, client2)
 
+    def _stub_list_ports(self, nested=None):
+        used = []
+
+        def fake_list_ports(client, **search_opts):
+            used.append(client)
+            if nested is not None and len(used) == 1:
+                neutronv2.get_client(nested).list_ports()
+            if search_opts.get('fail'):
+                raise exceptions.ConnectionFailed(reason='fake')
+            return {'ports': []}
+
+        self.stubs.Set(client.Client, 'list_ports', fake_list_ports)
+        return used
+
+    def test_get_pooled_neutron_client_for_non_admin(self):
+        self.flags(neutron_url='http://anyhost/')
+        self.flags(neutron_url_timeout=30)
+        my_context = context.RequestContext('userid',
+                                            'my_tenantid',
+                                            auth_token='token')
+        other_context = context.RequestContext('userid2',
+                                               'my_tenantid',
+                                               auth_token='token2')
+        used = self._stub_list_ports()
+
+        # Calls made with the same token share a client
+        neutronv2.get_client(my_context).list_ports()
+        neutronv2.get_client(my_context).list_ports()
+        neutronv2.get_client(other_context).list_ports()
+        self.assertIs(used[0], used[1])
+        self.assertIsNot(used[0], used[2])
+        self.assertEqual({'size': 2, 'hits': 1, 'misses': 2,
+                          'evictions': 0},
+                         neutronv2.get_client_pool_stats())
+
+    def test_pooled_neutron_client_checked_out(self):
+        self.flags(neutron_url='http://anyhost/')
+        my_context = context.RequestContext('userid',
+                                            'my_tenantid',
+                                            auth_token='token')
+        used = self._stub_list_ports(nested=my_context)
+
+        # A client is not shared with the calls made during its own
+        neutronv2.get_client(my_context).list_ports()
+        self.assertIsNot(used[0], used[1])
+        self.assertEqual(2, neutronv2.get_client_pool_stats()['size'])
+
+        # and is not reused once one of its calls failed
+        self.assertRaises(exceptions.ConnectionFailed,
+                          neutronv2.get_client(my_context).list_ports,
+                          fail=True)
+        self.assertEqual(1, neutronv2.get_client_pool_stats()['size'])
+
+    def test_neutron_client_pool_eviction(self):
+        self.flags(neutron_url='http://anyhost/')
+        self.flags(neutron_client_pool_size=2)
+        self.flags(neutron_client_pool_idle_timeout=60)
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: now[0]))
+        now = [1000]
+        contexts = [context.RequestContext('userid', 'my_tenantid',
+                                           auth_token='token%d' % i)
+                    for i in range(3)]
+        used = self._stub_list_ports()
+
+        neutronv2.get_client(contexts[0]).list_ports()
+        now[0] += 1
+        neutronv2.get_client(contexts[1]).list_ports()
+        now[0] += 1
+        # The least recently used client is dropped
+        neutronv2.get_client(contexts[2]).list_ports()
+        self.assertEqual(2, neutronv2.get_client_pool_stats()['size'])
+        neutronv2.get_client(contexts[0]).list_ports()
+        self.assertIsNot(used[0], used[3])
+
+        # and so are the idle ones
+        now[0] += 61
+        neutronv2.get_client(contexts[1]).list_ports()
+        self.assertIsNot(used[1], used[4])
+        self.assertEqual(1, neutronv2.get_client_pool_stats()['size'])
+        self.assertEqual(4, neutronv2.get_client_pool_stats()['evictions'])
+
+    def test_neutron_client_pool_report(self):
+        self.flags(neutron_url='http://anyhost/')
+        self.flags(neutron_client_pool_report_interval=60)
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: now[0]))
+        now = [1000]
+        neutronv2._client_pool.clear()
+        my_context = context.RequestContext('userid', 'my_tenantid',
+                                            auth_token='token')
+        self._stub_list_ports()
+
+        with mock.patch.object(neutronv2.LOG, 'info') as log_info:
+            neutronv2.get_client(my_context).list_ports()
+            self.assertFalse(log_info.called)
+            now[0] += 60
+            neutronv2.get_client(my_context).list_ports()
+            neutronv2.get_client(my_context).list_ports()
+        self.assertEqual(1, log_info.call_count)
+        self.assertEqual({'size': 0, 'hits': 1, 'misses': 1,
+                          'evictions': 0}, log_info.call_args[0][1])
+
     def test_get_neutron_client_for_non_admin_and_no_token(self):
         self.flags(neutron_url='http://anyhost/')
         self.flags(neutron_url_timeout=30)
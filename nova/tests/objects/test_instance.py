@@ -991,6 +991,17 @@ class _TestInstanceListObject(object):
             self.assertEqual(obj.uuid, fake['uuid'])
         self.assertRemotes()
 
+    def test_get_uuids_by_info_cache_age(self):
+        self.mox.StubOutWithMock(db, 'instance_get_uuids_by_info_cache_age')
+        db.instance_get_uuids_by_info_cache_age(
+                self.context, 'foo', use_slave=False).AndReturn(
+                        ['uuid2', 'uuid1'])
+        self.mox.ReplayAll()
+        uuids = instance.InstanceList.get_uuids_by_info_cache_age(
+                self.context, 'foo')
+        self.assertEqual(['uuid2', 'uuid1'], uuids)
+        self.assertRemotes()
+
     def test_with_fault(self):
         fake_insts = [
             fake_instance.fake_db_instance(uuid='fake-uuid', host='host'),
@@ -0,0 +1,102 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler aggregate metadata index.
+"""
+
+from nova import context
+from nova import db
+from nova.openstack.common import timeutils
+from nova.scheduler import aggregate_index
+from nova import test
+
+
+class AggregateMetadataIndexTestCase(test.TestCase):
+    """Test case for AggregateMetadataIndex class."""
+
+    def setUp(self):
+        super(AggregateMetadataIndexTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.index = aggregate_index.AggregateMetadataIndex()
+        self._create_aggregate('agg1', ['host1', 'host2'],
+                               {'availability_zone': 'az1', 'ssd': 'true'})
+        self._create_aggregate('agg2', ['host2'], {'ssd': 'false'})
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(AggregateMetadataIndexTestCase, self).tearDown()
+
+    def _create_aggregate(self, name, hosts, metadata):
+        aggregate = db.aggregate_create(self.context, {'name': name},
+                                        metadata=metadata)
+        for host in hosts:
+            db.aggregate_host_add(self.context, aggregate['id'], host)
+        return aggregate
+
+    def test_get_by_host(self):
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'ssd': set(['true'])},
+                         self.index.get_by_host(self.context, 'host1'))
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'ssd': set(['true', 'false'])},
+                         self.index.get_by_host(self.context, 'host2'))
+        self.assertEqual({}, self.index.get_by_host(self.context, 'host3'))
+
+    def test_get_by_host_and_key(self):
+        self.assertEqual({'ssd': set(['true', 'false'])},
+                         self.index.get_by_host(self.context, 'host2',
+                                                key='ssd'))
+        self.assertEqual({}, self.index.get_by_host(self.context, 'host2',
+                                                    key='foo'))
+
+    def test_matches_db_api(self):
+        for host in ('host1', 'host2', 'host3'):
+            for key in (None, 'ssd', 'availability_zone'):
+                self.assertEqual(
+                    db.aggregate_metadata_get_by_host(self.context, host,
+                                                      key=key),
+                    self.index.get_by_host(self.context, host, key=key))
+
+    def test_loaded_once(self):
+        self.mox.StubOutWithMock(db, 'aggregate_get_all')
+        db.aggregate_get_all(self.context).AndReturn([])
+        self.mox.ReplayAll()
+
+        for host in ('host1', 'host2', 'host3'):
+            self.assertEqual({}, self.index.get_by_host(self.context, host))
+
+    def test_invalidate(self):
+        self.index.get_by_host(self.context, 'host3')
+        self.assertFalse(self.index.needs_refresh())
+        self._create_aggregate('agg3', ['host3'], {'ssd': 'true'})
+        self.assertEqual({}, self.index.get_by_host(self.context, 'host3'))
+
+        self.index.invalidate()
+        self.assertTrue(self.index.needs_refresh())
+        self.assertEqual({'ssd': set(['true'])},
+                         self.index.get_by_host(self.context, 'host3'))
+
+    def test_refresh_interval(self):
+        self.flags(scheduler_aggregate_index_refresh_interval=60)
+        timeutils.set_time_override()
+        self.index.get_by_host(self.context, 'host3')
+        self._create_aggregate('agg3', ['host3'], {'ssd': 'true'})
+
+        timeutils.advance_time_seconds(30)
+        self.assertEqual({}, self.index.get_by_host(self.context, 'host3'))
+
+        timeutils.advance_time_seconds(31)
+        self.assertEqual({'ssd': set(['true'])},
+                         self.index.get_by_host(self.context, 'host3'))
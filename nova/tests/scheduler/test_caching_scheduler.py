@@ -13,12 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+import os
+
+import fixtures
 import mock
 
+from nova import db
 from nova import exception
 from nova.openstack.common import timeutils
 from nova.scheduler import caching_scheduler
 from nova.scheduler import host_manager
+from nova.scheduler import host_state_snapshot
+from nova.tests.scheduler import fakes
 from nova.tests.scheduler import test_scheduler
 
 ENABLE_PROFILER = False
@@ -72,6 +79,51 @@ class CachingSchedulerTestCase(test_scheduler.SchedulerTestCase):
             self.assertTrue(mock_get_hosts.called)
             self.assertEqual(mock_get_hosts.return_value, result)
 
+    def _use_snapshot(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'host-states')
+        self.flags(scheduler_host_state_snapshot_path=path)
+        self.driver = self.driver_cls()
+        return host_state_snapshot.HostStateSnapshot(path)
+
+    @mock.patch.object(db, 'compute_node_get_all')
+    def test_run_periodic_tasks_writes_snapshot(self, mock_get_all):
+        snapshot = self._use_snapshot()
+        mock_get_all.return_value = fakes.COMPUTE_NODES[:2]
+
+        self.driver.run_periodic_tasks(self.context)
+
+        self.assertEqual(1, snapshot.get_generation())
+        self.assertEqual(1, self.driver.snapshot_generation)
+        self.assertEqual(set(['host1', 'host2']),
+                         set(h.host for h in self.driver.all_host_states))
+
+    @mock.patch.object(db, 'compute_node_get_all')
+    def test_get_all_host_states_reads_new_snapshot(self, mock_get_all):
+        snapshot = self._use_snapshot()
+        updated_at = timeutils.utcnow() - datetime.timedelta(minutes=1)
+        compute_nodes = [dict(node, updated_at=updated_at)
+                         for node in fakes.COMPUTE_NODES[:4]]
+        snapshot.write(compute_nodes[:2])
+
+        result = self.driver._get_all_host_states(self.context)
+        self.assertEqual(2, len(result))
+        host_state = result[0]
+        host_state.consume_from_instance(
+                self._get_fake_request_spec()['instance_properties'])
+        free_ram_mb = host_state.free_ram_mb
+
+        # Same generation, nothing is reloaded
+        self.assertIs(result, self.driver._get_all_host_states(self.context))
+
+        # Consumed resources are kept on hosts that did not report since
+        snapshot.write(compute_nodes)
+        result = self.driver._get_all_host_states(self.context)
+        self.assertEqual(4, len(result))
+        self.assertIn(host_state, result)
+        self.assertEqual(free_ram_mb, host_state.free_ram_mb)
+        self.assertFalse(mock_get_all.called)
+
     def test_select_destination_raises_with_no_hosts(self):
         fake_request_spec = self._get_fake_request_spec()
         self.driver.all_host_states = []
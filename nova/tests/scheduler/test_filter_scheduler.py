@@ -28,6 +28,7 @@ from nova.conductor import api as conductor_api
 from nova import context
 from nova import db
 from nova import exception
+from nova.objects import instance as instance_obj
 from nova.objects import instance_group as instance_group_obj
 from nova.pci import pci_request
 from nova.scheduler import driver
@@ -35,6 +36,8 @@ from nova.scheduler import filter_scheduler
 from nova.scheduler import host_manager
 from nova.scheduler import utils as scheduler_utils
 from nova.scheduler import weights
+from nova.scheduler.weights import ram
+from nova import test
 from nova.tests import fake_instance
 from nova.tests.scheduler import fakes
 from nova.tests.scheduler import test_scheduler
@@ -63,6 +66,13 @@ def fake_get_group_filtered_affinity_hosts(hosts, filter_properties, index):
         return list(hosts)
 
 
+class FreeRAMWeigher(ram.RAMWeigher):
+    """RAMWeigher normalizing from the lowest free RAM, like MetricsWeigher
+    normalizes from the lowest metric.
+    """
+    minval = None
+
+
 class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
     """Test case for Filter Scheduler."""
 
@@ -397,12 +407,14 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
             'group_hosts': ['hostB'],
         }
 
+        member = fake_instance.fake_instance_obj(self.context,
+                uuid=group.members[0], host='hostA')
         with contextlib.nested(
             mock.patch.object(instance_group_obj.InstanceGroup, func,
                                return_value=group),
-            mock.patch.object(instance_group_obj.InstanceGroup, 'get_hosts',
-                               return_value=['hostA']),
-        ) as (get_group, get_hosts):
+            mock.patch.object(instance_obj.InstanceList, 'get_by_filters',
+                               return_value=[member]),
+        ) as (get_group, get_by_filters):
             update_group_hosts = sched._setup_instance_group(self.context,
                     filter_properties)
             self.assertTrue(update_group_hosts)
@@ -621,3 +633,154 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
             request_spec, filter_properties)
         self.assertEqual(filter_properties.get('pci_requests'),
                          requests)
+
+    def _schedule_instances(self, num_instances, filter_properties=None):
+        sched = fakes.FakeFilterScheduler()
+
+        def _fake_get_filtered_hosts(hosts, filter_properties, index):
+            group_hosts = filter_properties.get('group_hosts') or set()
+            return [host for host in hosts if host.free_ram_mb >= 500 and
+                    host.host not in group_hosts]
+
+        self.stubs.Set(sched.host_manager, 'get_filtered_hosts',
+                       _fake_get_filtered_hosts)
+        self.stubs.Set(sched.host_manager, 'weight_classes',
+                       [ram.RAMWeigher])
+        instance_properties = {'project_id': 1,
+                               'root_gb': 1,
+                               'memory_mb': 500,
+                               'ephemeral_gb': 0,
+                               'vcpus': 1,
+                               'os_type': 'Linux'}
+        request_spec = dict(instance_properties=instance_properties,
+                            instance_type={}, num_instances=num_instances)
+        hosts = sched._schedule(self.context, request_spec,
+                filter_properties=filter_properties or {})
+        return [host.obj.host for host in hosts]
+
+    def test_schedule_batch_placement(self):
+        self.flags(scheduler_host_subset_size=1)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(mox.IgnoreArg()).MultipleTimes().AndReturn(
+                fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+
+        expected = self._schedule_instances(30)
+        self.flags(scheduler_batch_placement=True)
+        result = self._schedule_instances(30)
+        self.assertEqual(expected, result)
+        # host1 to host4 have room for 1 + 2 + 6 + 16 instances
+        self.assertEqual(25, len(result))
+
+    def test_schedule_batch_placement_identical_hosts(self):
+        self.flags(scheduler_host_subset_size=1)
+        sched = fakes.FakeFilterScheduler()
+        self.stubs.Set(sched.host_manager, 'get_filtered_hosts',
+                       lambda hosts, props, index: [host for host in hosts
+                           if host.free_ram_mb >= 512])
+        self.stubs.Set(sched.host_manager, 'weight_classes',
+                       [FreeRAMWeigher])
+        hosts = [fakes.FakeHostState('host%d' % i, 'node',
+                                     {'free_ram_mb': 1024})
+                 for i in xrange(4)]
+        instance_properties = {'memory_mb': 512, 'root_gb': 1,
+                               'ephemeral_gb': 0, 'vcpus': 1}
+
+        result = sched._schedule_batch(hosts, {}, instance_properties, 8,
+                                       False)
+        self.assertEqual(['host0', 'host1', 'host2', 'host3'] * 2,
+                         [host.obj.host for host in result])
+
+    def test_schedule_batch_placement_anti_affinity(self):
+        self.flags(scheduler_batch_placement=True)
+        fakes.mox_host_manager_db_calls(self.mox, self.context)
+        filter_properties = {'group_hosts': set(),
+                             'group_policies': ['anti-affinity']}
+        self.mox.StubOutWithMock(filter_scheduler.FilterScheduler,
+                                 '_setup_instance_group')
+        filter_scheduler.FilterScheduler._setup_instance_group(
+                self.context, filter_properties).AndReturn(True)
+        self.mox.ReplayAll()
+
+        result = self._schedule_instances(5, filter_properties)
+        self.assertEqual(['host4', 'host3', 'host2', 'host1'], result)
+
+    def test_schedule_records_group_hosts(self):
+        fakes.mox_host_manager_db_calls(self.mox, self.context)
+        self.mox.ReplayAll()
+        sched = fakes.FakeFilterScheduler()
+        self.stubs.Set(sched.host_manager, 'get_filtered_hosts',
+                       lambda hosts, props, index: [host for host in hosts
+                           if host.host not in props['group_hosts']])
+        group = self._create_server_group()
+        request_spec = dict(instance_properties={'project_id': 1,
+                                                 'root_gb': 1,
+                                                 'memory_mb': 512,
+                                                 'ephemeral_gb': 0,
+                                                 'vcpus': 1,
+                                                 'os_type': 'Linux'},
+                            instance_type={}, num_instances=2)
+        filter_properties = {'scheduler_hints': {'group': group.uuid}}
+
+        with contextlib.nested(
+            mock.patch.object(instance_group_obj.InstanceGroup,
+                              'get_by_uuid', return_value=group),
+            mock.patch.object(instance_obj.InstanceList, 'get_by_filters',
+                              return_value=[]),
+        ):
+            hosts = sched._schedule(self.context, request_spec,
+                                    filter_properties)
+            self.assertEqual(
+                set(host.obj.host for host in hosts),
+                sched.instance_group_index.get_hosts(self.context, group))
+        self.assertEqual(2, len(hosts))
+
+    def test_schedule_batch_placement_affinity_per_instance(self):
+        self.flags(scheduler_batch_placement=True)
+        fakes.mox_host_manager_db_calls(self.mox, self.context)
+        self.mox.ReplayAll()
+        filter_properties = {'group_hosts': set(),
+                             'group_policies': ['affinity']}
+
+        with mock.patch.object(filter_scheduler.FilterScheduler,
+                               '_schedule_batch') as schedule_batch:
+            self._schedule_instances(2, filter_properties)
+        self.assertFalse(schedule_batch.called)
+
+
+class WeightHandlerReweighTestCase(test.NoDBTestCase):
+    def test_reweigh_object_keeps_normalization(self):
+        handler = weights.HostWeightHandler()
+        hosts = [fakes.FakeHostState('host%d' % i, 'node',
+                                     {'free_ram_mb': free_ram_mb})
+                 for i, free_ram_mb in enumerate((1024, 2048, 4096))]
+        weighers = [ram.RAMWeigher()]
+        weighed = handler.get_weighed_objects_with_weighers(weighers,
+                                                            hosts, {})
+        self.assertEqual(1.0, weighed[0].weight)
+
+        hosts[2].free_ram_mb = 1024
+        reweighed = handler.reweigh_object(weighers, hosts[2], {})
+        self.assertEqual(0.25, reweighed.weight)
+        self.assertEqual(4096, weighers[0].maxval)
+
+    def test_reweigh_object_out_of_range(self):
+        handler = weights.HostWeightHandler()
+        hosts = [fakes.FakeHostState('host%d' % i, 'node',
+                                     {'free_ram_mb': free_ram_mb})
+                 for i, free_ram_mb in enumerate((1024, 2048))]
+        weighers = [FreeRAMWeigher()]
+        handler.get_weighed_objects_with_weighers(weighers, hosts, {})
+
+        hosts[0].free_ram_mb = 512
+        self.assertIsNone(handler.reweigh_object(weighers, hosts[0], {}))
+
+    def test_reweigh_object_identical_objects(self):
+        handler = weights.HostWeightHandler()
+        hosts = [fakes.FakeHostState('host%d' % i, 'node',
+                                     {'free_ram_mb': 1024})
+                 for i in xrange(2)]
+        weighers = [FreeRAMWeigher()]
+        handler.get_weighed_objects_with_weighers(weighers, hosts, {})
+
+        self.assertIsNone(handler.reweigh_object(weighers, hosts[0], {}))
@@ -15,18 +15,23 @@
 Tests For Scheduler Host Filters.
 """
 
+import collections
 import httplib
 
+import mox
 from oslo.config import cfg
 import stubout
+import testtools
 
 from nova import context
 from nova import db
 from nova.openstack.common import jsonutils
 from nova.openstack.common import timeutils
 from nova.pci import pci_stats
+from nova.scheduler import aggregate_index
 from nova.scheduler import filters
 from nova.scheduler.filters import extra_specs_ops
+from nova.scheduler.filters import json_filter
 from nova.scheduler.filters import trusted_filter
 from nova import servicegroup
 from nova import test
@@ -352,6 +357,28 @@ class HostFiltersTestCase(test.NoDBTestCase):
 
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_affinity_filters_look_up_instances_once(self):
+        instance = fakes.FakeInstance(context=self.context,
+                                      params={'host': 'host2'})
+        hosts = [fakes.FakeHostState('host%d' % i, 'node', {})
+                 for i in xrange(1, 4)]
+        for filter_name, hint, expected in (
+                ('DifferentHostFilter', 'different_host', ['host1', 'host3']),
+                ('SameHostFilter', 'same_host', ['host2'])):
+            filt_cls = self.class_map[filter_name]()
+            filter_properties = {'context': self.context.elevated(),
+                                 'scheduler_hints': {hint: [instance.uuid]}}
+            self.mox.StubOutWithMock(filt_cls.compute_api, 'get_all')
+            filt_cls.compute_api.get_all(
+                    filter_properties['context'],
+                    {'uuid': [instance.uuid], 'deleted': False}).AndReturn(
+                            [{'host': 'host2'}])
+            self.mox.ReplayAll()
+            passing = filt_cls.filter_all(hosts, filter_properties)
+            self.assertEqual(expected, [host.host for host in passing])
+            self.mox.VerifyAll()
+            self.mox.UnsetStubs()
+
     def test_affinity_same_filter_passes(self):
         filt_cls = self.class_map['SameHostFilter']()
         host = fakes.FakeHostState('host1', 'node1', {})
@@ -1144,6 +1171,44 @@ class HostFiltersTestCase(test.NoDBTestCase):
                  'service': service})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
 
+    def test_json_filter_compiles_query_once(self):
+        json_query = jsonutils.dumps(
+                ['and', ['>=', '$free_ram_mb', 1024],
+                        ['>=', '$free_disk_mb', 200 * 1024]])
+        filter_properties = {'scheduler_hints': {'query': json_query}}
+        host = fakes.FakeHostState('host1', 'node1',
+                {'free_ram_mb': 1024,
+                 'free_disk_mb': 200 * 1024})
+        self.stubs.Set(json_filter.JsonFilter, '_compiled_queries',
+                       collections.OrderedDict())
+        self.mox.StubOutWithMock(jsonutils, 'loads')
+        jsonutils.loads(json_query).AndReturn(
+                ['and', ['>=', '$free_ram_mb', 1024],
+                        ['>=', '$free_disk_mb', 200 * 1024]])
+        self.mox.ReplayAll()
+        for i in xrange(2):
+            filt_cls = self.class_map['JsonFilter']()
+            self.assertTrue(filt_cls.host_passes(host, filter_properties))
+            host.free_ram_mb = 1023
+            self.assertFalse(filt_cls.host_passes(host, filter_properties))
+            host.free_ram_mb = 1024
+
+    def test_json_filter_query_cache_size(self):
+        self.stubs.Set(json_filter, 'QUERY_CACHE_SIZE', 2)
+        self.stubs.Set(json_filter.JsonFilter, '_compiled_queries',
+                       collections.OrderedDict())
+        host = fakes.FakeHostState('host1', 'node1', {'free_ram_mb': 1024})
+        for ram in (1, 2, 3, 2):
+            filter_properties = {'scheduler_hints': {
+                    'query': jsonutils.dumps(['>=', '$free_ram_mb', ram])}}
+            filt_cls = self.class_map['JsonFilter']()
+            self.assertTrue(filt_cls.host_passes(host, filter_properties))
+        self.assertEqual(
+                [jsonutils.dumps(['>=', '$free_ram_mb', ram])
+                 for ram in (3, 2)],
+                [query for (_cls, query)
+                 in json_filter.JsonFilter._compiled_queries])
+
     def test_json_filter_basic_operators(self):
         filt_cls = self.class_map['JsonFilter']()
         host = fakes.FakeHostState('host1', 'node1',
@@ -1480,6 +1545,33 @@ class HostFiltersTestCase(test.NoDBTestCase):
             }
         }
 
+    def test_aggregate_filters_use_aggregate_index(self):
+        self._create_aggregate_with_host(name='fake2',
+                                         metadata={'opt1': '1'})
+        aggregates = db.aggregate_get_all(self.context.elevated())
+        index = aggregate_index.AggregateMetadataIndex()
+        host = fakes.FakeHostState('host1', 'node1',
+                                   {'aggregate_index': index})
+        # Every lookup must be served by the index, loaded once
+        self.mox.StubOutWithMock(db, 'aggregate_metadata_get_by_host')
+        self.mox.StubOutWithMock(db, 'aggregate_get_all')
+        db.aggregate_get_all(mox.IgnoreArg()).AndReturn(aggregates)
+        self.mox.ReplayAll()
+
+        filt_cls = self.class_map['AggregateInstanceExtraSpecsFilter']()
+        filter_properties = {'context': self.context,
+            'instance_type': {'memory_mb': 1024,
+                              'extra_specs': {'opt1': '1'}}}
+        self.assertTrue(filt_cls.host_passes(host, filter_properties))
+        filter_properties['instance_type']['extra_specs'] = {'opt1': '2'}
+        self.assertFalse(filt_cls.host_passes(host, filter_properties))
+
+        filt_cls = self.class_map['AvailabilityZoneFilter']()
+        request = self._make_zone_request('fake_avail_zone')
+        self.assertTrue(filt_cls.host_passes(host, request))
+        request = self._make_zone_request('nova')
+        self.assertFalse(filt_cls.host_passes(host, request))
+
     def test_availability_zone_filter_same(self):
         filt_cls = self.class_map['AvailabilityZoneFilter']()
         service = {'availability_zone': 'nova'}
@@ -1830,3 +1922,92 @@ class HostFiltersTestCase(test.NoDBTestCase):
                                    attribute_dict={'metrics': metrics})
         filt_cls = self.class_map['MetricsFilter']()
         self.assertFalse(filt_cls.host_passes(host, None))
+
+
+@testtools.skipIf(filters.numpy is None, "numpy is not installed")
+class VectorizedHostFiltersTestCase(test.NoDBTestCase):
+    """Test that vectorized filters agree with host_passes()."""
+
+    def setUp(self):
+        super(VectorizedHostFiltersTestCase, self).setUp()
+        self.filter_handler = filters.HostFilterHandler()
+        self.class_map = dict((cls.__name__, cls) for cls in
+                              self.filter_handler.get_all_classes())
+        self.filter_properties = {'instance_type': {'memory_mb': 1024,
+                                                    'vcpus': 2,
+                                                    'root_gb': 10,
+                                                    'ephemeral_gb': 0,
+                                                    'swap': 512}}
+        self.hosts = []
+        for free_ram_mb, vcpus_total, vcpus_used, free_disk_mb, num in [
+                (2048, 4, 0, 20480, 0),
+                (1023, 4, 0, 20480, 0),
+                (-1024, 4, 6, 0, 50),
+                (512, 0, 8, 10752, 8),
+                (4096, 8, 7, 10751, 7)]:
+            self.hosts.append(fakes.FakeHostState('host%d' % len(self.hosts),
+                    'node', {'free_ram_mb': free_ram_mb,
+                             'total_usable_ram_mb': 2048,
+                             'vcpus_total': vcpus_total,
+                             'vcpus_used': vcpus_used,
+                             'free_disk_mb': free_disk_mb,
+                             'total_usable_disk_gb': 20,
+                             'num_instances': num,
+                             'num_io_ops': num}))
+
+    def _test_filter(self, filter_name):
+        filt_cls = self.class_map[filter_name]()
+        self.assertTrue(filt_cls.vectorized)
+        columns = filters.HostStateColumns(self.hosts)
+        passes = filt_cls.host_passes_vectorized(columns,
+                                                 self.filter_properties)
+        vectorized_limits = [dict(host.limits) for host in self.hosts]
+        for host in self.hosts:
+            host.limits = {}
+        expected = [filt_cls.host_passes(host, self.filter_properties)
+                    for host in self.hosts]
+        self.assertEqual(expected, list(passes))
+        for i, host in enumerate(self.hosts):
+            if expected[i]:
+                self.assertEqual(host.limits, vectorized_limits[i])
+
+    def test_ram_filter(self):
+        self.flags(ram_allocation_ratio=1.5)
+        self._test_filter('RamFilter')
+
+    def test_core_filter(self):
+        self.flags(cpu_allocation_ratio=2.0)
+        self._test_filter('CoreFilter')
+
+    def test_disk_filter(self):
+        self.flags(disk_allocation_ratio=1.0)
+        self._test_filter('DiskFilter')
+
+    def test_num_instances_filter(self):
+        self.flags(max_instances_per_host=50)
+        self._test_filter('NumInstancesFilter')
+
+    def test_io_ops_filter(self):
+        self.flags(max_io_ops_per_host=8)
+        self._test_filter('IoOpsFilter')
+
+    def test_core_filter_without_instance_type(self):
+        filt_cls = self.class_map['CoreFilter']()
+        columns = filters.HostStateColumns(self.hosts)
+        self.assertIsNone(filt_cls.host_passes_vectorized(columns, {}))
+
+    def test_get_filtered_objects(self):
+        filter_classes = [self.class_map[name] for name in
+                          ['RamFilter', 'ComputeFilter', 'CoreFilter',
+                           'DiskFilter', 'NumInstancesFilter', 'IoOpsFilter']]
+        self.stubs.Set(servicegroup.API, 'service_is_up',
+                       lambda self, service: True)
+        for host in self.hosts:
+            host.service = {'disabled': False}
+        expected = self.filter_handler.get_filtered_objects(
+                filter_classes, self.hosts, self.filter_properties)
+        self.flags(scheduler_vectorized_filters=True)
+        result = self.filter_handler.get_filtered_objects(
+                filter_classes, self.hosts, self.filter_properties)
+        self.assertEqual(expected, result)
+        self.assertEqual(['host0', 'host1'], [host.host for host in result])
@@ -15,6 +15,8 @@
 """
 Tests For HostManager
 """
+import datetime
+
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
@@ -373,6 +375,80 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         self.assertEqual(len(host_states_map), 0)
 
 
+class HostManagerIncrementalSyncTestCase(test.NoDBTestCase):
+    """Test case for incremental compute node syncing in HostManager."""
+
+    def setUp(self):
+        super(HostManagerIncrementalSyncTestCase, self).setUp()
+        self.flags(scheduler_host_state_full_sync_interval=600)
+        self.host_manager = host_manager.HostManager()
+        self.context = 'fake_context'
+        self.synced_at = datetime.datetime(2014, 1, 1, 12, 0, 0)
+        timeutils.set_time_override(self.synced_at)
+        self.addCleanup(timeutils.clear_time_override)
+        self.services = [dict(id=x, host='host%s' % x, disabled=False,
+                              binary='nova-compute') for x in xrange(1, 5)]
+        self.compute_nodes = []
+        for node in fakes.COMPUTE_NODES[:4]:
+            node = dict(node, service_id=node['id'],
+                        service=self.services[node['id'] - 1],
+                        created_at=self.synced_at, deleted=0)
+            self.compute_nodes.append(node)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'compute_node_get_all_changed_since')
+
+    def test_get_all_host_states_fetches_changed_nodes(self):
+        changed_at = self.synced_at + datetime.timedelta(seconds=30)
+        changed = dict(self.compute_nodes[0], free_ram_mb=256,
+                       updated_at=changed_at)
+        deleted = dict(self.compute_nodes[3], deleted=4,
+                       deleted_at=changed_at)
+        db.compute_node_get_all(self.context).AndReturn(self.compute_nodes)
+        margin = host_manager._CHANGED_SINCE_MARGIN
+        db.compute_node_get_all_changed_since(
+                self.context, self.synced_at - margin).AndReturn(
+                        ([changed, deleted], self.services))
+        db.compute_node_get_all_changed_since(
+                self.context, changed_at - margin).AndReturn(
+                        ([changed], self.services[:2]))
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(self.context)
+        timeutils.advance_time_seconds(60)
+        self.host_manager.get_all_host_states(self.context)
+        host_states_map = self.host_manager.host_state_map
+        self.assertEqual(3, len(host_states_map))
+        self.assertEqual(256, host_states_map[('host1', 'node1')].free_ram_mb)
+        self.assertNotIn(('host4', 'node4'), host_states_map)
+
+        # Losing the service of a cached node makes it dead as well
+        timeutils.advance_time_seconds(60)
+        self.host_manager.get_all_host_states(self.context)
+        self.assertEqual(set([('host1', 'node1'), ('host2', 'node2')]),
+                         set(host_states_map.keys()))
+
+    def test_get_all_host_states_within_max_staleness(self):
+        self.flags(scheduler_host_state_max_staleness=30)
+        db.compute_node_get_all(self.context).AndReturn(self.compute_nodes)
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(self.context)
+        timeutils.advance_time_seconds(10)
+        self.host_manager.get_all_host_states(self.context)
+        self.assertEqual(4, len(self.host_manager.host_state_map))
+
+    def test_get_all_host_states_full_sync_interval(self):
+        db.compute_node_get_all(self.context).AndReturn(self.compute_nodes)
+        db.compute_node_get_all(self.context).AndReturn(
+                self.compute_nodes[:2])
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(self.context)
+        timeutils.advance_time_seconds(601)
+        self.host_manager.get_all_host_states(self.context)
+        self.assertEqual(2, len(self.host_manager.host_state_map))
+
+
 class HostStateTestCase(test.NoDBTestCase):
     """Test case for HostState class."""
 
@@ -0,0 +1,67 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the shared host state snapshot.
+"""
+
+import datetime
+import os
+
+import fixtures
+
+from nova.scheduler import host_state_snapshot
+from nova import test
+
+
+class HostStateSnapshotTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(HostStateSnapshotTestCase, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tempdir, 'host-states')
+        self.snapshot = host_state_snapshot.HostStateSnapshot(self.path)
+        self.updated_at = datetime.datetime(2014, 1, 1, 12, 0, 0, 42)
+        self.compute_nodes = [dict(id=1, free_ram_mb=512,
+                                   updated_at=self.updated_at,
+                                   service=dict(host='host1',
+                                                updated_at=self.updated_at,
+                                                created_at=None))]
+
+    def test_read_missing(self):
+        self.assertIsNone(self.snapshot.get_generation())
+        self.assertEqual((None, None), self.snapshot.read())
+
+    def test_write_and_read(self):
+        self.assertEqual(1, self.snapshot.write(self.compute_nodes))
+        generation, compute_nodes = self.snapshot.read()
+        self.assertEqual(1, generation)
+        self.assertEqual(self.compute_nodes, compute_nodes)
+
+    def test_read_known_generation(self):
+        self.snapshot.write(self.compute_nodes)
+        self.assertEqual((1, None), self.snapshot.read(1))
+        self.assertEqual(2, self.snapshot.write([]))
+        self.assertEqual((2, []), self.snapshot.read(1))
+        self.assertEqual(2, self.snapshot.get_generation())
+
+    def test_single_writer(self):
+        self.assertTrue(self.snapshot.acquire_writer())
+        self.assertTrue(self.snapshot.acquire_writer())
+        # lockf locks are per process, so take the lock from a child
+        pid = os.fork()
+        if pid == 0:
+            other = host_state_snapshot.HostStateSnapshot(self.path)
+            os._exit(0 if not other.acquire_writer() else 1)
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
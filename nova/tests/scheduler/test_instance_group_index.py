@@ -0,0 +1,97 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler instance group host index.
+"""
+
+import mock
+
+from nova import context
+from nova.objects import instance as instance_obj
+from nova.objects import instance_group as instance_group_obj
+from nova.openstack.common import timeutils
+from nova.scheduler import instance_group_index
+from nova import test
+from nova.tests import fake_instance
+
+
+class InstanceGroupHostIndexTestCase(test.NoDBTestCase):
+    """Test case for InstanceGroupHostIndex class."""
+
+    def setUp(self):
+        super(InstanceGroupHostIndexTestCase, self).setUp()
+        self.context = context.RequestContext('fake_user', 'fake_project')
+        self.index = instance_group_index.InstanceGroupHostIndex()
+        self.group = instance_group_obj.InstanceGroup()
+        self.group.uuid = 'fake-group'
+        self.group.members = ['inst1', 'inst2', 'inst3']
+        timeutils.set_time_override()
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(InstanceGroupHostIndexTestCase, self).tearDown()
+
+    def _instance(self, uuid, host):
+        return fake_instance.fake_instance_obj(self.context, uuid=uuid,
+                                               host=host)
+
+    def _get_hosts(self, instances):
+        with mock.patch.object(instance_obj.InstanceList, 'get_by_filters',
+                               return_value=instances) as get_by_filters:
+            hosts = self.index.get_hosts(self.context, self.group)
+        self.assertEqual({'uuid': ['inst1', 'inst2', 'inst3'],
+                          'deleted': False},
+                         get_by_filters.call_args[1]['filters'])
+        return hosts
+
+    def test_get_hosts(self):
+        hosts = self._get_hosts([self._instance('inst1', 'host1'),
+                                 self._instance('inst2', 'host2'),
+                                 self._instance('inst3', None)])
+        self.assertEqual(set(['host1', 'host2']), hosts)
+
+    def test_get_hosts_of_moved_members(self):
+        self._get_hosts([self._instance('inst1', 'host1'),
+                         self._instance('inst2', 'host2'),
+                         self._instance('inst3', 'host3')])
+        hosts = self._get_hosts([self._instance('inst1', 'host1'),
+                                 self._instance('inst2', 'host4')])
+        self.assertEqual(set(['host1', 'host4']), hosts)
+
+    def test_add_host(self):
+        self.index.add_host('fake-group', 'host3')
+        self.index.add_host('other-group', 'host4')
+
+        hosts = self._get_hosts([self._instance('inst1', 'host1'),
+                                 self._instance('inst2', 'host2'),
+                                 self._instance('inst3', None)])
+        self.assertEqual(set(['host1', 'host2', 'host3']), hosts)
+
+    def test_added_host_dropped_once_member_shows_up(self):
+        self.index.add_host('fake-group', 'host3')
+        hosts = self._get_hosts([self._instance('inst3', 'host3')])
+        self.assertEqual(set(['host3']), hosts)
+
+        hosts = self._get_hosts([self._instance('inst3', 'host4')])
+        self.assertEqual(set(['host4']), hosts)
+
+    def test_added_host_expires(self):
+        self.flags(scheduler_instance_group_placement_timeout=60)
+        self.index.add_host('fake-group', 'host3')
+        timeutils.advance_time_seconds(61)
+
+        hosts = self._get_hosts([self._instance('inst1', 'host1')])
+        self.assertEqual(set(['host1']), hosts)
+        self.assertEqual({}, self.index.placed_hosts)
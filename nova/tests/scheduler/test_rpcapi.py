@@ -82,3 +82,15 @@ class SchedulerRpcAPITestCase(test.NoDBTestCase):
         self._test_scheduler_api('select_destinations', rpc_method='call',
                 request_spec='fake_request_spec',
                 filter_properties='fake_prop')
+
+    def test_aggregates_changed(self):
+        self._test_scheduler_api('aggregates_changed', rpc_method='cast',
+                fanout=True, version='3.1')
+
+    def test_aggregates_changed_version_cap(self):
+        rpcapi = scheduler_rpcapi.SchedulerAPI()
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        self.mox.StubOutWithMock(rpcapi, 'client')
+        rpcapi.client.can_send_version('3.1').AndReturn(False)
+        self.mox.ReplayAll()
+        rpcapi.aggregates_changed(ctxt)
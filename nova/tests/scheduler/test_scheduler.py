@@ -72,6 +72,12 @@ class SchedulerManagerTestCase(test.NoDBTestCase):
         manager = self.manager
         self.assertIsInstance(manager.driver, self.driver_cls)
 
+    def test_aggregates_changed(self):
+        index = self.manager.driver.host_manager.aggregate_index
+        index.stale = False
+        self.manager.aggregates_changed(self.context)
+        self.assertTrue(index.stale)
+
     def test_show_host_resources(self):
         host = 'fake_host'
 
@@ -582,3 +588,9 @@ class SchedulerV3PassthroughTestCase(test.TestCase):
                 ) as prep_resize:
             self.proxy.prep_resize(None, None, None, None, None, None, None)
             prep_resize.assert_called_once()
+
+    def test_aggregates_changed(self):
+        with mock.patch.object(self.manager, 'aggregates_changed'
+                ) as aggregates_changed:
+            self.proxy.aggregates_changed(None)
+            aggregates_changed.assert_called_once_with(None)
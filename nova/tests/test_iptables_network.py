@@ -126,6 +126,16 @@ class IptablesManagerTestCase(test.NoDBTestCase):
                         '-s 1.2.3.4/5 -j DROP' % self.binary_name
                         not in new_lines)
 
+    def test_unmatched_remove_rules_are_flushed(self):
+        table = self.manager.ipv4['filter']
+        for i in range(3):
+            rule = '-s 1.2.3.%d -j DROP' % i
+            table.add_rule('FORWARD', rule, wrap=False)
+            table.remove_rule('FORWARD', rule, wrap=False)
+        self.assertEqual(3, len(table.remove_rules))
+        self.manager._modify_rules(self.sample_filter, table, 'filter')
+        self.assertEqual([], table.remove_rules)
+
     def test_remove_rules_regex(self):
         current_lines = self.sample_nat
         table = self.manager.ipv4['nat']
@@ -276,3 +286,62 @@ class IptablesManagerTestCase(test.NoDBTestCase):
                                                self.manager.ipv4['filter'],
                                                'filter')
         self.assertEqual(current_lines, new_lines)
+
+    def _apply(self):
+        executes = []
+
+        def fake_execute(*cmd, **kwargs):
+            executes.append((cmd, kwargs.get('process_input')))
+            if cmd == ('iptables-save', '-c'):
+                return '\n'.join(self.sample_filter + self.sample_nat), ''
+            return '', ''
+
+        self.stubs.Set(self.manager, 'execute', fake_execute)
+        self.manager.apply()
+        return executes
+
+    def test_apply_changed_chains(self):
+        self.flags(use_ipv6=False, iptables_full_apply_interval=600)
+        self.assertEqual([('iptables-save', '-c'), ('iptables-restore', '-c')],
+                         [cmd for cmd, process_input in self._apply()])
+
+        table = self.manager.ipv4['filter']
+        table.add_chain('inst-1')
+        table.add_rule('inst-1', '-s 1.2.3.4/32 -j ACCEPT')
+        table.add_rule('local', '-d 10.0.0.1 -j $inst-1')
+        executes = self._apply()
+        self.assertEqual(1, len(executes))
+        cmd, process_input = executes[0]
+        self.assertEqual(('iptables-restore', '-c', '--noflush'), cmd)
+        self.assertEqual(['*filter',
+                          ':%s-inst-1 - [0:0]' % self.binary_name,
+                          ':%s-local - [0:0]' % self.binary_name,
+                          '[0:0] -A %s-inst-1 -s 1.2.3.4/32 -j ACCEPT' %
+                          self.binary_name,
+                          '[0:0] -A %s-local -d 10.0.0.1 -j %s-inst-1' %
+                          (self.binary_name, self.binary_name),
+                          'COMMIT'], process_input.split('\n'))
+
+        table.remove_chain('inst-1')
+        cmd, process_input = self._apply()[0]
+        self.assertEqual(['*filter',
+                          ':%s-local - [0:0]' % self.binary_name,
+                          ':%s-inst-1 - [0:0]' % self.binary_name,
+                          '-X %s-inst-1' % self.binary_name,
+                          'COMMIT'], process_input.split('\n'))
+
+    def test_apply_all_rules_when_unwrapped_rules_change(self):
+        self.flags(use_ipv6=False, iptables_full_apply_interval=600)
+        self._apply()
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-j ACCEPT',
+                                             wrap=False)
+        self.assertEqual([('iptables-save', '-c'), ('iptables-restore', '-c')],
+                         [cmd for cmd, process_input in self._apply()])
+
+    def test_apply_all_rules_after_interval(self):
+        self.flags(use_ipv6=False, iptables_full_apply_interval=600)
+        self._apply()
+        self.flags(iptables_full_apply_interval=0)
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-j ACCEPT')
+        self.assertEqual([('iptables-save', '-c'), ('iptables-restore', '-c')],
+                         [cmd for cmd, process_input in self._apply()])
@@ -18,6 +18,7 @@ import StringIO
 import sys
 
 from nova.cmd import manage
+from nova.compute import flavors
 from nova import context
 from nova import db
 from nova import exception
@@ -396,6 +397,61 @@ class DBCommandsTestCase(test.TestCase):
     def test_archive_deleted_rows_negative(self):
         self.assertEqual(1, self.commands.archive_deleted_rows(-1))
 
+    def test_archive_deleted_rows_invalid_batch_size(self):
+        self.assertEqual(1, self.commands.archive_deleted_rows(None,
+                                                               batch_size=0))
+
+    def test_archive_deleted_rows(self):
+        def fake_archive_deleted_rows(context, max_rows, batch_size,
+                                      batch_delay, workers, progress):
+            self.assertEqual((10, 100, 0.5, 2),
+                             (max_rows, batch_size, batch_delay, workers))
+            progress('instances', 8, 2.0)
+            progress('fixed_ips', 0, 0.0)
+            return 8
+
+        self.stubs.Set(db, 'archive_deleted_rows', fake_archive_deleted_rows)
+        output = StringIO.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', output))
+        self.commands.archive_deleted_rows('10', batch_size='100',
+                                           batch_delay='0.5', workers='2')
+        self.assertEqual('instances: 8 rows archived in 2.0 seconds '
+                         '(4.0 rows/s)\n8 rows archived\n',
+                         output.getvalue())
+
+
+class VmCommandsTestCase(test.TestCase):
+    def setUp(self):
+        super(VmCommandsTestCase, self).setUp()
+        self.commands = manage.VmCommands()
+        self.context = context.get_admin_context()
+        sys_meta = flavors.save_flavor_info({},
+                                            flavors.get_default_flavor())
+        for name, host in (('vm1', 'host1'), ('vm2', 'host2')):
+            db.instance_create(self.context,
+                               {'display_name': name, 'host': host,
+                                'vm_state': 'active', 'launch_index': 0,
+                                'system_metadata': sys_meta})
+
+    def _list(self, host=None):
+        output = StringIO.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', output))
+        self.commands.list(host)
+        return output.getvalue().splitlines()[1:]
+
+    def test_list(self):
+        lines = sorted(self._list())
+        self.assertEqual(2, len(lines))
+        self.assertEqual(['vm1', 'host1', 'm1.small', 'active'],
+                         lines[0].split()[:4])
+        self.assertEqual(['vm2', 'host2', 'm1.small', 'active'],
+                         lines[1].split()[:4])
+
+    def test_list_host(self):
+        lines = self._list('host2')
+        self.assertEqual(1, len(lines))
+        self.assertEqual('vm2', lines[0].split()[0])
+
 
 class ServiceCommandsTestCase(test.TestCase):
     def setUp(self):
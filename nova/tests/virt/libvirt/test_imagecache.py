@@ -21,6 +21,7 @@ import json
 import os
 import time
 
+import mock
 from oslo.config import cfg
 
 from nova import conductor
@@ -865,6 +866,63 @@ class VerifyChecksumTestCase(test.NoDBTestCase):
                 log = stream.getvalue()
                 self.assertNotEqual(log.find('image verification failed'), -1)
 
+    def _verify_stored_checksum(self, tmpdir, modify=False, rewrite=False,
+                                touch=False):
+        self.flags(checksum_interval_seconds=0, group='libvirt')
+        self.flags(instances_path=tmpdir)
+        self.flags(image_info_filename_pattern=('$instances_path/'
+                                                '%(image)s.info'),
+                   group='libvirt')
+        fname, info_fname, testdata = self._make_checksum(tmpdir)
+        os.utime(fname, (-1, time.time() - 3600))
+        imagecache.write_stored_checksum(fname)
+        if modify:
+            with open(fname, 'a') as f:
+                f.write('modified')
+        if rewrite:
+            # Same size and inode, only the modification time changes
+            with open(fname, 'r+') as f:
+                f.write('X')
+
+        image_cache_manager = imagecache.ImageCacheManager()
+        if touch:
+            image_cache_manager._touch_base_file(fname)
+        with mock.patch.object(imagecache, '_hash_file',
+                               side_effect=imagecache._hash_file) as hash_file:
+            res = image_cache_manager._verify_checksum(self.img, fname)
+        return res, hash_file.called
+
+    def test_verify_checksum_unmodified(self):
+        with utils.tempdir() as tmpdir:
+            res, hashed = self._verify_stored_checksum(tmpdir)
+            self.assertTrue(res)
+            self.assertFalse(hashed)
+
+    def test_verify_checksum_unmodified_rehashed(self):
+        self.flags(checksum_unmodified_base_images=True, group='libvirt')
+        with utils.tempdir() as tmpdir:
+            res, hashed = self._verify_stored_checksum(tmpdir)
+            self.assertTrue(res)
+            self.assertTrue(hashed)
+
+    def test_verify_checksum_modified(self):
+        with utils.tempdir() as tmpdir:
+            res, hashed = self._verify_stored_checksum(tmpdir, modify=True)
+            self.assertFalse(res)
+            self.assertTrue(hashed)
+
+    def test_verify_checksum_rewritten(self):
+        with utils.tempdir() as tmpdir:
+            res, hashed = self._verify_stored_checksum(tmpdir, rewrite=True)
+            self.assertFalse(res)
+            self.assertTrue(hashed)
+
+    def test_verify_checksum_touched(self):
+        with utils.tempdir() as tmpdir:
+            res, hashed = self._verify_stored_checksum(tmpdir, touch=True)
+            self.assertTrue(res)
+            self.assertFalse(hashed)
+
     def test_verify_checksum_file_missing(self):
         with utils.tempdir() as tmpdir:
             self.flags(instances_path=tmpdir)
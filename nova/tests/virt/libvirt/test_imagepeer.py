@@ -0,0 +1,221 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import cStringIO
+import hashlib
+import os
+import urllib2
+
+import fixtures
+import mock
+import webob
+
+from nova import context
+from nova.image import glance
+from nova.objects import instance as instance_obj
+from nova.objects import service as service_obj
+from nova.openstack.common import timeutils
+from nova import servicegroup
+from nova import test
+from nova.tests import fake_instance
+from nova.virt import images
+from nova.virt.libvirt import imagepeer
+
+
+class ImagePeerAppTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ImagePeerAppTestCase, self).setUp()
+        self.instances_path = self.useFixture(fixtures.TempDir()).path
+        self.flags(instances_path=self.instances_path)
+        self.flags(image_peer_port=9999, image_peer_shared_secret='secret',
+                   group='libvirt')
+        base_dir = os.path.join(self.instances_path, '_base')
+        os.mkdir(base_dir)
+        with open(os.path.join(base_dir, hashlib.sha1('image1').hexdigest()),
+                  'wb') as f:
+            f.write('someData')
+        self.app = imagepeer.ImagePeerApp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.expires = timeutils.utcnow_ts() + 60
+
+    def _get(self, path, signature=None, size=8, expires=None):
+        expires = expires or self.expires
+        req = webob.Request.blank(path)
+        req.headers['X-Image-Peer-Size'] = str(size)
+        req.headers['X-Image-Peer-Expires'] = str(expires)
+        if signature is not None:
+            req.headers['X-Image-Peer-Signature'] = signature
+        return req.get_response(self.app)
+
+    def _sign(self, image_id, size=8):
+        return imagepeer._sign(image_id, size, self.expires)
+
+    def test_get_image(self):
+        res = self._get('/images/image1', self._sign('image1'))
+        self.assertEqual(200, res.status_int)
+        self.assertEqual('someData', res.body)
+
+    def test_get_image_bad_signature(self):
+        res = self._get('/images/image1', self._sign('image2'))
+        self.assertEqual(403, res.status_int)
+        res = self._get('/images/image1', self._sign('image1', size=9))
+        self.assertEqual(403, res.status_int)
+        res = self._get('/images/image1')
+        self.assertEqual(403, res.status_int)
+
+    def test_get_image_expired_signature(self):
+        expires = timeutils.utcnow_ts() - 1
+        res = self._get('/images/image1',
+                        imagepeer._sign('image1', 8, expires),
+                        expires=expires)
+        self.assertEqual(403, res.status_int)
+
+    def test_get_image_without_size(self):
+        req = webob.Request.blank('/images/image1')
+        req.headers['X-Image-Peer-Signature'] = self._sign('image1')
+        res = req.get_response(self.app)
+        self.assertEqual(400, res.status_int)
+
+    def test_get_image_other_size(self):
+        res = self._get('/images/image1', self._sign('image1', size=9),
+                        size=9)
+        self.assertEqual(404, res.status_int)
+
+    def test_get_missing_image(self):
+        res = self._get('/images/image2', self._sign('image2'))
+        self.assertEqual(404, res.status_int)
+        res = self._get('/other/image1', self._sign('image1'))
+        self.assertEqual(404, res.status_int)
+
+
+class ImagePeerFetchTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ImagePeerFetchTestCase, self).setUp()
+        self.flags(host='host1')
+        self.flags(image_peer_port=9999, image_peer_shared_secret='secret',
+                   image_peer_max_peers=2, group='libvirt')
+        self.context = context.RequestContext('fake', 'fake')
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'image')
+        self.image_meta = {'disk_format': 'raw', 'size': 8,
+                           'checksum': hashlib.md5('someData').hexdigest()}
+        self.urls = []
+        self.peer_data = {}
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+        self.useFixture(fixtures.MonkeyPatch(
+                'random.shuffle', lambda hosts: hosts.sort()))
+        self.useFixture(fixtures.MonkeyPatch(
+                'urllib2.urlopen', self._fake_urlopen))
+
+    def _fake_urlopen(self, req, timeout=None):
+        url = req.get_full_url()
+        self.urls.append(url)
+        expires = timeutils.utcnow_ts() + 60
+        self.assertEqual(str(expires), req.get_header('X-image-peer-expires'))
+        self.assertEqual('8', req.get_header('X-image-peer-size'))
+        self.assertEqual(imagepeer._sign('image1', 8, expires),
+                         req.get_header('X-image-peer-signature'))
+        data = self.peer_data.get(url)
+        if data is None:
+            raise urllib2.HTTPError(url, 404, 'Not Found', {}, None)
+        return cStringIO.StringIO(data)
+
+    def _fetch(self, peers_asked=True):
+        services = [mock.Mock(host=host)
+                    for host in ('host1', 'host2', 'host3', 'host4',
+                                 'host5')]
+        instances = [fake_instance.fake_instance_obj(self.context, host=host)
+                     for host in ('host2', 'host3', 'host3', 'host4')]
+        with contextlib.nested(
+            mock.patch.object(glance.GlanceImageService, 'show',
+                              return_value=self.image_meta),
+            mock.patch.object(service_obj.ServiceList, 'get_by_topic',
+                              return_value=services),
+            mock.patch.object(servicegroup.API, 'service_is_up',
+                              side_effect=lambda service:
+                                  service.host != 'host5'),
+            mock.patch.object(instance_obj.InstanceList, 'get_by_filters',
+                              return_value=instances),
+            mock.patch.object(images, 'fetch'),
+        ) as (show, get_by_topic, service_is_up, get_by_filters, fetch):
+            imagepeer.fetch(self.context, 'image1', self.path, 'fake',
+                            'fake')
+            show.assert_called_once_with(self.context, 'image1')
+            if peers_asked:
+                self.assertEqual({'image_ref': 'image1', 'deleted': False,
+                                  'host': ['host2', 'host3', 'host4']},
+                                 get_by_filters.call_args[0][1])
+                self.assertEqual(100, get_by_filters.call_args[1]['limit'])
+            else:
+                self.assertFalse(get_by_filters.called)
+        return fetch
+
+    def test_fetch_from_peer(self):
+        self.peer_data['http://host3:9999/images/image1'] = 'someData'
+        fetch = self._fetch()
+        self.assertFalse(fetch.called)
+        self.assertEqual(['http://host2:9999/images/image1',
+                          'http://host3:9999/images/image1'], self.urls)
+        with open(self.path) as f:
+            self.assertEqual('someData', f.read())
+
+    def test_fetch_qcow2_from_peer(self):
+        self.flags(force_raw_images=False)
+        self.image_meta['disk_format'] = 'qcow2'
+        self.peer_data['http://host2:9999/images/image1'] = 'someData'
+        fetch = self._fetch()
+        self.assertFalse(fetch.called)
+        with open(self.path) as f:
+            self.assertEqual('someData', f.read())
+
+    def test_fetch_converted_image(self):
+        self.image_meta['disk_format'] = 'qcow2'
+        self.peer_data['http://host2:9999/images/image1'] = 'someData'
+        fetch = self._fetch(peers_asked=False)
+        self.assertTrue(fetch.called)
+        self.assertEqual([], self.urls)
+
+    def test_fetch_without_checksum(self):
+        self.image_meta['checksum'] = None
+        self.peer_data['http://host2:9999/images/image1'] = 'someData'
+        fetch = self._fetch(peers_asked=False)
+        self.assertTrue(fetch.called)
+        self.assertEqual([], self.urls)
+
+    def test_fetch_from_glance(self):
+        fetch = self._fetch()
+        fetch.assert_called_once_with(self.context, 'image1', self.path,
+                                      'fake', 'fake', max_size=0)
+        self.assertEqual(2, len(self.urls))
+
+    def test_fetch_checksum_mismatch(self):
+        self.peer_data['http://host2:9999/images/image1'] = 'otherData'
+        fetch = self._fetch()
+        self.assertTrue(fetch.called)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_fetch_disabled(self):
+        self.flags(image_peer_shared_secret='', group='libvirt')
+        with mock.patch.object(images, 'fetch') as fetch:
+            imagepeer.fetch(self.context, 'image1', self.path, 'fake',
+                            'fake')
+            fetch.assert_called_once_with(self.context, 'image1', self.path,
+                                          'fake', 'fake', max_size=0)
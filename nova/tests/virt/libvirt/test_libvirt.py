@@ -23,6 +23,7 @@ import mox
 import os
 import re
 import shutil
+import stat
 import tempfile
 
 from eventlet import greenthread
@@ -41,10 +42,13 @@ from nova.compute import vm_states
 from nova import context
 from nova import db
 from nova import exception
+from nova.network import linux_net
 from nova.network import model as network_model
 from nova.objects import flavor as flavor_obj
 from nova.objects import instance as instance_obj
 from nova.objects import pci_device as pci_device_obj
+from nova.objects import security_group as security_group_obj
+from nova.objects import security_group_rule as security_group_rule_obj
 from nova.objects import service as service_obj
 from nova.openstack.common import fileutils
 from nova.openstack.common import importutils
@@ -77,6 +81,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import driver as libvirt_driver
 from nova.virt.libvirt import firewall
 from nova.virt.libvirt import imagebackend
+from nova.virt.libvirt import imagepeer
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt import netutils
 
@@ -2440,6 +2445,64 @@ class LibvirtConnTestCase(test.TestCase):
         # Only one should be listed, since domain with ID 0 must be skipped
         self.assertEqual(len(instances), 1)
 
+    def test_get_power_states(self):
+        def fake_domain(uuidstr, domain_id=1, state=None):
+            domain = FakeVirtDomain(uuidstr=uuidstr)
+            domain.ID = lambda: domain_id
+            if state is None:
+                domain.info = lambda: self.fail('info() was called')
+            else:
+                domain.info = lambda: [state, None, None, None, None]
+            return domain
+
+        domains = {
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_RUNNING: [
+                fake_domain('dom0', domain_id=0),
+                fake_domain('uuid1')],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_PAUSED: [
+                fake_domain('uuid2')],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_SHUTOFF: [
+                fake_domain('uuid3', domain_id=-1)],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_OTHER: [
+                fake_domain('uuid4',
+                            state=libvirt_driver.VIR_DOMAIN_CRASHED)],
+        }
+
+        class FakeConn(object):
+            def listAllDomains(self, flags):
+                return domains[flags]
+
+        self.stubs.Set(libvirt_driver.LibvirtDriver, '_conn', FakeConn())
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        self.assertEqual({'uuid1': power_state.RUNNING,
+                          'uuid2': power_state.PAUSED,
+                          'uuid3': power_state.SHUTDOWN,
+                          'uuid4': power_state.CRASHED},
+                         conn.get_power_states())
+
+    def test_get_power_states_without_list_all_domains(self):
+        class FakeConn(object):
+            def numOfDomains(self):
+                return 2
+
+            def listDomainsID(self):
+                return [0, 1]
+
+            def lookupByID(self, domain_id):
+                return FakeVirtDomain(uuidstr='uuid1')
+
+            def listDefinedDomains(self):
+                return ['instance-2']
+
+            def lookupByName(self, name):
+                return FakeVirtDomain(uuidstr='uuid2')
+
+        self.stubs.Set(libvirt_driver.LibvirtDriver, '_conn', FakeConn())
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        self.assertEqual({'uuid1': power_state.RUNNING,
+                          'uuid2': power_state.RUNNING},
+                         conn.get_power_states())
+
     def test_list_defined_instances(self):
         self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_conn')
         libvirt_driver.LibvirtDriver._conn.lookupByID = self.fake_lookup
@@ -4516,6 +4579,43 @@ class LibvirtConnTestCase(test.TestCase):
 
         db.instance_destroy(self.context, instance_ref['uuid'])
 
+    def test_get_instance_disk_info_cached(self):
+        dummyxml = ("<domain type='kvm'><name>instance-0000000a</name>"
+                    "<uuid>fake-uuid</uuid>"
+                    "<devices>"
+                    "<disk type='file'><driver name='qemu' type='qcow2'/>"
+                    "<source file='/test/disk'/>"
+                    "<target dev='vda' bus='virtio'/></disk>"
+                    "</devices></domain>")
+        st = mock.Mock(st_ino=1, st_size=3328599655, st_mtime=0,
+                       st_mode=stat.S_IFREG)
+        images._qemu_img_info_cache.clear()
+        self.addCleanup(images._qemu_img_info_cache.clear)
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+
+        with contextlib.nested(
+            mock.patch.object(os, 'stat', return_value=st),
+            mock.patch.object(os.path, 'getsize', return_value=3328599655),
+            mock.patch.object(utils, 'execute',
+                              return_value=('virtual size: 20G '
+                                            '(21474836480 bytes)\n', '')),
+        ) as (_stat, _getsize, execute):
+            for i in range(2):
+                info = jsonutils.loads(conn.get_instance_disk_info(
+                        'instance-0000000a', xml=dummyxml))
+            self.assertEqual(21474836480, info[0]['virt_disk_size'])
+            # The qemu-img info cache only ran qemu-img once
+            self.assertEqual(1, execute.call_count)
+
+            # The disk was modified
+            st.st_mtime = 1
+            conn.get_instance_disk_info('instance-0000000a', xml=dummyxml)
+            self.assertEqual(2, execute.call_count)
+
+            # The domain was restarted
+            conn._invalidate_domain_caches('fake-uuid')
+            self.assertEqual({}, conn._domain_configs)
+
     def test_spawn_with_network_info(self):
         # Preparing mocks
         def fake_none(*args, **kwargs):
@@ -5814,9 +5914,27 @@ class LibvirtConnTestCase(test.TestCase):
         # Ensure destroy calls managedSaveRemove for saved instance.
         conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
 
-        def list_instances():
-            return ['fake1', 'fake2']
-        self.stubs.Set(conn, 'list_instances', list_instances)
+        def list_instance_ids():
+            return [1]
+        self.stubs.Set(conn, 'list_instance_ids', list_instance_ids)
+        conn._conn.listDefinedDomains = lambda: ['fake2']
+
+        class FakeDomain(object):
+            def __init__(self, name):
+                self._name = name
+
+            def name(self):
+                return self._name
+
+            def XMLDesc(self, flags):
+                return '<domain/>'
+
+            def vcpus(self):
+                return ([1], [True])
+
+        self.stubs.Set(conn, '_lookup_by_id',
+                       lambda dom_id: FakeDomain('fake1'))
+        self.stubs.Set(conn, '_lookup_by_name', FakeDomain)
 
         fake_disks = {'fake1': [{'type': 'qcow2', 'path': '/somepath/disk1',
                                  'virt_disk_size': '10737418240',
@@ -5829,13 +5947,62 @@ class LibvirtConnTestCase(test.TestCase):
                                  'disk_size': '10737418240',
                                  'over_committed_disk_size': '0'}]}
 
-        def get_info(instance_name):
+        def get_info(instance_name, xml=None):
+            self.assertEqual('<domain/>', xml)
             return jsonutils.dumps(fake_disks.get(instance_name))
         self.stubs.Set(conn, 'get_instance_disk_info', get_info)
 
         result = conn.get_disk_over_committed_size_total()
         self.assertEqual(result, 10653532160)
 
+    def test_get_domains_usage(self):
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        doms = {}
+        for name, vcpus in (('fake1', 2), ('fake2', 4), ('fake3', 1)):
+            dom = mock.Mock()
+            dom.name.return_value = name
+            dom.XMLDesc.return_value = '<domain name="%s"/>' % name
+            dom.vcpus.return_value = ([1] * vcpus, [True] * vcpus)
+            doms[name] = dom
+        disks = {'fake1': [{'over_committed_disk_size': '10'}],
+                 'fake2': [],
+                 'fake3': [{'over_committed_disk_size': '5'}]}
+
+        with contextlib.nested(
+            mock.patch.object(conn, 'list_instance_ids', return_value=[1, 2]),
+            mock.patch.object(conn._conn, 'listDefinedDomains',
+                              return_value=['fake1', 'fake3'], create=True),
+            mock.patch.object(conn, '_lookup_by_id',
+                              side_effect=lambda dom_id: doms['fake%d' %
+                                                              dom_id]),
+            mock.patch.object(conn, '_lookup_by_name',
+                              side_effect=lambda name: doms[name]),
+            mock.patch.object(conn, 'get_instance_disk_info',
+                side_effect=lambda name, xml: jsonutils.dumps(disks[name])),
+        ) as (list_instance_ids, list_defined, lookup_by_id, lookup_by_name,
+              get_instance_disk_info):
+            domains = conn._get_domains_usage()
+            self.assertEqual(['fake1', 'fake2', 'fake3'],
+                             [domain['name'] for domain in domains])
+            self.assertEqual(6, conn.get_vcpu_used(domains))
+            self.assertEqual(15,
+                             conn.get_disk_over_committed_size_total(domains))
+            lookup_by_name.assert_called_once_with('fake3')
+            for dom in doms.values():
+                self.assertEqual(1, dom.XMLDesc.call_count)
+
+            # The vcpus are only counted again when the XML changed
+            doms['fake2'].XMLDesc.return_value = '<domain name="fake2-2"/>'
+            doms['fake2'].vcpus.return_value = ([1], [True])
+            self.assertEqual(3, conn.get_vcpu_used())
+            self.assertEqual(1, doms['fake1'].vcpus.call_count)
+            self.assertEqual(2, doms['fake2'].vcpus.call_count)
+            self.assertFalse(doms['fake3'].vcpus.called)
+
+            list_instance_ids.return_value = [2]
+            conn._get_domains_usage()
+            self.assertEqual([2], conn._domain_vcpus.keys())
+
     def test_cpu_info(self):
         conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
 
@@ -6373,10 +6540,17 @@ class LibvirtConnTestCase(test.TestCase):
                 else:
                     return ([1] * self._vcpus, [True] * self._vcpus)
 
+            def name(self):
+                return 'fake-%s' % self._vcpus
+
+            def XMLDesc(self, flags):
+                return '<domain/>'
+
         driver = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
         conn = driver._conn
         self.mox.StubOutWithMock(driver, 'list_instance_ids')
         conn.lookupByID = self.mox.CreateMockAnything()
+        conn.listDefinedDomains = lambda: []
 
         driver.list_instance_ids().AndReturn([1, 2])
         conn.lookupByID(1).AndReturn(DiagFakeDomain(None))
@@ -6398,10 +6572,17 @@ class LibvirtConnTestCase(test.TestCase):
             def vcpus(self):
                 return None
 
+            def name(self):
+                return 'fake'
+
+            def XMLDesc(self, flags):
+                return '<domain/>'
+
         driver = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
         conn = driver._conn
         self.mox.StubOutWithMock(driver, 'list_instance_ids')
         conn.lookupByID = self.mox.CreateMockAnything()
+        conn.listDefinedDomains = lambda: []
 
         driver.list_instance_ids().AndReturn([1])
         conn.lookupByID(1).AndReturn(DiagFakeDomain())
@@ -7331,13 +7512,16 @@ class HostStateTestCase(test.TestCase):
         def get_vcpu_total(self):
             return 1
 
-        def get_vcpu_used(self):
+        def _get_domains_usage(self):
+            return []
+
+        def get_vcpu_used(self, domains=None):
             return 0
 
         def get_cpu_info(self):
             return HostStateTestCase.cpu_info
 
-        def get_disk_over_committed_size_total(self):
+        def get_disk_over_committed_size_total(self, domains=None):
             return 0
 
         def get_local_gb_info(self):
@@ -7346,7 +7530,7 @@ class HostStateTestCase(test.TestCase):
         def get_memory_mb_total(self):
             return 497
 
-        def get_memory_mb_used(self):
+        def get_memory_mb_used(self, domains=None):
             return 88
 
         def get_hypervisor_type(self):
@@ -7438,6 +7622,15 @@ class IptablesFirewallTestCase(test.TestCase):
                       fake.FakeVirtAPI(),
                       get_connection=lambda: self.fake_libvirt_connection)
 
+        # The firewall shares linux_net.iptables_manager, which must save
+        # and restore all the fake rules of each test.
+        self._clear_applied_rules()
+        self.addCleanup(self._clear_applied_rules)
+
+    def _clear_applied_rules(self):
+        linux_net.iptables_manager.applied_rules.clear()
+        linux_net.iptables_manager.fully_applied_at.clear()
+
     in_rules = [
       '# Generated by iptables-save v1.4.10 on Sat Feb 19 00:03:19 2011',
       '*nat',
@@ -7717,6 +7910,75 @@ class IptablesFirewallTestCase(test.TestCase):
                                                    any_order=True)
             self.assertEqual(0, mock_filter.add_chain.call_count)
 
+    def _test_instance_rules_ipset(self, member_ips):
+        instance = fake_instance.fake_instance_obj(self.context, id=1)
+        grantee_group = mock.Mock(id=2)
+        rule = {'cidr': None, 'protocol': 'tcp', 'from_port': 22,
+                'to_port': 22, 'grantee_group': grantee_group}
+        with contextlib.nested(
+            mock.patch.object(security_group_obj.SecurityGroupList,
+                              'get_by_instance',
+                              return_value=[mock.Mock(id=1)]),
+            mock.patch.object(security_group_rule_obj.SecurityGroupRuleList,
+                              'get_by_security_group', return_value=[rule]),
+            mock.patch.object(self.fw, '_get_security_group_member_ips',
+                              return_value=member_ips),
+        ):
+            return self.fw.instance_rules(instance, [])
+
+    def test_instance_rules_ipset(self):
+        self.flags(security_group_use_ipset=True)
+        with mock.patch.object(self.fw.iptables, 'execute',
+                               return_value=('', '')) as execute:
+            ipv4_rules, ipv6_rules = self._test_instance_rules_ipset(
+                    ['10.0.0.1', '10.0.0.2'])
+            self.assertIn('-j ACCEPT -p tcp --dport 22 '
+                          '-m set --match-set nova-sg-2-v4 src', ipv4_rules)
+            self.assertNotIn('10.0.0.1', ' '.join(ipv4_rules))
+            execute.assert_has_calls([
+                mock.call('ipset', 'create', '-exist', 'nova-sg-2-v4',
+                          'hash:ip', 'family', 'inet', run_as_root=True),
+                mock.call('ipset', 'list', 'nova-sg-2-v4', run_as_root=True),
+                mock.call('ipset', 'add', '-exist', 'nova-sg-2-v4',
+                          '10.0.0.1', run_as_root=True),
+                mock.call('ipset', 'add', '-exist', 'nova-sg-2-v4',
+                          '10.0.0.2', run_as_root=True)])
+
+            # A membership change only updates the ipset
+            execute.reset_mock()
+            with contextlib.nested(
+                mock.patch.object(self.fw, '_get_security_group_member_ips',
+                                  return_value=['10.0.0.2', '10.0.0.3']),
+                mock.patch.object(self.fw, 'do_refresh_security_group_rules'),
+            ) as (get_member_ips, do_refresh_security_group_rules):
+                self.fw.refresh_security_group_members(2)
+                self.assertFalse(do_refresh_security_group_rules.called)
+            self.assertEqual(
+                [mock.call('ipset', 'add', '-exist', 'nova-sg-2-v4',
+                           '10.0.0.3', run_as_root=True),
+                 mock.call('ipset', 'del', '-exist', 'nova-sg-2-v4',
+                           '10.0.0.1', run_as_root=True)],
+                execute.call_args_list)
+
+    def test_instance_rules_without_ipset(self):
+        ipv4_rules, ipv6_rules = self._test_instance_rules_ipset(
+                ['10.0.0.1', '10.0.0.2'])
+        self.assertIn('-j ACCEPT -p tcp --dport 22 -s 10.0.0.1', ipv4_rules)
+        self.assertIn('-j ACCEPT -p tcp --dport 22 -s 10.0.0.2', ipv4_rules)
+
+    def test_do_refresh_instance_rules_unchanged(self):
+        instance = {'id': 1, 'uuid': 'fake-uuid1'}
+        rules = (['-j ACCEPT'], [])
+        self.fw.instance_info[1] = (instance, [])
+        self.fw.iptables.ipv4['filter'].add_chain('inst-1')
+        self.fw.instance_rules_applied[1] = rules
+        with contextlib.nested(
+            mock.patch.object(self.fw, 'instance_rules', return_value=rules),
+            mock.patch.object(self.fw, 'remove_filters_for_instance'),
+        ) as (instance_rules, remove_filters_for_instance):
+            self.fw.do_refresh_instance_rules(instance)
+            self.assertFalse(remove_filters_for_instance.called)
+
     def test_unfilter_instance_undefines_nwfilter(self):
         admin_ctxt = context.get_admin_context()
 
@@ -8253,7 +8515,7 @@ disk size: 4.4M''', ''))
         user_id = 'fake'
         project_id = 'fake'
         images.fetch_to_raw(context, image_id, target, user_id, project_id,
-                            max_size=0)
+                            max_size=0, fetch_func=imagepeer.fetch)
 
         self.mox.ReplayAll()
         libvirt_utils.fetch_image(context, target, image_id,
@@ -12,8 +12,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+import os
+import stat
+
+import fixtures
+import mock
 
 from nova import test
+from nova import utils
 from nova.virt import images
 
 
@@ -22,3 +29,100 @@ class QemuTestCase(test.NoDBTestCase):
         image_info = images.qemu_img_info("/path/that/does/not/exist")
         self.assertTrue(image_info)
         self.assertTrue(str(image_info))
+
+
+class QemuImgInfoCacheTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(QemuImgInfoCacheTestCase, self).setUp()
+        self.flags(qemu_img_info_cache_size=2)
+        images._qemu_img_info_cache.clear()
+        self.addCleanup(images._qemu_img_info_cache.clear)
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.paths = []
+        for name in ('a', 'b', 'c'):
+            path = os.path.join(self.tmpdir, name)
+            with open(path, 'w') as f:
+                f.write(name)
+            self.paths.append(path)
+
+    def _fake_execute(self, *cmd, **kwargs):
+        return 'virtual size: 1K (%d bytes)\n' % os.path.getsize(cmd[-1]), ''
+
+    def test_qemu_img_info_cached(self):
+        with mock.patch.object(utils, 'execute',
+                               side_effect=self._fake_execute) as execute:
+            images.qemu_img_info(self.paths[0])
+            self.assertEqual(1, images.qemu_img_info(
+                    self.paths[0]).virtual_size)
+            self.assertEqual(1, execute.call_count)
+
+            with open(self.paths[0], 'a') as f:
+                f.write('more')
+            self.assertEqual(5, images.qemu_img_info(
+                    self.paths[0]).virtual_size)
+            self.assertEqual(2, execute.call_count)
+
+    def test_qemu_img_info_cache_disabled(self):
+        self.flags(qemu_img_info_cache_size=0)
+        with mock.patch.object(utils, 'execute',
+                               side_effect=self._fake_execute) as execute:
+            images.qemu_img_info(self.paths[0])
+            images.qemu_img_info(self.paths[0])
+            self.assertEqual(2, execute.call_count)
+
+    def test_qemu_img_info_cache_eviction(self):
+        with mock.patch.object(utils, 'execute',
+                               side_effect=self._fake_execute) as execute:
+            images.qemu_img_info(self.paths[0])
+            images.qemu_img_info(self.paths[1])
+            images.qemu_img_info(self.paths[0])
+            images.qemu_img_info(self.paths[2])
+            self.assertEqual(3, execute.call_count)
+
+            # The least recently used file was dropped
+            images.qemu_img_info(self.paths[0])
+            self.assertEqual(3, execute.call_count)
+            images.qemu_img_info(self.paths[1])
+            self.assertEqual(4, execute.call_count)
+
+    def test_qemu_img_info_cache_persisted(self):
+        cache_path = os.path.join(self.tmpdir, 'qemu-img-info')
+        self.flags(qemu_img_info_cache_path=cache_path)
+        base_dir = os.path.join(self.tmpdir, '_base')
+        os.mkdir(base_dir)
+        base_path = os.path.join(base_dir, 'base')
+        with open(base_path, 'w') as f:
+            f.write('base')
+        with mock.patch.object(utils, 'execute',
+                               side_effect=self._fake_execute) as execute:
+            images.qemu_img_info(base_path)
+            images.qemu_img_info(self.paths[0])
+            images._qemu_img_info_cache.clear()
+            self.assertEqual(4, images.qemu_img_info(base_path).virtual_size)
+            self.assertEqual(2, execute.call_count)
+
+            # The disks of instances are not persisted
+            images.qemu_img_info(self.paths[0])
+            self.assertEqual(3, execute.call_count)
+
+    def test_qemu_img_info_cache_not_saved_for_disks(self):
+        cache_path = os.path.join(self.tmpdir, 'qemu-img-info')
+        self.flags(qemu_img_info_cache_path=cache_path)
+        with mock.patch.object(utils, 'execute',
+                               side_effect=self._fake_execute):
+            images.qemu_img_info(self.paths[0])
+        self.assertFalse(os.path.exists(cache_path))
+
+    def test_qemu_img_info_block_device_not_cached(self):
+        st = os.stat(self.paths[0])
+        block_st = mock.Mock(st_ino=st.st_ino, st_size=st.st_size,
+                             st_mtime=st.st_mtime, st_mode=stat.S_IFBLK)
+        with contextlib.nested(
+                mock.patch.object(os, 'stat', return_value=block_st),
+                mock.patch.object(utils, 'execute',
+                                  side_effect=self._fake_execute)
+                ) as (_stat, execute):
+            images.qemu_img_info(self.paths[0])
+            images.qemu_img_info(self.paths[0])
+            self.assertEqual(2, execute.call_count)
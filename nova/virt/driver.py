@@ -137,6 +137,7 @@ class ComputeDriver(object):
     capabilities = {
         "has_imagecache": False,
         "supports_recreate": False,
+        "emits_lifecycle_events": False,
         }
 
     def __init__(self, virtapi):
@@ -172,6 +173,17 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_power_states(self):
+        """Return the power states of all the instances on the host.
+
+        Drivers which can get the power states of all their instances at
+        once should implement this, to spare the compute manager one
+        get_info call per instance when it syncs the power states.
+
+        :returns: dict of power_state codes, keyed by instance uuid
+        """
+        raise NotImplementedError()
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
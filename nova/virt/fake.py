@@ -72,9 +72,10 @@ def restore_nodes():
 
 class FakeInstance(object):
 
-    def __init__(self, name, state):
+    def __init__(self, name, state, uuid=None):
         self.name = name
         self.state = state
+        self.uuid = uuid
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -128,7 +129,7 @@ class FakeDriver(driver.ComputeDriver):
               admin_password, network_info=None, block_device_info=None):
         name = instance['name']
         state = power_state.RUNNING
-        fake_instance = FakeInstance(name, state)
+        fake_instance = FakeInstance(name, state, instance['uuid'])
         self.instances[name] = fake_instance
 
     def snapshot(self, context, instance, name, update_task_state):
@@ -265,6 +266,9 @@ class FakeDriver(driver.ComputeDriver):
                 'num_cpu': 2,
                 'cpu_time': 0}
 
+    def get_power_states(self):
+        return dict((i.uuid, i.state) for i in self.instances.values())
+
     def get_diagnostics(self, instance_name):
         return {'cpu0_time': 17300000000,
                 'memory': 524288,
@@ -38,6 +38,12 @@ firewall_opts = [
     cfg.BoolOpt('allow_same_net_traffic',
                 default=True,
                 help='Whether to allow network traffic from same network'),
+    cfg.BoolOpt('security_group_use_ipset',
+                default=False,
+                help='Whether the iptables firewall driver matches the '
+                     'members of the security groups granted access with '
+                     'one ipset per group, instead of one rule per member. '
+                     'Not supported in XenServer dom0'),
 ]
 
 CONF = cfg.CONF
@@ -139,10 +145,17 @@ class FirewallDriver(object):
 class IptablesFirewallDriver(FirewallDriver):
     """Driver which enforces security groups through iptables rules."""
 
+    # Whether ipset can be run where the iptables rules are applied.
+    supports_ipset = True
+
     def __init__(self, virtapi, **kwargs):
         super(IptablesFirewallDriver, self).__init__(virtapi)
         self.iptables = linux_net.iptables_manager
         self.instance_info = {}
+        # { instance id : (ipv4 rules, ipv6 rules) of its chain }
+        self.instance_rules_applied = {}
+        # { ipset name : set of the member ips it contains }
+        self.ipsets = {}
         self.basically_filtered = False
 
         # Flags for DHCP request rule
@@ -246,9 +259,12 @@ class IptablesFirewallDriver(FirewallDriver):
                                                             network_info)
         self._add_filters('local', ipv4_rules, ipv6_rules)
         self._add_filters(chain_name, inst_ipv4_rules, inst_ipv6_rules)
+        self.instance_rules_applied[instance['id']] = (inst_ipv4_rules,
+                                                       inst_ipv6_rules)
 
     def remove_filters_for_instance(self, instance):
         chain_name = self._instance_chain_name(instance)
+        self.instance_rules_applied.pop(instance['id'], None)
 
         self.iptables.ipv4['filter'].remove_chain(chain_name)
         if CONF.use_ipv6:
@@ -327,6 +343,67 @@ class IptablesFirewallDriver(FirewallDriver):
                     '--dports', '%s:%s' % (rule['from_port'],
                                            rule['to_port'])]
 
+    def _use_ipset(self):
+        return CONF.security_group_use_ipset and self.supports_ipset
+
+    @staticmethod
+    def _ipset_name(security_group_id, version):
+        return 'nova-sg-%s-v%d' % (security_group_id, version)
+
+    def _get_security_group_member_ips(self, ctxt, security_group_id,
+                                       version):
+        ips = []
+        instances = instance_obj.InstanceList.get_by_security_group_id(
+            ctxt, security_group_id)
+        for instance in instances:
+            if instance['info_cache']['deleted']:
+                LOG.debug('ignoring deleted cache')
+                continue
+            nw_info = compute_utils.get_nw_info_for_instance(instance)
+            ips += [ip['address'] for ip in nw_info.fixed_ips()
+                    if ip['version'] == version]
+        return ips
+
+    def _get_ipset_ips(self, name):
+        out, _err = self.iptables.execute('ipset', 'list', name,
+                                          run_as_root=True)
+        lines = out.split('\n')
+        if 'Members:' not in lines:
+            return set()
+        return set(line.strip()
+                   for line in lines[lines.index('Members:') + 1:]
+                   if line.strip())
+
+    def _update_ipset(self, name, version, ips):
+        """Make an ipset contain the given ips, adding and deleting only
+        the members which changed since it was last updated.
+        """
+        ips = set(ips)
+        current_ips = self.ipsets.get(name)
+        if current_ips is None:
+            family = 'inet6' if version == 6 else 'inet'
+            self.iptables.execute('ipset', 'create', '-exist', name,
+                                  'hash:ip', 'family', family,
+                                  run_as_root=True)
+            current_ips = self._get_ipset_ips(name)
+        for ip in sorted(ips - current_ips):
+            self.iptables.execute('ipset', 'add', '-exist', name, ip,
+                                  run_as_root=True)
+        for ip in sorted(current_ips - ips):
+            self.iptables.execute('ipset', 'del', '-exist', name, ip,
+                                  run_as_root=True)
+        self.ipsets[name] = ips
+
+    def _refresh_ipsets(self, security_group_id):
+        """Update the ipsets of the members of a security group."""
+        ctxt = context.get_admin_context()
+        for version in (4, 6):
+            name = self._ipset_name(security_group_id, version)
+            if name in self.ipsets:
+                self._update_ipset(name, version,
+                                   self._get_security_group_member_ips(
+                                       ctxt, security_group_id, version))
+
     def instance_rules(self, instance, network_info):
         ctxt = context.get_admin_context()
         if isinstance(instance, dict):
@@ -396,26 +473,20 @@ class IptablesFirewallDriver(FirewallDriver):
                     LOG.debug('Using cidr %r', rule['cidr'], instance=instance)
                     args += ['-s', str(rule['cidr'])]
                     fw_rules += [' '.join(args)]
-                else:
-                    if rule['grantee_group']:
-                        insts = (
-                            instance_obj.InstanceList.get_by_security_group(
-                                ctxt, rule['grantee_group']))
-                        for instance in insts:
-                            if instance['info_cache']['deleted']:
-                                LOG.debug('ignoring deleted cache')
-                                continue
-                            nw_info = compute_utils.get_nw_info_for_instance(
-                                    instance)
-
-                            ips = [ip['address']
-                                for ip in nw_info.fixed_ips()
-                                    if ip['version'] == version]
-
-                            LOG.debug('ips: %r', ips, instance=instance)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
+                elif rule['grantee_group']:
+                    grantee_id = rule['grantee_group'].id
+                    ips = self._get_security_group_member_ips(
+                        ctxt, grantee_id, version)
+                    LOG.debug('ips: %r', ips, instance=instance)
+                    if self._use_ipset():
+                        name = self._ipset_name(grantee_id, version)
+                        self._update_ipset(name, version, ips)
+                        subrule = args + ['-m set --match-set %s src' % name]
+                        fw_rules += [' '.join(subrule)]
+                    else:
+                        for ip in ips:
+                            subrule = args + ['-s %s' % ip]
+                            fw_rules += [' '.join(subrule)]
 
                 LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
 
@@ -428,6 +499,10 @@ class IptablesFirewallDriver(FirewallDriver):
         pass
 
     def refresh_security_group_members(self, security_group):
+        if self._use_ipset():
+            # NOTE: The rules only refer to the ipset of the group.
+            self._refresh_ipsets(security_group)
+            return
         self.do_refresh_security_group_rules(security_group)
         self.iptables.apply()
 
@@ -449,6 +524,11 @@ class IptablesFirewallDriver(FirewallDriver):
                     'skipping') % chain_name,
                 instance=instance)
             return
+        if (self.instance_rules_applied.get(instance['id']) ==
+                (ipv4_rules, ipv6_rules)):
+            LOG.debug(_('instance chain %s is up to date'), chain_name,
+                      instance=instance)
+            return
         self.remove_filters_for_instance(instance)
         self.add_filters_for_instance(instance, network_info, ipv4_rules,
                                       ipv6_rules)
@@ -19,7 +19,9 @@
 Handling of VM disk images.
 """
 
+import collections
 import os
+import stat
 
 from oslo.config import cfg
 
@@ -28,6 +30,7 @@ from nova.image import glance
 from nova.openstack.common import fileutils
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import imageutils
+from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova import utils
 
@@ -37,10 +40,124 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format'),
+    cfg.IntOpt('qemu_img_info_cache_size',
+               default=1000,
+               help='Number of files whose qemu-img info output is kept '
+                    'until their inode, size or modification time change. '
+                    'Set to 0 to run qemu-img info on every call'),
+    cfg.StrOpt('qemu_img_info_cache_path',
+               help='File in which the cached qemu-img info outputs of the '
+                    'images of the image cache directory are persisted '
+                    'across restarts, for example next to that directory. '
+                    'They are only kept in memory if not set'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_opts)
+CONF.import_opt('image_cache_subdirectory_name', 'nova.virt.imagecache')
+
+
+class _QemuImgInfoCache(object):
+    """Output of qemu-img info for the files it was run on, reused as long
+    as the inode, size and modification time of a file stay the same.
+
+    Only regular files are cached. The least recently used files beyond
+    qemu_img_info_cache_size are dropped. The outputs of the images of the
+    image cache directory, which do not change, are saved to
+    qemu_img_info_cache_path, if set, whenever one of them is added. The
+    disks of instances change all the time, so they are only kept in
+    memory.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # { path : (inode, size, mtime, output) }, least recently used first
+        self._outputs = collections.OrderedDict()
+        self._loaded = False
+
+    @staticmethod
+    def _identity(path):
+        # Block devices such as LVM volumes keep their inode, size and
+        # modification time while being written to, so only regular files
+        # are cached.
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def _load(self):
+        self._loaded = True
+        cache_path = CONF.qemu_img_info_cache_path
+        if not cache_path or not os.path.exists(cache_path):
+            return
+        try:
+            with open(cache_path) as f:
+                outputs = jsonutils.loads(f.read())
+            for path, entry in outputs:
+                self._outputs[path] = tuple(entry)
+        except (IOError, ValueError, TypeError) as e:
+            LOG.warn(_('Ignoring the qemu-img info cache %(cache_path)s: '
+                       '%(error)s'), {'cache_path': cache_path, 'error': e})
+            self._outputs.clear()
+
+    @staticmethod
+    def _is_cached_image(path):
+        return (os.path.basename(os.path.dirname(path)) ==
+                CONF.image_cache_subdirectory_name)
+
+    def _save(self):
+        cache_path = CONF.qemu_img_info_cache_path
+        if not cache_path:
+            return
+        outputs = [(path, entry) for path, entry in self._outputs.iteritems()
+                   if self._is_cached_image(path)]
+        tmp_path = '%s.tmp' % cache_path
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(jsonutils.dumps(outputs))
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            LOG.warn(_('Failed to save the qemu-img info cache '
+                       '%(cache_path)s: %(error)s'),
+                     {'cache_path': cache_path, 'error': e})
+
+    def get(self, path):
+        """Return the output of qemu-img info for a file, running it only if
+        the file changed since it was last run.
+        """
+        size = CONF.qemu_img_info_cache_size
+        identity = self._identity(path) if size > 0 else None
+        if identity is None:
+            return _execute_qemu_img_info(path)
+        if not self._loaded:
+            self._load()
+
+        entry = self._outputs.pop(path, None)
+        if entry is not None and entry[:3] == identity:
+            self._outputs[path] = entry
+            return entry[3]
+
+        out = _execute_qemu_img_info(path)
+        self._outputs[path] = identity + (out,)
+        while len(self._outputs) > size:
+            self._outputs.popitem(last=False)
+        if self._is_cached_image(path):
+            self._save()
+        return out
+
+
+_qemu_img_info_cache = _QemuImgInfoCache()
+
+
+def _execute_qemu_img_info(path):
+    out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
+                             'qemu-img', 'info', path)
+    return out
 
 
 def qemu_img_info(path):
@@ -50,9 +167,7 @@ def qemu_img_info(path):
     if not os.path.exists(path) and CONF.libvirt.images_type != 'rbd':
         return imageutils.QemuImgInfo()
 
-    out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
-                             'qemu-img', 'info', path)
-    return imageutils.QemuImgInfo(out)
+    return imageutils.QemuImgInfo(_qemu_img_info_cache.get(path))
 
 
 def convert_image(source, dest, out_format, run_as_root=False):
@@ -72,10 +187,16 @@ def fetch(context, image_href, path, _user_id, _project_id, max_size=0):
         image_service.download(context, image_id, dst_path=path)
 
 
-def fetch_to_raw(context, image_href, path, user_id, project_id, max_size=0):
+def fetch_to_raw(context, image_href, path, user_id, project_id, max_size=0,
+                 fetch_func=None):
+    """Fetch an image and convert it to raw if needed.
+
+    fetch_func, which takes the same arguments as fetch, may be given to
+    get the image from somewhere else than the image service.
+    """
     path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, user_id, project_id,
-          max_size=max_size)
+    (fetch_func or fetch)(context, image_href, path_tmp, user_id, project_id,
+                          max_size=max_size)
 
     with fileutils.remove_path_on_error(path_tmp):
         data = qemu_img_info(path_tmp)
@@ -1252,11 +1252,16 @@ class LibvirtConfigGuest(LibvirtConfigObject):
         return root
 
     def parse_dom(self, xmldoc):
-        # Note: This cover only for: LibvirtConfigGuestDisks
+        # Note: This cover only for: uuid, name
+        #                            LibvirtConfigGuestDisks
         #                            LibvirtConfigGuestHostdevPCI
         #                            LibvirtConfigGuestCPU
         for c in xmldoc.getchildren():
-            if c.tag == 'devices':
+            if c.tag == 'uuid':
+                self.uuid = c.text
+            elif c.tag == 'name':
+                self.name = c.text
+            elif c.tag == 'devices':
                 for d in c.getchildren():
                     if d.tag == 'disk':
                         obj = LibvirtConfigGuestDisk()
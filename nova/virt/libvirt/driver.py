@@ -102,6 +102,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import firewall as libvirt_firewall
 from nova.virt.libvirt import imagebackend
 from nova.virt.libvirt import imagecache
+from nova.virt.libvirt import imagepeer
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt import netutils
 from nova.virt import watchdog_actions
@@ -329,6 +330,19 @@ LIBVIRT_POWER_STATE = {
     VIR_DOMAIN_PMSUSPENDED: power_state.SUSPENDED,
 }
 
+VIR_CONNECT_LIST_DOMAINS_RUNNING = 16
+VIR_CONNECT_LIST_DOMAINS_PAUSED = 32
+VIR_CONNECT_LIST_DOMAINS_SHUTOFF = 64
+VIR_CONNECT_LIST_DOMAINS_OTHER = 128
+
+# The domain states that listAllDomains can filter on, other than
+# VIR_CONNECT_LIST_DOMAINS_OTHER which covers all the remaining ones.
+LIST_DOMAINS_STATES = [
+    (VIR_CONNECT_LIST_DOMAINS_RUNNING, VIR_DOMAIN_RUNNING),
+    (VIR_CONNECT_LIST_DOMAINS_PAUSED, VIR_DOMAIN_PAUSED),
+    (VIR_CONNECT_LIST_DOMAINS_SHUTOFF, VIR_DOMAIN_SHUTOFF),
+]
+
 MIN_LIBVIRT_VERSION = (0, 9, 6)
 # When the above version matches/exceeds this version
 # delete it & corresponding code using it
@@ -354,6 +368,7 @@ class LibvirtDriver(driver.ComputeDriver):
     capabilities = {
         "has_imagecache": True,
         "supports_recreate": True,
+        "emits_lifecycle_events": True,
         }
 
     def __init__(self, virtapi, read_only=False):
@@ -371,6 +386,10 @@ class LibvirtDriver(driver.ComputeDriver):
         self._wrapped_conn_lock = threading.Lock()
         self._caps = None
         self._vcpu_total = 0
+        # { domain id : (domain XML, number of vcpus) }
+        self._domain_vcpus = {}
+        # { domain name : (domain XML, LibvirtConfigGuest) }
+        self._domain_configs = {}
         self.read_only = read_only
         self.firewall_driver = firewall.load_driver(
             DEFAULT_FIREWALL_DRIVER,
@@ -564,6 +583,7 @@ class LibvirtDriver(driver.ComputeDriver):
             try:
                 event = self._event_queue.get(block=False)
                 if isinstance(event, virtevent.LifecycleEvent):
+                    self._invalidate_domain_caches(event.get_instance_uuid())
                     self.emit_event(event)
                 elif 'conn' in event and 'reason' in event:
                     last_close_event = event
@@ -584,6 +604,12 @@ class LibvirtDriver(driver.ComputeDriver):
                 # new instances of being scheduled on this host.
                 self._set_host_enabled(False, disable_reason=_error)
 
+    def _invalidate_domain_caches(self, uuid):
+        """Forget the cached config of a domain."""
+        for name, (xml, guest) in self._domain_configs.items():
+            if guest.uuid == uuid:
+                del self._domain_configs[name]
+
     def _init_events_pipe(self):
         """Create a self-pipe for the native thread to synchronize on.
 
@@ -666,6 +692,9 @@ class LibvirtDriver(driver.ComputeDriver):
 
         self._init_events()
 
+        if imagepeer.is_enabled():
+            self._image_peer_server = imagepeer.start_server()
+
     def _get_new_connection(self):
         # call with _wrapped_conn_lock held
         LOG.debug(_('Connecting to libvirt: %s'), self.uri())
@@ -854,6 +883,67 @@ class LibvirtDriver(driver.ComputeDriver):
 
         return list(uuids)
 
+    def _list_all_domains(self, flags=0):
+        """Return the running and the defined domains.
+
+        The flags are only honoured when listAllDomains is available.
+        """
+        list_all_domains = getattr(self._conn, 'listAllDomains', None)
+        if list_all_domains is not None:
+            # We skip domains with ID 0 (hypervisors).
+            return [domain for domain in list_all_domains(flags)
+                    if domain.ID() != 0]
+
+        # NOTE: listAllDomains needs libvirt 0.9.13 or later.
+        domains = []
+        for domain_id in self.list_instance_ids():
+            try:
+                # We skip domains with ID 0 (hypervisors).
+                if domain_id != 0:
+                    domains.append(self._lookup_by_id(domain_id))
+            except exception.InstanceNotFound:
+                # Ignore deleted instance while listing
+                continue
+
+        for domain_name in self._conn.listDefinedDomains():
+            try:
+                domains.append(self._lookup_by_name(domain_name))
+            except exception.InstanceNotFound:
+                # Ignore deleted instance while listing
+                continue
+
+        return domains
+
+    def get_power_states(self):
+        """Efficient override of base get_power_states method.
+
+        With listAllDomains, domains are listed once per common state so
+        that only the domains in none of those states need a call to info().
+        """
+        if getattr(self._conn, 'listAllDomains', None) is None:
+            return self._get_domain_power_states(self._list_all_domains())
+
+        power_states = {}
+        for flags, state in LIST_DOMAINS_STATES:
+            for domain in self._list_all_domains(flags):
+                power_states[domain.UUIDString()] = LIBVIRT_POWER_STATE[state]
+        power_states.update(self._get_domain_power_states(
+                self._list_all_domains(VIR_CONNECT_LIST_DOMAINS_OTHER)))
+        return power_states
+
+    def _get_domain_power_states(self, domains):
+        power_states = {}
+        for domain in domains:
+            try:
+                state = LIBVIRT_POWER_STATE[domain.info()[0]]
+            except libvirt.libvirtError as ex:
+                # Ignore deleted instance while listing
+                if ex.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                    continue
+                raise
+            power_states[domain.UUIDString()] = state
+        return power_states
+
     def plug_vifs(self, instance, network_info):
         """Plug VIFs into networks."""
         for vif in network_info:
@@ -3845,41 +3935,121 @@ class LibvirtDriver(driver.ComputeDriver):
 
         return info
 
-    def get_vcpu_used(self):
-        """Get vcpu usage number of physical computer.
+    def _get_domain_vcpus(self, dom, dom_id, xml):
+        """Return the number of vcpus of a running domain.
 
-        :returns: The total number of vcpu(s) that are currently being used.
+        The number is cached until the XML of the domain changes, and is
+        None if libvirt could not tell it.
+        """
+        cached = self._domain_vcpus.get(dom_id)
+        if cached is not None and cached[0] == xml:
+            return cached[1]
 
+        try:
+            vcpus = dom.vcpus()
+        except libvirt.libvirtError as e:
+            LOG.warn(_("couldn't obtain the vpu count from domain id:"
+                       " %(id)s, exception: %(ex)s") %
+                       {"id": dom_id, "ex": e})
+            return None
+        if vcpus is None or len(vcpus) < 2:
+            return None
+        self._domain_vcpus[dom_id] = (xml, len(vcpus[1]))
+        return len(vcpus[1])
+
+    def _get_domain_usage(self, dom, dom_id):
+        """Return the resources used by a domain, dom_id being None for the
+        domains which are not running.
         """
+        name = dom.name()
+        xml = dom.XMLDesc(0)
+        usage = {'id': dom_id, 'name': name, 'vcpus': 0, 'memory_kb': 0,
+                 'disk_info': []}
+        if dom_id is not None:
+            if CONF.libvirt.virt_type != 'lxc':
+                usage['vcpus'] = self._get_domain_vcpus(dom, dom_id, xml) or 0
+            if CONF.libvirt.virt_type == 'xen':
+                usage['memory_kb'] = int(dom.info()[2])
+
+        # We skip domains with ID 0 (hypervisors).
+        if dom_id != 0:
+            try:
+                usage['disk_info'] = jsonutils.loads(
+                        self.get_instance_disk_info(name, xml=xml))
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    LOG.warning(_('Periodic task is updating the host stat, '
+                                  'it is trying to get disk %(i_name)s, '
+                                  'but disk file was removed by concurrent '
+                                  'operations such as resize.'),
+                                {'i_name': name})
+                else:
+                    raise
+        return usage
 
-        total = 0
-        if CONF.libvirt.virt_type == 'lxc':
-            return total + 1
+    def _get_domains_usage(self):
+        """Return the resources used by every domain of the host.
+
+        Each domain is looked up and described once, for the vcpus, memory
+        and disks it uses to be collected in a single pass.
 
+        :returns: a list of dicts with the 'id', 'name', 'vcpus',
+                  'memory_kb' and 'disk_info' of each domain
+        """
+        domains = []
         dom_ids = self.list_instance_ids()
         for dom_id in dom_ids:
             try:
                 dom = self._lookup_by_id(dom_id)
-                try:
-                    vcpus = dom.vcpus()
-                except libvirt.libvirtError as e:
-                    LOG.warn(_("couldn't obtain the vpu count from domain id:"
-                               " %(id)s, exception: %(ex)s") %
-                               {"id": dom_id, "ex": e})
-                else:
-                    if vcpus is not None and len(vcpus) > 1:
-                        total += len(vcpus[1])
-
-            except exception.InstanceNotFound:
+                domains.append(self._get_domain_usage(dom, dom_id))
+            except (exception.InstanceNotFound, libvirt.libvirtError):
                 LOG.info(_("libvirt can't find a domain with id: %s") % dom_id)
-                continue
             # NOTE(gtt116): give change to do other task.
             greenthread.sleep(0)
+
+        names = set(domain['name'] for domain in domains)
+        for name in self._conn.listDefinedDomains():
+            if name in names:
+                continue
+            try:
+                dom = self._lookup_by_name(name)
+                domains.append(self._get_domain_usage(dom, None))
+            except (exception.InstanceNotFound, libvirt.libvirtError):
+                # Instance was deleted during the check so ignore it
+                pass
+            greenthread.sleep(0)
+
+        for dom_id in set(self._domain_vcpus) - set(dom_ids):
+            del self._domain_vcpus[dom_id]
+        names = set(domain['name'] for domain in domains)
+        for name in set(self._domain_configs) - names:
+            del self._domain_configs[name]
+        return domains
+
+    def get_vcpu_used(self, domains=None):
+        """Get vcpu usage number of physical computer.
+
+        :param domains: Optional; the usage of the domains as returned by
+            _get_domains_usage.
+        :returns: The total number of vcpu(s) that are currently being used.
+
+        """
+
+        total = 0
+        if CONF.libvirt.virt_type == 'lxc':
+            return total + 1
+
+        if domains is None:
+            domains = self._get_domains_usage()
+        for domain in domains:
+            total += domain['vcpus']
         return total
 
-    def get_memory_mb_used(self):
+    def get_memory_mb_used(self, domains=None):
         """Get the free memory size(MB) of physical computer.
 
+        :param domains: Optional; the usage of the domains as returned by
+            _get_domains_usage.
         :returns: the total usage of memory(MB).
 
         """
@@ -3893,13 +4063,13 @@ class LibvirtDriver(driver.ComputeDriver):
         idx3 = m.index('Cached:')
         if CONF.libvirt.virt_type == 'xen':
             used = 0
-            for domain_id in self.list_instance_ids():
-                try:
-                    dom_mem = int(self._lookup_by_id(domain_id).info()[2])
-                except exception.InstanceNotFound:
-                    LOG.info(_("libvirt can't find a domain with id: %s")
-                             % domain_id)
+            if domains is None:
+                domains = self._get_domains_usage()
+            for domain in domains:
+                domain_id = domain['id']
+                if domain_id is None:
                     continue
+                dom_mem = domain['memory_kb']
                 # skip dom0
                 if domain_id != 0:
                     used += dom_mem
@@ -4777,23 +4947,19 @@ class LibvirtDriver(driver.ComputeDriver):
             volume_devices.add(disk_dev)
 
         disk_info = []
-        doc = etree.fromstring(xml)
-        disk_nodes = doc.findall('.//devices/disk')
-        path_nodes = doc.findall('.//devices/disk/source')
-        driver_nodes = doc.findall('.//devices/disk/driver')
-        target_nodes = doc.findall('.//devices/disk/target')
-
-        for cnt, path_node in enumerate(path_nodes):
-            disk_type = disk_nodes[cnt].get('type')
-            path = path_node.get('file')
-            target = target_nodes[cnt].attrib['dev']
+        guest = self._get_domain_config(instance_name, xml)
+        for dev in guest.devices:
+            if not isinstance(dev, vconfig.LibvirtConfigGuestDisk):
+                continue
+            path = dev.source_path
+            target = dev.target_dev
 
             if not path:
                 LOG.debug(_('skipping disk for %s as it does not have a path'),
                           instance_name)
                 continue
 
-            if disk_type != 'file':
+            if dev.source_type != 'file':
                 LOG.debug(_('skipping %s since it looks like volume'), path)
                 continue
 
@@ -4806,7 +4972,7 @@ class LibvirtDriver(driver.ComputeDriver):
             # raise a localized error if image is unavailable
             dk_size = int(os.path.getsize(path))
 
-            disk_type = driver_nodes[cnt].get('type')
+            disk_type = dev.driver_format
             if disk_type == "qcow2":
                 backing_file = libvirt_utils.get_disk_backing_file(path)
                 virt_size = disk.get_disk_size(path)
@@ -4824,32 +4990,35 @@ class LibvirtDriver(driver.ComputeDriver):
                               'over_committed_disk_size': over_commit_size})
         return jsonutils.dumps(disk_info)
 
-    def get_disk_over_committed_size_total(self):
-        """Return total over committed disk size for all instances."""
+    def _get_domain_config(self, name, xml):
+        """Return the LibvirtConfigGuest parsed from the XML of a domain.
+
+        The config is cached until the XML of the domain changes or a
+        lifecycle event is received for the domain.
+        """
+        cached = self._domain_configs.get(name)
+        if cached is not None and cached[0] == xml:
+            return cached[1]
+
+        guest = vconfig.LibvirtConfigGuest()
+        guest.parse_str(xml)
+        self._domain_configs[name] = (xml, guest)
+        return guest
+
+    def get_disk_over_committed_size_total(self, domains=None):
+        """Return total over committed disk size for all instances.
+
+        :param domains: Optional; the usage of the domains as returned by
+            _get_domains_usage.
+        """
         # Disk size that all instance uses : virtual_size - disk_size
-        instances_name = self.list_instances()
+        if domains is None:
+            domains = self._get_domains_usage()
         disk_over_committed_size = 0
-        for i_name in instances_name:
-            try:
-                disk_infos = jsonutils.loads(
-                        self.get_instance_disk_info(i_name))
-                for info in disk_infos:
-                    disk_over_committed_size += int(
-                        info['over_committed_disk_size'])
-            except OSError as e:
-                if e.errno == errno.ENOENT:
-                    LOG.warning(_('Periodic task is updating the host stat, '
-                                  'it is trying to get disk %(i_name)s, '
-                                  'but disk file was removed by concurrent '
-                                  'operations such as resize.'),
-                                {'i_name': i_name})
-                else:
-                    raise
-            except exception.InstanceNotFound:
-                # Instance was deleted during the check so ignore it
-                pass
-            # NOTE(gtt116): give change to do other task.
-            greenthread.sleep(0)
+        for domain in domains:
+            for info in domain['disk_info']:
+                disk_over_committed_size += int(
+                    info['over_committed_disk_size'])
         return disk_over_committed_size
 
     def unfilter_instance(self, instance, network_info):
@@ -5281,13 +5450,14 @@ class HostState(object):
             """
             disk_free_gb = disk_info_dict['free']
             disk_over_committed = (self.driver.
-                    get_disk_over_committed_size_total())
+                    get_disk_over_committed_size_total(domains))
             # Disk available least size
             available_least = disk_free_gb * units.Gi - disk_over_committed
             return (available_least / units.Gi)
 
         LOG.debug(_("Updating host stats"))
         disk_info_dict = self.driver.get_local_gb_info()
+        domains = self.driver._get_domains_usage()
         data = {}
 
         #NOTE(dprince): calling capabilities before getVersion works around
@@ -5300,8 +5470,8 @@ class HostState(object):
         data["vcpus"] = self.driver.get_vcpu_total()
         data["memory_mb"] = self.driver.get_memory_mb_total()
         data["local_gb"] = disk_info_dict['total']
-        data["vcpus_used"] = self.driver.get_vcpu_used()
-        data["memory_mb_used"] = self.driver.get_memory_mb_used()
+        data["vcpus_used"] = self.driver.get_vcpu_used(domains)
+        data["memory_mb_used"] = self.driver.get_memory_mb_used(domains)
         data["local_gb_used"] = disk_info_dict['used']
         data["hypervisor_type"] = self.driver.get_hypervisor_type()
         data["hypervisor_version"] = self.driver.get_hypervisor_version()
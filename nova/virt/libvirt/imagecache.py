@@ -66,6 +66,14 @@ imagecache_opts = [
                default=3600,
                help='How frequently to checksum base images',
                deprecated_group='DEFAULT'),
+    cfg.BoolOpt('checksum_unmodified_base_images',
+                default=False,
+                help='Checksum base images again every '
+                     'checksum_interval_seconds even if their size, inode '
+                     'and modification time did not change since their last '
+                     'checksum. This is only needed to detect a corruption '
+                     'of the storage itself, and reads the whole image '
+                     'cache'),
     ]
 
 CONF = cfg.CONF
@@ -223,6 +231,17 @@ def _hash_file(filename):
     return checksum.hexdigest()
 
 
+def _get_file_stat(filename):
+    """Return the size, inode and modification time of a file, which change
+    when it is replaced or written to.
+
+    Since the modification time is also updated every time the file is
+    found to be in use, the stored stat is refreshed when that happens.
+    """
+    st = os.stat(filename)
+    return [st.st_size, st.st_ino, st.st_mtime]
+
+
 def read_stored_checksum(target, timestamped=True):
     """Read the checksum.
 
@@ -231,9 +250,15 @@ def read_stored_checksum(target, timestamped=True):
     return read_stored_info(target, field='sha1', timestamped=timestamped)
 
 
-def write_stored_checksum(target):
-    """Write a checksum to disk for a file in _base."""
-    write_stored_info(target, field='sha1', value=_hash_file(target))
+def write_stored_checksum(target, checksum=None, stat=None):
+    """Write a checksum to disk for a file in _base, along with the stat of
+    the file it was computed for.
+    """
+    if checksum is None:
+        stat = _get_file_stat(target)
+        checksum = _hash_file(target)
+    write_stored_info(target, field='sha1', value=checksum)
+    write_stored_info(target, field='sha1-stat', value=stat)
 
 
 class ImageCacheManager(imagecache.ImageCacheManager):
@@ -382,6 +407,14 @@ class ImageCacheManager(imagecache.ImageCacheManager):
                         CONF.libvirt.checksum_interval_seconds):
                     return True
 
+                # NOTE: A file which was not replaced or written to since its
+                # checksum was computed does not need to be read again.
+                current_stat = _get_file_stat(base_file)
+                if (not CONF.libvirt.checksum_unmodified_base_images and
+                        read_stored_info(base_file, field='sha1-stat') ==
+                        current_stat):
+                    return True
+
                 # NOTE(mikal): If there is no timestamp, then the checksum was
                 # performed by a previous version of the code.
                 if not stored_timestamp:
@@ -398,6 +431,8 @@ class ImageCacheManager(imagecache.ImageCacheManager):
                     return False
 
                 else:
+                    write_stored_checksum(base_file, checksum=current_checksum,
+                                          stat=current_stat)
                     return True
 
             else:
@@ -519,7 +554,19 @@ class ImageCacheManager(imagecache.ImageCacheManager):
                            'base_file': base_file})
                 if os.path.exists(base_file):
                     virtutils.chown(base_file, os.getuid())
-                    os.utime(base_file, None)
+                    self._touch_base_file(base_file)
+
+    def _touch_base_file(self, base_file):
+        """Update the modification time of a base file in use, along with
+        its stored stat if the file was not modified since its checksum.
+        """
+        unmodified = (CONF.libvirt.checksum_base_images and
+                      read_stored_info(base_file, field='sha1-stat') ==
+                      _get_file_stat(base_file))
+        os.utime(base_file, None)
+        if unmodified:
+            write_stored_info(base_file, field='sha1-stat',
+                              value=_get_file_stat(base_file))
 
     def _age_and_verify_cached_images(self, context, all_instances, base_dir):
         LOG.debug(_('Verify base images'))
@@ -0,0 +1,291 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Distribution of base images between compute nodes.
+
+Each compute node may serve the images of its _base directory to the
+other compute nodes over HTTP. Before downloading an image from glance,
+a compute node asks the nodes which run instances of that image for
+their copy, and only falls back to glance if none of them has it.
+
+Base files are converted to raw when force_raw_images is set, so only raw
+images are fetched from peers then. Only a copy of the same size and
+checksum as the image in glance is accepted, whatever its format.
+
+Requests are signed with image_peer_shared_secret, which must be the
+same on all the compute nodes, and expire after image_peer_signature_ttl
+seconds. The access of the requesting user to the image is checked
+against glance before asking the peers.
+"""
+
+import hashlib
+import hmac
+import os
+import random
+import urllib2
+
+from oslo.config import cfg
+import webob.dec
+import webob.exc
+
+from nova.image import glance
+from nova.objects import instance as instance_obj
+from nova.objects import service as service_obj
+from nova.openstack.common import fileutils
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova import servicegroup
+from nova import utils
+from nova.virt import images
+from nova import wsgi
+
+LOG = logging.getLogger(__name__)
+
+imagepeer_opts = [
+    cfg.StrOpt('image_peer_host',
+               default='0.0.0.0',
+               help='The IP address on which the base images are served to '
+                    'the other compute nodes'),
+    cfg.IntOpt('image_peer_port',
+               default=0,
+               help='Port on which the base images are served to the other '
+                    'compute nodes, which must be able to reach this node '
+                    'by its host name. Set to 0 to neither serve nor fetch '
+                    'images from peers'),
+    cfg.StrOpt('image_peer_shared_secret',
+               default='',
+               secret=True,
+               help='Shared secret used to sign the requests of base images '
+                    'between compute nodes. Images are not shared when it '
+                    'is empty'),
+    cfg.IntOpt('image_peer_signature_ttl',
+               default=60,
+               help='Number of seconds for which a signed request of a base '
+                    'image is accepted. The clocks of the compute nodes '
+                    'must not drift apart by more than that'),
+    cfg.IntOpt('image_peer_max_peers',
+               default=3,
+               help='Maximum number of compute nodes asked for an image '
+                    'before it is downloaded from glance'),
+    cfg.IntOpt('image_peer_timeout',
+               default=30,
+               help='Number of seconds to wait for a compute node serving '
+                    'an image'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(imagepeer_opts, 'libvirt')
+CONF.import_opt('host', 'nova.netconf')
+CONF.import_opt('compute_topic', 'nova.compute.rpcapi')
+CONF.import_opt('instances_path', 'nova.compute.manager')
+CONF.import_opt('image_cache_subdirectory_name', 'nova.virt.imagecache')
+
+_CHUNK_SIZE = 64 * 1024
+_SIGNATURE_HEADER = 'X-Image-Peer-Signature'
+_EXPIRES_HEADER = 'X-Image-Peer-Expires'
+_SIZE_HEADER = 'X-Image-Peer-Size'
+# Maximum number of instances of an image looked at to find peers
+_MAX_PEER_INSTANCES = 100
+
+
+def is_enabled():
+    return bool(CONF.libvirt.image_peer_port and
+                CONF.libvirt.image_peer_shared_secret)
+
+
+def _sign(image_id, size, expires):
+    """Sign the request of an image of the given size, which is valid until
+    the expires timestamp.
+    """
+    data = '%s:%d:%d' % (image_id, size, expires)
+    return hmac.new(CONF.libvirt.image_peer_shared_secret, data,
+                    hashlib.sha256).hexdigest()
+
+
+def _get_base_dir():
+    return os.path.join(CONF.instances_path,
+                        CONF.image_cache_subdirectory_name)
+
+
+def _read_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+class ImagePeerApp(object):
+    """Serves the images of the _base directory as /images/<image id>,
+    if they have the size given with the request.
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        parts = req.path_info.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'images' or req.method != 'GET':
+            raise webob.exc.HTTPNotFound()
+        image_id = parts[1]
+
+        try:
+            size = int(req.headers[_SIZE_HEADER])
+            expires = int(req.headers[_EXPIRES_HEADER])
+        except (KeyError, ValueError):
+            raise webob.exc.HTTPBadRequest()
+
+        signature = req.headers.get(_SIGNATURE_HEADER, '')
+        if not utils.constant_time_compare(_sign(image_id, size, expires),
+                                           signature):
+            LOG.warn(_('Invalid signature of the request of image %(image)s '
+                       'from %(remote_address)s'),
+                     {'image': image_id, 'remote_address': req.remote_addr})
+            raise webob.exc.HTTPForbidden()
+        if expires < timeutils.utcnow_ts():
+            LOG.warn(_('Expired signature of the request of image %(image)s '
+                       'from %(remote_address)s'),
+                     {'image': image_id, 'remote_address': req.remote_addr})
+            raise webob.exc.HTTPForbidden()
+
+        # NOTE: The images are named after the SHA1 of their id by
+        # imagecache.get_cache_fname, and only appear under that name once
+        # completely downloaded.
+        path = os.path.join(_get_base_dir(),
+                            hashlib.sha1(image_id).hexdigest())
+        if not os.path.isfile(path):
+            raise webob.exc.HTTPNotFound()
+        # NOTE: A base file converted to raw is not the image in glance.
+        if os.path.getsize(path) != size:
+            LOG.debug(_('Not serving image %(image)s, whose base file was '
+                        'converted'), {'image': image_id})
+            raise webob.exc.HTTPNotFound()
+
+        LOG.debug(_('Serving image %(image)s to %(remote_address)s'),
+                  {'image': image_id, 'remote_address': req.remote_addr})
+        return webob.Response(app_iter=_read_chunks(path),
+                              content_type='application/octet-stream',
+                              content_length=os.path.getsize(path))
+
+
+def start_server():
+    """Start serving the base images to the other compute nodes."""
+    server = wsgi.Server('image-peer', ImagePeerApp(),
+                         host=CONF.libvirt.image_peer_host,
+                         port=CONF.libvirt.image_peer_port)
+    server.start()
+    return server
+
+
+def _get_peers(context, image_id):
+    """Return the hosts running instances of an image, in random order.
+
+    Only the compute nodes which are up are asked, so only their instances
+    are looked at.
+    """
+    context = context.elevated()
+    servicegroup_api = servicegroup.API()
+    services = service_obj.ServiceList.get_by_topic(context,
+                                                    CONF.compute_topic)
+    hosts = [service.host for service in services
+             if service.host != CONF.host and
+             servicegroup_api.service_is_up(service)]
+    if not hosts:
+        return []
+    instances = instance_obj.InstanceList.get_by_filters(
+            context, {'image_ref': image_id, 'deleted': False,
+                      'host': hosts},
+            limit=_MAX_PEER_INSTANCES, expected_attrs=[])
+    hosts = list(set(instance.host for instance in instances))
+    random.shuffle(hosts)
+    return hosts[:CONF.libvirt.image_peer_max_peers]
+
+
+def _fetch_from_peer(host, image_id, size, path):
+    """Fetch an image of the given size from a host, and return its md5
+    checksum.
+    """
+    url = 'http://%s:%d/images/%s' % (host, CONF.libvirt.image_peer_port,
+                                      image_id)
+    expires = timeutils.utcnow_ts() + CONF.libvirt.image_peer_signature_ttl
+    req = urllib2.Request(url, headers={
+            _SIGNATURE_HEADER: _sign(image_id, size, expires),
+            _EXPIRES_HEADER: str(expires),
+            _SIZE_HEADER: str(size)})
+    md5 = hashlib.md5()
+    response = urllib2.urlopen(req, timeout=CONF.libvirt.image_peer_timeout)
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = response.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                f.write(chunk)
+    finally:
+        response.close()
+    return md5.hexdigest()
+
+
+def fetch(context, image_href, path, user_id, project_id, max_size=0):
+    """Fetch an image from a compute node which has it, or from glance.
+
+    Takes the same arguments as images.fetch.
+    """
+    if not is_enabled() or '/' in str(image_href):
+        return images.fetch(context, image_href, path, user_id, project_id,
+                            max_size=max_size)
+
+    # NOTE: Showing the image checks that the user may access it.
+    image_meta = glance.get_default_image_service().show(context,
+                                                         image_href)
+    if not (image_meta.get('checksum') and image_meta.get('size')):
+        LOG.debug(_('Not fetching image %s from peers, as glance has no '
+                    'checksum or size for it'), image_href)
+    elif CONF.force_raw_images and image_meta.get('disk_format') != 'raw':
+        LOG.debug(_('Not fetching image %s from peers, as their base files '
+                    'are converted to raw'), image_href)
+    elif _fetch_from_peers(context, image_href, image_meta, path):
+        return
+
+    images.fetch(context, image_href, path, user_id, project_id,
+                 max_size=max_size)
+
+
+def _fetch_from_peers(context, image_id, image_meta, path):
+    """Fetch an image from the first peer which has a copy matching the
+    checksum of the image in glance. Returns whether one had.
+    """
+    for host in _get_peers(context, image_id):
+        try:
+            with fileutils.remove_path_on_error(path):
+                checksum = _fetch_from_peer(host, image_id,
+                                            image_meta['size'], path)
+                if checksum != image_meta['checksum']:
+                    raise IOError(_('Checksum mismatch'))
+        except urllib2.HTTPError as e:
+            if e.code != 404:
+                LOG.warn(_('Failed to fetch image %(image)s from %(host)s: '
+                           '%(error)s'),
+                         {'image': image_id, 'host': host, 'error': e})
+        except Exception as e:
+            LOG.warn(_('Failed to fetch image %(image)s from %(host)s: '
+                       '%(error)s'),
+                     {'image': image_id, 'host': host, 'error': e})
+        else:
+            LOG.info(_('Fetched image %(image)s from %(host)s'),
+                     {'image': image_id, 'host': host})
+            return True
+    return False
@@ -32,6 +32,7 @@ from nova.openstack.common import processutils
 from nova.openstack.common import units
 from nova import utils
 from nova.virt import images
+from nova.virt.libvirt import imagepeer
 from nova.virt import volumeutils
 
 libvirt_opts = [
@@ -650,7 +651,7 @@ def get_fs_info(path):
 def fetch_image(context, target, image_id, user_id, project_id, max_size=0):
     """Grab image."""
     images.fetch_to_raw(context, image_id, target, user_id, project_id,
-                        max_size=max_size)
+                        max_size=max_size, fetch_func=imagepeer.fetch)
 
 
 def get_instance_path(instance, forceold=False, relative=False):
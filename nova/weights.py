@@ -124,13 +124,23 @@ class BaseWeightHandler(loadables.BaseLoader):
     def get_weighed_objects(self, weigher_classes, obj_list,
             weighing_properties):
         """Return a sorted (descending), normalized list of WeighedObjects."""
+        weighers = [weigher_cls() for weigher_cls in weigher_classes]
+        return self.get_weighed_objects_with_weighers(weighers, obj_list,
+                                                      weighing_properties)
+
+    def get_weighed_objects_with_weighers(self, weighers, obj_list,
+            weighing_properties):
+        """Same as get_weighed_objects(), using weigher instances.
+
+        The weighers keep the minval and maxval found for obj_list, which
+        reweigh_object() uses afterwards.
+        """
 
         if not obj_list:
             return []
 
         weighed_objs = [self.object_class(obj, 0.0) for obj in obj_list]
-        for weigher_cls in weigher_classes:
-            weigher = weigher_cls()
+        for weigher in weighers:
             weights = weigher.weigh_objects(weighed_objs, weighing_properties)
 
             # Normalize the weights
@@ -143,3 +153,29 @@ class BaseWeightHandler(loadables.BaseLoader):
                 obj.weight += weigher.weight_multiplier() * weight
 
         return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)
+
+    def reweigh_object(self, weighers, obj, weighing_properties):
+        """Return a new WeighedObject for a single object.
+
+        The weights are normalized with the minval and maxval the weighers
+        found when weighing a whole list, so that the result can be compared
+        with the weights of that list. None is returned when it can't be,
+        because all the objects of the list had the same weight or the new
+        weight is out of their range, in which case the whole list must be
+        weighed again.
+        """
+        weighed_obj = self.object_class(obj, 0.0)
+        for weigher in weighers:
+            minval, maxval = weigher.minval, weigher.maxval
+            weights = weigher.weigh_objects([weighed_obj], weighing_properties)
+            weigher.minval, weigher.maxval = minval, maxval
+            if minval == maxval or not minval <= weights[0] <= maxval:
+                return None
+
+            # Normalize the weights
+            weights = normalize(weights, minval=minval, maxval=maxval)
+
+            for weight in weights:
+                weighed_obj.weight += weigher.weight_multiplier() * weight
+
+        return weighed_obj
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compare per-host and vectorized evaluation of the core scheduler filters.
+
+Builds synthetic HostStates and runs RamFilter, CoreFilter, DiskFilter,
+NumInstancesFilter and IoOpsFilter through HostFilterHandler, once with
+scheduler_vectorized_filters disabled and once with it enabled.
+
+Usage:
+
+    python tools/scheduler_filter_benchmark.py [--hosts 10000] [--runs 10]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from oslo.config import cfg
+
+from nova.scheduler import filters
+from nova.scheduler.filters import core_filter
+from nova.scheduler.filters import disk_filter
+from nova.scheduler.filters import io_ops_filter
+from nova.scheduler.filters import num_instances_filter
+from nova.scheduler.filters import ram_filter
+from nova.scheduler import host_manager
+
+CONF = cfg.CONF
+
+FILTER_CLASSES = [ram_filter.RamFilter, core_filter.CoreFilter,
+                  disk_filter.DiskFilter,
+                  num_instances_filter.NumInstancesFilter,
+                  io_ops_filter.IoOpsFilter]
+
+FILTER_PROPERTIES = {'instance_type': {'memory_mb': 4096, 'vcpus': 2,
+                                       'root_gb': 40, 'ephemeral_gb': 0,
+                                       'swap': 0}}
+
+
+def make_hosts(count):
+    hosts = []
+    for i in xrange(count):
+        host_state = host_manager.HostState('host%d' % i, 'node%d' % i)
+        host_state.total_usable_ram_mb = 65536
+        host_state.free_ram_mb = random.randint(-16384, 65536)
+        host_state.vcpus_total = 16
+        host_state.vcpus_used = random.randint(0, 260)
+        host_state.total_usable_disk_gb = 1024
+        host_state.free_disk_mb = random.randint(0, 1024) * 1024
+        host_state.num_instances = random.randint(0, 60)
+        host_state.num_io_ops = random.randint(0, 10)
+        hosts.append(host_state)
+    return hosts
+
+
+def run(handler, hosts, runs, vectorized):
+    CONF.set_override('scheduler_vectorized_filters', vectorized)
+    start = time.time()
+    for _i in xrange(runs):
+        result = handler.get_filtered_objects(FILTER_CLASSES, hosts,
+                                              FILTER_PROPERTIES)
+    return result, (time.time() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--hosts', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    if filters.numpy is None:
+        sys.stderr.write("numpy is required for vectorized filtering\n")
+        return 1
+
+    hosts = make_hosts(args.hosts)
+    handler = filters.HostFilterHandler()
+    expected, per_host = run(handler, hosts, args.runs, False)
+    result, vectorized = run(handler, hosts, args.runs, True)
+    if result != expected:
+        sys.stderr.write("Vectorized filters selected different hosts\n")
+        return 1
+
+    print("%d hosts, %d passing, average of %d runs" % (
+            args.hosts, len(result), args.runs))
+    print("per host:   %8.2f ms" % (per_host * 1000))
+    print("vectorized: %8.2f ms (%.1fx)" % (vectorized * 1000,
+                                           per_host / vectorized))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())